@@ -0,0 +1,278 @@
+"""
+check_emails のスループットベンチマーク
+
+生成したメールボックスを読み込んだローカル IMAP サーバー（benchmarks/fake_imap.py）を
+別プロセスで起動し、K 個のキーでチェックを繰り返す。最初の 1 回（全件取得）と、
+以降の新着だけを処理するサイクルについて、メール数/秒、転送バイト数、ラウンドトリップ数
+（サーバーが受けたコマンド数）、サイクル時間の p50 / p99、ピーク RSS を出力し、
+結果を JSON に保存する。--compare で以前の結果との差分を表示する。
+
+    python benchmarks/bench_check.py --messages 2000 --keys 100 --cycles 20 --new-per-cycle 50
+    python benchmarks/bench_check.py --tls --set fetch_mode=\\"partial\\" --compare benchmarks/results/前回.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from mailbox_gen import MailboxGenerator, make_keys  # noqa: E402
+
+
+def parse_charsets(value: str) -> Dict[str, float]:
+    """"utf-8=5,iso-2022-jp=3" の形式"""
+    charsets = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        charsets[name.strip()] = float(weight or 1)
+    return charsets
+
+
+def _generator(options: Dict, seed_offset: int = 0) -> MailboxGenerator:
+    return MailboxGenerator(
+        seed=options["seed"] + seed_offset,
+        mean_body_bytes=options["body_bytes"],
+        size_sigma=options["size_sigma"],
+        attachment_ratio=options["attachment_ratio"],
+        attachment_bytes=options["attachment_bytes"],
+        multipart_ratio=options["multipart_ratio"],
+        charsets=parse_charsets(options["charsets"]),
+        japanese_subject_ratio=options["japanese_subjects"],
+        keys=make_keys(options["keys"], options["seed"]),
+        hit_ratio=options["hit_ratio"],
+    )
+
+
+def _serve(conn, options: Dict) -> None:
+    """サーバープロセス。メールボックスを生成して待ち受け、親からの指示を処理する"""
+    from fake_imap import FakeImapServer, FakeMailbox, make_self_signed_context
+
+    generator = _generator(options)
+    mailbox = FakeMailbox("INBOX", 1)
+    for raw in generator.messages(options["messages"]):
+        mailbox.append(raw)
+
+    ssl_context, cert = make_self_signed_context() if options["tls"] else (None, None)
+    server = FakeImapServer({"INBOX": mailbox}, ssl_context=ssl_context, latency=options["latency"]).start()
+    conn.send({
+        "address": server.address,
+        "cert": cert,
+        "mailbox_bytes": sum(len(m["raw"]) for m in mailbox.messages),
+    })
+
+    new_messages = _generator(options, seed_offset=1)
+    while True:
+        command, argument = conn.recv()
+        if command == "append":
+            for raw in new_messages.messages(argument, days=0.01):
+                mailbox.append(raw)
+            conn.send(None)
+        elif command == "stats":
+            conn.send(server.stats.snapshot())
+        elif command == "reset_stats":
+            with server.stats.lock:
+                server.stats.reset()
+            conn.send(None)
+        elif command == "stop":
+            server.stop()
+            conn.send(None)
+            return
+
+
+def percentile(values: List[float], p: float) -> float:
+    """最近傍順位法によるパーセンタイル"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(options: Dict) -> Dict:
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=_serve, args=(child, options), daemon=True)
+    server.start()
+    info = parent.recv()
+
+    def call(command, argument=None):
+        parent.send((command, argument))
+        return parent.recv()
+
+    workdir = tempfile.mkdtemp(prefix="bench-check-")
+    os.chdir(workdir)
+    host, port = info["address"]
+    config = {
+        "imap_server": host,
+        "imap_port": port,
+        "imap_ssl": options["tls"],
+        "imap_ca_file": info["cert"],
+        "email": "bench@example.com",
+        "password": "password",
+        "check_interval": 3600,
+        "folder": "INBOX",
+    }
+    config.update(options["set"])
+    with open("config.json", "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    keys = {key: {"description": "", "expected_frequency": "daily", "last_received": None, "history": []}
+            for key in make_keys(options["keys"], options["seed"])}
+    with open("keys.json", "w", encoding="utf-8") as f:
+        json.dump(keys, f, ensure_ascii=False)
+
+    from email_monitor.config_manager import ConfigManager
+    from email_monitor.monitor import EmailMonitor
+
+    monitor = EmailMonitor(ConfigManager())
+    cycles = []
+    try:
+        for cycle in range(options["cycles"] + 1):
+            if cycle > 0 and options["new_per_cycle"]:
+                call("append", options["new_per_cycle"])
+            call("reset_stats")
+            started = time.perf_counter()
+            monitor.check_emails()
+            elapsed = time.perf_counter() - started
+            stats = call("stats")
+            cycles.append({
+                "cycle": cycle,
+                "seconds": elapsed,
+                "messages": monitor.last_cycle_stats.get("messages_fetched", 0),
+                "bytes_sent": stats["bytes_sent"],
+                "bytes_received": stats["bytes_received"],
+                "round_trips": sum(stats["commands"].values()),
+                "commands": stats["commands"],
+            })
+    finally:
+        monitor.close()
+        call("stop")
+        server.join()
+
+    cold, warm = cycles[0], cycles[1:]
+    warm_seconds = [c["seconds"] for c in warm]
+    warm_messages = sum(c["messages"] for c in warm)
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": options,
+            "mailbox_bytes": info["mailbox_bytes"],
+        },
+        "cold": {
+            "seconds": cold["seconds"],
+            "messages": cold["messages"],
+            "messages_per_sec": cold["messages"] / cold["seconds"] if cold["seconds"] else 0.0,
+            "bytes_sent": cold["bytes_sent"],
+            "round_trips": cold["round_trips"],
+        },
+        "warm": {
+            "cycles": len(warm),
+            "p50_seconds": percentile(warm_seconds, 50),
+            "p99_seconds": percentile(warm_seconds, 99),
+            "messages_per_sec": warm_messages / sum(warm_seconds) if sum(warm_seconds) else 0.0,
+            "bytes_sent_per_cycle": sum(c["bytes_sent"] for c in warm) / len(warm) if warm else 0,
+            "round_trips_per_cycle": sum(c["round_trips"] for c in warm) / len(warm) if warm else 0,
+        },
+        # Linux では KB 単位
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "cycles": cycles,
+    }
+
+
+COMPARED = [
+    ("cold", "messages_per_sec"), ("cold", "bytes_sent"), ("cold", "round_trips"),
+    ("warm", "p50_seconds"), ("warm", "p99_seconds"), ("warm", "messages_per_sec"),
+    ("warm", "bytes_sent_per_cycle"), ("warm", "round_trips_per_cycle"), (None, "peak_rss_kb"),
+]
+
+
+def _value(result: Dict, section, name):
+    return result[name] if section is None else result[section][name]
+
+
+def report(result: Dict, baseline: Dict = None) -> None:
+    print(f"commit {result['meta']['commit']}  メールボックス {result['meta']['mailbox_bytes']:,} バイト")
+    for section, name in COMPARED:
+        value = _value(result, section, name)
+        label = f"{section}.{name}" if section else name
+        line = f"  {label:<28} {value:>14,.3f}"
+        if baseline is not None:
+            before = _value(baseline, section, name)
+            change = (value - before) / before * 100 if before else 0.0
+            line += f"   (前回 {before:,.3f}, {change:+.1f}%)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000, help="最初に用意するメール数")
+    parser.add_argument("--keys", type=int, default=100)
+    parser.add_argument("--cycles", type=int, default=10, help="最初のチェックの後に繰り返すチェックの回数")
+    parser.add_argument("--new-per-cycle", type=int, default=20, help="各サイクルの前に届く新着メール数")
+    parser.add_argument("--body-bytes", type=int, default=4000, help="本文サイズの平均")
+    parser.add_argument("--size-sigma", type=float, default=1.0, help="本文サイズ（対数正規分布）のばらつき")
+    parser.add_argument("--attachment-ratio", type=float, default=0.1)
+    parser.add_argument("--attachment-bytes", type=int, default=200_000)
+    parser.add_argument("--multipart-ratio", type=float, default=0.3)
+    parser.add_argument("--charsets", default="utf-8=5,iso-2022-jp=3,shift_jis=1,us-ascii=1")
+    parser.add_argument("--japanese-subjects", type=float, default=0.7, help="日本語件名の割合")
+    parser.add_argument("--hit-ratio", type=float, default=0.05, help="キーを含むメールの割合")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tls", action="store_true", help="自己署名証明書の TLS で接続する")
+    parser.add_argument("--latency", type=float, default=0.0, help="サーバー応答ごとの遅延（秒）")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=JSON",
+                        help="config.json の値を上書きする（例: --set fetch_mode=\\\"partial\\\"）")
+    parser.add_argument("--output", help="結果の保存先（既定 benchmarks/results/check-<commit>-<日時>.json）")
+    parser.add_argument("--compare", help="比較する以前の結果 JSON")
+    args = parser.parse_args()
+
+    options = {name: value for name, value in vars(args).items() if name not in ("set", "output", "compare")}
+    options["set"] = {}
+    for item in args.set:
+        name, _, value = item.partition("=")
+        options["set"][name] = json.loads(value)
+
+    # run() は作業ディレクトリを移動するため、パスは先に絶対パスにしておく
+    output = os.path.abspath(args.output) if args.output else None
+    compare = os.path.abspath(args.compare) if args.compare else None
+
+    logging.basicConfig(level=logging.WARNING)
+    result = run(options)
+
+    output = output or os.path.join(
+        BENCH_DIR, "results", f"check-{result['meta']['commit']}-{datetime.datetime.now():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+
+    baseline = None
+    if compare:
+        with open(compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    print(f"結果を保存しました: {output}")
+
+
+if __name__ == "__main__":
+    main()
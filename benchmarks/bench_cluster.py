@@ -0,0 +1,208 @@
+"""
+コーディネーター / ワーカーによる分散チェックのベンチマーク・動作確認
+
+ローカル IMAP サーバー（benchmarks/fake_imap.py）に F 個のフォルダを用意し、
+python -m email_monitor coordinator と W 個の worker を別プロセスで起動して
+すべてのフォルダを処理し終えるまでの時間を計測する。--kill 個のワーカーは
+フォルダの処理中に SIGKILL で停止し、リースが切れた後に残りのワーカーが引き継ぐことを確認する。
+最後に同じメールボックスを単独の check で処理した結果とキーの受信履歴を比較し、
+一致しなければ終了コード 1 で終わる。
+
+    python benchmarks/bench_cluster.py --folders 40 --workers 4 --kill 1
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BENCH_DIR, "..", "src"))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SRC_DIR)
+
+from bench_check import _git_commit  # noqa: E402
+from fake_imap import FakeImapServer, FakeMailbox  # noqa: E402
+from mailbox_gen import MailboxGenerator, make_keys  # noqa: E402
+from email_monitor.cluster import LeaseStore  # noqa: E402
+from email_monitor.key_store import JsonKeyStore  # noqa: E402
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SRC_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def _prepare(workdir: str, config: Dict, keys: List[str]) -> None:
+    os.makedirs(workdir)
+    with open(os.path.join(workdir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    with open(os.path.join(workdir, "keys.json"), "w", encoding="utf-8") as f:
+        json.dump({key: {"description": "", "expected_frequency": "daily", "last_received": None, "history": []}
+                   for key in keys}, f, ensure_ascii=False)
+
+
+def _spawn(workdir: str, *args: str) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", "email_monitor"] + list(args), cwd=workdir, env=_env(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _histories(workdir: str) -> Dict[str, List]:
+    # 履歴は keys.json ではなく検出ログ（keys.history）にある
+    keys = JsonKeyStore(os.path.join(workdir, "keys.json"), 0).load()
+    return {key: sorted((entry.timestamp, entry.subject) for entry in data["history"])
+            for key, data in keys.items()}
+
+
+def run_cluster(workdir: str, options: Dict, expected_uid: int) -> Dict:
+    store_path = os.path.join(workdir, "cluster.db")
+    coordinator = _spawn(workdir, "coordinator")
+    while not os.path.exists(store_path):
+        time.sleep(0.05)
+    started = time.perf_counter()
+    workers = {f"w{i}": _spawn(workdir, "worker", f"w{i}") for i in range(options["workers"])}
+
+    store = LeaseStore(store_path)
+    killed: List[str] = []
+    try:
+        while True:
+            status = store.status()
+            owners = {item["owner"] for item in status["items"] if item["owner"]}
+            for worker_id in list(workers):
+                # フォルダを処理中のワーカーを止める（リースを持ったまま消える）
+                if len(killed) < options["kill"] and worker_id in owners and worker_id not in killed:
+                    workers[worker_id].send_signal(signal.SIGKILL)
+                    killed.append(worker_id)
+            items = status["items"]
+            if (items and all(item["last_done"] is not None and item["owner"] is None for item in items)
+                    and status["pending_detections"] == 0):
+                break
+            time.sleep(0.05)
+        seconds = time.perf_counter() - started
+        # 最後の統合の保存が終わるまで待つ
+        time.sleep(0.2)
+    finally:
+        for process in list(workers.values()) + [coordinator]:
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in list(workers.values()) + [coordinator]:
+            process.wait()
+    status = store.status()
+    store.close()
+    return {
+        "seconds": seconds,
+        "killed": killed,
+        "items_done": {worker["worker_id"]: worker["items_done"] for worker in status["workers"]},
+        "incomplete_items": [item["item_id"] for item in status["items"] if item["last_uid"] != expected_uid],
+    }
+
+
+def run_single(workdir: str) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "email_monitor", "check"], cwd=workdir, env=_env(), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def run(options: Dict) -> Dict:
+    keys = make_keys(options["keys"], options["seed"])
+    mailboxes = {}
+    for index in range(options["folders"]):
+        generator = MailboxGenerator(seed=options["seed"] + index, mean_body_bytes=options["body_bytes"],
+                                     attachment_ratio=0.0, keys=keys, hit_ratio=options["hit_ratio"])
+        mailbox = FakeMailbox(f"F{index:04d}", 1)
+        for raw in generator.messages(options["messages"]):
+            mailbox.append(raw)
+        mailboxes[mailbox.name] = mailbox
+
+    server = FakeImapServer(mailboxes, latency=options["latency"]).start()
+    host, port = server.address
+    config = {
+        "imap_server": host, "imap_port": port, "imap_ssl": False,
+        "email": "bench@example.com", "password": "password",
+        "check_interval": 3600, "folder": "INBOX",
+        "accounts": [{"folders": sorted(mailboxes)}],
+        "history_limit": 0, "message_cache_max_bytes": 0,
+        "lease_seconds": options["lease"], "worker_poll_seconds": 0.1, "cluster_merge_interval": 0.2,
+    }
+    root = tempfile.mkdtemp(prefix="bench-cluster-")
+    try:
+        _prepare(os.path.join(root, "cluster"), config, keys)
+        cluster = run_cluster(os.path.join(root, "cluster"), options, options["messages"])
+        _prepare(os.path.join(root, "single"), dict(config, max_concurrency=options["workers"]), keys)
+        single_seconds = run_single(os.path.join(root, "single"))
+    finally:
+        server.stop()
+
+    cluster_history = _histories(os.path.join(root, "cluster"))
+    single_history = _histories(os.path.join(root, "single"))
+    mismatched = sorted(key for key in keys if cluster_history.get(key) != single_history.get(key))
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": options,
+            "workdir": root,
+        },
+        "cluster": cluster,
+        "single_seconds": single_seconds,
+        "detections": sum(len(history) for history in single_history.values()),
+        "mismatched_keys": mismatched,
+    }
+
+
+def report(result: Dict) -> None:
+    options = result["meta"]["options"]
+    cluster = result["cluster"]
+    total = options["folders"] * options["messages"]
+    print(f"commit {result['meta']['commit']}  フォルダ {options['folders']} × {options['messages']} 通, "
+          f"ワーカー {options['workers']} (停止 {len(cluster['killed'])}), リース {options['lease']}秒")
+    print(f"  分散   {cluster['seconds']:8.2f} 秒  {total / cluster['seconds']:8.1f} 通/秒")
+    print(f"  単独   {result['single_seconds']:8.2f} 秒  {total / result['single_seconds']:8.1f} 通/秒 "
+          f"(max_concurrency={options['workers']})")
+    print(f"  ワーカーごとの処理数: {cluster['items_done']}  停止したワーカー: {cluster['killed']}")
+    print(f"  検出 {result['detections']} 件, 単独実行と異なるキー {len(result['mismatched_keys'])} 個, "
+          f"未処理のフォルダ {len(cluster['incomplete_items'])} 個")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folders", type=int, default=40, help="フォルダ数")
+    parser.add_argument("--messages", type=int, default=50, help="フォルダごとのメール数")
+    parser.add_argument("--keys", type=int, default=20, help="キーの数")
+    parser.add_argument("--hit-ratio", type=float, default=0.1, help="キーを含むメールの割合")
+    parser.add_argument("--body-bytes", type=int, default=2000, help="本文の平均サイズ")
+    parser.add_argument("--workers", type=int, default=4, help="ワーカー数")
+    parser.add_argument("--kill", type=int, default=1, help="処理中に停止させるワーカー数")
+    parser.add_argument("--lease", type=float, default=3.0, help="リースの秒数")
+    parser.add_argument("--latency", type=float, default=0.002, help="サーバーの応答遅延（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果の保存先（既定 benchmarks/results/cluster-<commit>-<日時>.json）")
+    args = parser.parse_args()
+
+    options = {"folders": args.folders, "messages": args.messages, "keys": args.keys, "hit_ratio": args.hit_ratio,
+               "body_bytes": args.body_bytes, "workers": args.workers, "kill": min(args.kill, args.workers - 1),
+               "lease": args.lease, "latency": args.latency, "seed": args.seed}
+    result = run(options)
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"cluster-{result['meta']['commit']}-{datetime.datetime.now():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    report(result)
+    print(f"結果を保存しました: {output}")
+    if result["mismatched_keys"] or result["cluster"]["incomplete_items"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
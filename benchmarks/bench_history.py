@@ -0,0 +1,212 @@
+"""
+受信履歴の保持方法のベンチマーク
+
+K 個のキーにそれぞれ history_limit 件の履歴がある状態で、以前の保持方法
+（{"date": ISO 文字列, "subject"} の dict のリストを検出のたびに [-history_limit:] で作り直し、
+keys.json に履歴ごと書く）と、現在の保持方法（Detection のリングバッファと検出ログ）を比較する。
+
+- メモリ: 履歴を作り終えた時点で tracemalloc が数えた確保量（件名の文字列を含む）
+- 記録: 検出 N 件を記録する時間
+- 保存: 検出 --per-save 件ごとの保存 1 回の時間と書き込んだバイト数、keys.json の大きさ
+- 読み込み: 起動時にキーと履歴を読み込む時間
+
+    python benchmarks/bench_history.py --keys 10000 --history-limit 10
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from bench_check import _git_commit  # noqa: E402
+from email_monitor.history import Detection, History  # noqa: E402
+from email_monitor.key_store import JsonKeyStore, KeyChanges, atomic_write_json  # noqa: E402
+
+START = datetime.datetime(2024, 1, 1, 9, 0, 0)
+
+
+def _detections(options: Dict) -> List[Tuple[str, str, str]]:
+    """(キー, ISO 日時, 件名) を日時順に、各キーが history_limit 件ずつになるよう並べる"""
+    keys = [f"KEY-{i:05d}" for i in range(options["keys"])]
+    detections = []
+    for round_ in range(options["history_limit"]):
+        for index, key in enumerate(keys):
+            date = START + datetime.timedelta(hours=round_, seconds=index)
+            detections.append((key, date.isoformat(), f"[{key}] 日次レポート {date:%Y-%m-%d %H:%M}"))
+    return detections
+
+
+def _new_key(history) -> Dict:
+    return {"description": "", "expected_frequency": "daily", "last_received": None, "history": history}
+
+
+def record_legacy(keys: Dict, key: str, date: str, subject: str, limit: int) -> None:
+    """以前の ConfigManager.record_detection と同じ処理"""
+    data = keys[key]
+    entry = {"date": date, "subject": subject}
+    if not data["last_received"] or date > data["last_received"]:
+        data["last_received"] = date
+    data["history"].append(entry)
+    if limit > 0 and len(data["history"]) > limit:
+        data["history"] = data["history"][-limit:]
+
+
+def record_ring(keys: Dict, key: str, date: str, subject: str, limit: int) -> None:
+    """現在の ConfigManager.record_detection と同じ処理"""
+    data = keys[key]
+    if not data["last_received"] or date > data["last_received"]:
+        data["last_received"] = date
+    data["history"].append(Detection.from_iso(date, subject))
+
+
+def _measure_memory(build: Callable[[], Dict]) -> Tuple[Dict, int]:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keys = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return keys, used
+
+
+def run_layout(options: Dict, layout: str, detections: List[Tuple[str, str, str]]) -> Dict:
+    limit = options["history_limit"]
+    legacy = layout == "legacy"
+    record = record_legacy if legacy else record_ring
+
+    # 日時と件名の文字列は検出のたびに作られるため、メモリの計測に含めるよう計測の中で複製する
+    def build() -> Dict:
+        keys = {f"KEY-{i:05d}": _new_key([] if legacy else History(limit)) for i in range(options["keys"])}
+        for key, date, subject in detections:
+            record(keys, key, "".join(date), "".join(subject), limit)
+        return keys
+
+    keys, memory = _measure_memory(build)
+
+    # 履歴が満杯の状態での記録（リストの作り直し / リングバッファの上書き）
+    extra = [(key, (START + datetime.timedelta(days=30, seconds=i)).isoformat(), subject)
+             for i, (key, _, subject) in enumerate(detections[:options["records"]])]
+    started = time.perf_counter()
+    for key, date, subject in extra:
+        record(keys, key, date, subject, limit)
+    record_seconds = time.perf_counter() - started
+
+    workdir = tempfile.mkdtemp(prefix="bench-history-")
+    try:
+        path = os.path.join(workdir, "keys.json")
+        store = JsonKeyStore(path, limit)
+        if legacy:
+            atomic_write_json(path, keys)
+        else:
+            store.log.rewrite({key: data["history"] for key, data in keys.items()})
+            store.save(keys, KeyChanges())
+        log_before = os.path.getsize(store.log.path) if store.log.exists() else 0
+
+        # 検出 per_save 件ごとの保存
+        saves = []
+        per_save = options["per_save"]
+        for start in range(0, options["saves"] * per_save, per_save):
+            changes = KeyChanges()
+            for key, date, subject in extra[start:start + per_save]:
+                if legacy:
+                    record_legacy(keys, key, date, subject, limit)
+                else:
+                    record_ring(keys, key, date, subject, limit)
+                    changes.add_history(key, keys[key]["history"].last())
+            started = time.perf_counter()
+            if legacy:
+                atomic_write_json(path, keys)
+            else:
+                store.save(keys, changes)
+            saves.append(time.perf_counter() - started)
+        keys_json_bytes = os.path.getsize(path)
+        log_bytes = os.path.getsize(store.log.path) if store.log.exists() else 0
+
+        started = time.perf_counter()
+        if legacy:
+            with open(path, encoding="utf-8") as f:
+                json.load(f)
+        else:
+            JsonKeyStore(path, limit).load()
+        load_seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(workdir)
+
+    return {
+        "memory_bytes": memory,
+        "memory_bytes_per_entry": memory / len(detections),
+        "record_us_per_detection": record_seconds / len(extra) * 1e6,
+        "save_ms": sorted(saves)[len(saves) // 2] * 1000,
+        "save_written_bytes": keys_json_bytes + (log_bytes - log_before) / len(saves),
+        "keys_json_bytes": keys_json_bytes,
+        "log_bytes": log_bytes,
+        "load_ms": load_seconds * 1000,
+    }
+
+
+def run(options: Dict) -> Dict:
+    detections = _detections(options)
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": options,
+        },
+        "legacy": run_layout(options, "legacy", detections),
+        "ring": run_layout(options, "ring", detections),
+    }
+
+
+def report(result: Dict) -> None:
+    options = result["meta"]["options"]
+    print(f"commit {result['meta']['commit']}  キー {options['keys']} 個 × 履歴 {options['history_limit']} 件")
+    for name, label in (("legacy", "dict のリスト"), ("ring", "リングバッファ")):
+        row = result[name]
+        print(f"  {label:<8}  メモリ {row['memory_bytes'] / 2 ** 20:7.1f} MiB ({row['memory_bytes_per_entry']:5.0f} B/件)  "
+              f"記録 {row['record_us_per_detection']:5.2f} µs/件  "
+              f"保存 {row['save_ms']:8.1f} ms ({row['save_written_bytes'] / 2 ** 10:8.1f} KiB)  "
+              f"読み込み {row['load_ms']:7.1f} ms  keys.json {row['keys_json_bytes'] / 2 ** 20:5.1f} MiB  "
+              f"ログ {row['log_bytes'] / 2 ** 20:5.1f} MiB")
+    legacy, ring = result["legacy"], result["ring"]
+    print(f"  メモリ {ring['memory_bytes'] / legacy['memory_bytes']:.0%}, "
+          f"保存 1 回の書き込み {ring['save_written_bytes'] / legacy['save_written_bytes']:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=10000, help="キーの数")
+    parser.add_argument("--history-limit", type=int, default=10, help="キーごとの履歴の件数")
+    parser.add_argument("--records", type=int, default=20000, help="記録の時間を計る検出の件数")
+    parser.add_argument("--per-save", type=int, default=100, help="保存 1 回あたりの検出の件数")
+    parser.add_argument("--saves", type=int, default=20, help="保存の回数")
+    parser.add_argument("--output", help="結果の保存先（既定 benchmarks/results/history-<commit>-<日時>.json）")
+    args = parser.parse_args()
+
+    options = {"keys": args.keys, "history_limit": args.history_limit, "records": args.records,
+               "per_save": args.per_save, "saves": args.saves}
+    result = run(options)
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"history-{result['meta']['commit']}-{datetime.datetime.now():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    report(result)
+    print(f"結果を保存しました: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+キー照合のマイクロベンチマーク
+
+従来の `for key in keys: if key in search_text` ループ、Aho-Corasick オートマトン単体、
+KeyMatcher の既定動作（少数キーでは線形走査）を 10 / 1,000 / 10,000 キーで比較する。
+
+    python benchmarks/bench_matcher.py [--messages 200] [--body-chars 4000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from email_monitor.matcher import KeyMatcher  # noqa: E402
+
+WORDS = [
+    "請求書", "納品書", "見積書", "領収書", "注文確認", "支払通知", "月次報告", "日報",
+    "障害報告", "メンテナンス", "invoice", "receipt", "order", "report", "alert",
+]
+KANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+KANJI = "東京大阪名古屋福岡札幌仙台広島神戸京都横浜千葉埼玉株式会社部課係担当者様御中各位"
+
+
+def make_keys(count: int, rng: random.Random):
+    keys = set()
+    while len(keys) < count:
+        kind = rng.random()
+        if kind < 0.4:
+            keys.add(f"{rng.choice(WORDS)}-{rng.randrange(100000):05d}")
+        elif kind < 0.8:
+            keys.add("".join(rng.choice(KANJI) for _ in range(rng.randint(3, 6))) + rng.choice(WORDS))
+        else:
+            keys.add(f"{rng.choice(['ORD', 'INV', 'TKT'])}{rng.randrange(10**7):07d}")
+    return sorted(keys)
+
+
+def make_text(chars: int, keys, rng: random.Random) -> str:
+    pieces = []
+    size = 0
+    while size < chars:
+        r = rng.random()
+        if r < 0.01:
+            piece = rng.choice(keys)
+        elif r < 0.3:
+            piece = rng.choice(WORDS)
+        else:
+            piece = "".join(rng.choice(KANA + KANJI) for _ in range(rng.randint(2, 12)))
+        pieces.append(piece)
+        size += len(piece) + 1
+    return " ".join(pieces)
+
+
+def naive(keys, text):
+    return {key for key in keys if key in text}
+
+
+def bench(func, texts, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--body-chars", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'キー数':>8} {'構築(ms)':>10} {'従来ループ(ms)':>16} {'Aho-Corasick(ms)':>18} {'KeyMatcher(ms)':>16} {'速度比':>8}")
+    for count in (10, 1000, 10000):
+        keys = make_keys(count, rng)
+        texts = [make_text(args.body_chars, keys, rng) for _ in range(args.messages)]
+
+        start = time.perf_counter()
+        automaton = KeyMatcher(keys, linear_scan_max_keys=0)
+        build = time.perf_counter() - start
+        matcher = KeyMatcher(keys)
+
+        for text in texts[:20]:
+            assert automaton.find(text) == matcher.find(text) == naive(keys, text)
+
+        t_naive = bench(lambda text: naive(keys, text), texts, args.repeat)
+        t_automaton = bench(automaton.find, texts, args.repeat)
+        t_matcher = bench(matcher.find, texts, args.repeat)
+        print(f"{count:>8} {build * 1000:>10.1f} {t_naive * 1000:>16.1f} {t_automaton * 1000:>18.1f} "
+              f"{t_matcher * 1000:>16.1f} {t_naive / t_matcher:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
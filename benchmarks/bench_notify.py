@@ -0,0 +1,181 @@
+"""
+通知がチェックのサイクル時間に影響しないことを確認するベンチマーク
+
+ローカル IMAP サーバー（benchmarks/fake_imap.py）と、応答を遅らせたローカルの SMTP / webhook
+サーバー（benchmarks/fake_sinks.py、webhook は最初の数回を失敗させる）を使い、
+通知なしと通知ありで同じチェック（新着の照合 + 未着の報告）を繰り返してサイクル時間を比較する。
+あわせて、検出がすべて届いたこと、未着のキーの通知が 1 回だけだったこと、
+送信回数がサイクル数以下にまとめられたことを確認し、満たさなければ終了コード 1 で終わる。
+
+    python benchmarks/bench_notify.py --cycles 10 --sink-latency 1.0
+"""
+import argparse
+import datetime
+import email.utils
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from email.mime.text import MIMEText
+from typing import Dict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from bench_check import _git_commit, percentile  # noqa: E402
+from fake_imap import FakeImapServer, FakeMailbox  # noqa: E402
+from fake_sinks import FakeSmtpServer, FakeWebhookServer  # noqa: E402
+
+
+def _message(subject: str) -> bytes:
+    message = MIMEText("本文", "plain", "utf-8")
+    message["Subject"] = subject
+    message["Date"] = email.utils.formatdate(localtime=True)
+    message["Message-ID"] = email.utils.make_msgid(domain="example.com")
+    return message.as_bytes()
+
+
+def run_mode(options: Dict, notify: bool) -> Dict:
+    from email_monitor.config_manager import ConfigManager
+    from email_monitor.monitor import EmailMonitor
+
+    mailbox = FakeMailbox("INBOX")
+    server = FakeImapServer({"INBOX": mailbox}).start()
+    smtp = FakeSmtpServer(latency=options["sink_latency"]).start()
+    webhook = FakeWebhookServer(latency=options["sink_latency"], fail_first=options["fail_first"]).start()
+    host, port = server.address
+    workdir = tempfile.mkdtemp(prefix="bench-notify-")
+    os.chdir(workdir)
+    config = {
+        "imap_server": host, "imap_port": port, "imap_ssl": False,
+        "email": "bench@example.com", "password": "password", "check_interval": 3600, "folder": "INBOX",
+        "message_cache_max_bytes": 0,
+    }
+    if notify:
+        sink_options = {"retry_base": 0.2, "rate_per_minute": 600}
+        config["notifications"] = [dict(smtp.sink_config(), **sink_options),
+                                   dict(webhook.sink_config(), **sink_options)]
+    with open("config.json", "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    # 半分は毎サイクル届くキー、残りは一度も届かない（未着の）キー
+    keys = {f"KEY-{i:03d}": {"description": "", "expected_frequency": "daily", "last_received": None, "history": []}
+            for i in range(options["keys"])}
+    with open("keys.json", "w", encoding="utf-8") as f:
+        json.dump(keys, f)
+    arriving = sorted(keys)[:options["keys"] // 2]
+
+    monitor = EmailMonitor(ConfigManager())
+    seconds = []
+    detections = 0
+    try:
+        for cycle in range(options["cycles"]):
+            for key in arriving:
+                mailbox.append(_message(f"サイクル {cycle} {key}"))
+            started = time.perf_counter()
+            results = monitor.check_emails()
+            monitor._report_missing()
+            seconds.append(time.perf_counter() - started)
+            detections += sum(results.values())
+        started = time.perf_counter()
+        monitor.close()
+        drain_seconds = time.perf_counter() - started
+    finally:
+        server.stop()
+        smtp.stop()
+        webhook.stop()
+
+    result = {"cycle_p50_seconds": percentile(seconds, 50), "cycle_max_seconds": max(seconds),
+              "drain_seconds": drain_seconds, "detections": detections}
+    if notify:
+        missing_alerts: Dict[str, int] = {}
+        for payload in webhook.received:
+            for key in payload["missing"]:
+                missing_alerts[key] = missing_alerts.get(key, 0) + 1
+        result.update({
+            "webhook_posts": len(webhook.received),
+            "webhook_attempts": webhook.attempts,
+            "webhook_detections": sum(len(payload["detected"]) for payload in webhook.received),
+            "smtp_messages": len(smtp.received),
+            "missing_keys": options["keys"] - len(arriving),
+            "missing_alerts_max": max(missing_alerts.values(), default=0),
+            "missing_alerted_keys": len(missing_alerts),
+        })
+    return result
+
+
+def run(options: Dict) -> Dict:
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": options,
+        },
+        "without": run_mode(options, False),
+        "with": run_mode(options, True),
+    }
+
+
+def check(result: Dict) -> list:
+    """満たしていない条件の一覧"""
+    options, without, with_ = result["meta"]["options"], result["without"], result["with"]
+    problems = []
+    # 送信先の遅延の半分以上サイクルが延びていれば、送信を待っている
+    if with_["cycle_p50_seconds"] > without["cycle_p50_seconds"] + options["sink_latency"] / 2:
+        problems.append("サイクル時間が通知の送信に影響されています")
+    if with_["webhook_detections"] != with_["detections"]:
+        problems.append("webhook に届いた検出の数が一致しません")
+    if with_["missing_alerted_keys"] != with_["missing_keys"] or with_["missing_alerts_max"] != 1:
+        problems.append("未着のキーの通知が 1 回ずつになっていません")
+    if with_["webhook_posts"] > options["cycles"] or with_["smtp_messages"] > options["cycles"]:
+        problems.append("通知がサイクルごとにまとめられていません")
+    return problems
+
+
+def report(result: Dict, problems: list) -> None:
+    options, without, with_ = result["meta"]["options"], result["without"], result["with"]
+    print(f"commit {result['meta']['commit']}  {options['cycles']} サイクル, キー {options['keys']} 個, "
+          f"送信先の遅延 {options['sink_latency']}秒")
+    print(f"  通知なし  p50 {without['cycle_p50_seconds'] * 1000:8.1f} ms  最大 {without['cycle_max_seconds'] * 1000:8.1f} ms")
+    print(f"  通知あり  p50 {with_['cycle_p50_seconds'] * 1000:8.1f} ms  最大 {with_['cycle_max_seconds'] * 1000:8.1f} ms  "
+          f"(終了時の送信待ち {with_['drain_seconds']:.2f}秒)")
+    print(f"  webhook {with_['webhook_posts']} 回 (試行 {with_['webhook_attempts']} 回), SMTP {with_['smtp_messages']} 通, "
+          f"検出 {with_['webhook_detections']}/{with_['detections']} 件, "
+          f"未着の通知 {with_['missing_alerted_keys']}/{with_['missing_keys']} キー")
+    for problem in problems:
+        print(f"  NG: {problem}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cycles", type=int, default=10, help="チェックの回数")
+    parser.add_argument("--keys", type=int, default=20, help="キーの数（半分は未着）")
+    parser.add_argument("--sink-latency", type=float, default=1.0, help="SMTP / webhook サーバーの応答遅延（秒）")
+    parser.add_argument("--fail-first", type=int, default=2, help="webhook が失敗を返す回数")
+    parser.add_argument("--output", help="結果の保存先（既定 benchmarks/results/notify-<commit>-<日時>.json）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    options = {"cycles": args.cycles, "keys": args.keys, "sink_latency": args.sink_latency,
+               "fail_first": args.fail_first}
+    result = run(options)
+    problems = check(result)
+    result["problems"] = problems
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"notify-{result['meta']['commit']}-{datetime.datetime.now():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    report(result, problems)
+    print(f"結果を保存しました: {output}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
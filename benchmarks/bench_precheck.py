@@ -0,0 +1,183 @@
+"""
+STATUS による事前確認（folder_precheck）のベンチマーク・動作確認
+
+ローカル IMAP サーバー（benchmarks/fake_imap.py、応答ごとに --latency 秒遅らせる）に
+F 個のフォルダを用意し、folder_precheck を無効・有効にして同じチェックを行う。
+最初のチェックの後、新着の無いサイクルを --cycles 回と、--active 個のフォルダにだけ
+新着があるサイクルを 1 回行い、サーバーが受けたコマンドの数とサイクル時間を比較する。
+新着のあるサイクルで両者の検出が一致しないか、ログインの数が同時実行数（max_concurrency）を
+超えた場合は終了コード 1 で終わる。
+
+    python benchmarks/bench_precheck.py --folders 40 --cycles 5 --latency 0.005
+    python benchmarks/bench_precheck.py --condstore
+"""
+import argparse
+import datetime
+import email.utils
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from email.mime.text import MIMEText
+from typing import Dict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from bench_check import _git_commit, percentile  # noqa: E402
+from fake_imap import FakeImapServer, FakeMailbox  # noqa: E402
+
+
+def _message(subject: str) -> bytes:
+    message = MIMEText("本文", "plain", "utf-8")
+    message["Subject"] = subject
+    message["Date"] = email.utils.formatdate(localtime=True)
+    message["Message-ID"] = email.utils.make_msgid(domain="example.com")
+    return message.as_bytes()
+
+
+def _cycle(monitor, server) -> Dict:
+    before = server.stats.snapshot()["commands"]
+    started = time.perf_counter()
+    results = monitor.check_emails()
+    seconds = time.perf_counter() - started
+    after = server.stats.snapshot()["commands"]
+    commands = {name: after.get(name, 0) - before.get(name, 0) for name in after}
+    return {
+        "seconds": seconds,
+        "commands": {name: count for name, count in commands.items() if count},
+        "total_commands": sum(commands.values()),
+        "detected": sorted(key for key, found in results.items() if found),
+        "folders_skipped": monitor.last_cycle_stats.get("folders_skipped", 0),
+    }
+
+
+def run_mode(options: Dict, precheck: bool) -> Dict:
+    from email_monitor.config_manager import ConfigManager
+    from email_monitor.monitor import EmailMonitor
+
+    names = [f"Folder{i:02d}" for i in range(options["folders"])]
+    mailboxes = {name: FakeMailbox(name) for name in names}
+    for name in names:
+        for i in range(options["messages"]):
+            mailboxes[name].append(_message(f"{name} 既存 {i}"))
+    capabilities = [b"IMAP4rev1", b"IDLE", b"UIDPLUS", b"ENABLE", b"UNSELECT"] + ([b"CONDSTORE"] if options["condstore"] else [])
+    server = FakeImapServer(mailboxes, capabilities=capabilities, latency=options["latency"]).start()
+    host, port = server.address
+    os.chdir(tempfile.mkdtemp(prefix="bench-precheck-"))
+    with open("config.json", "w", encoding="utf-8") as f:
+        json.dump({
+            "imap_server": host, "imap_port": port, "imap_ssl": False,
+            "email": "bench@example.com", "password": "password", "check_interval": 3600,
+            "folder": names[0], "accounts": [{"folders": names}], "max_concurrency": options["concurrency"],
+            "message_cache_max_bytes": 0, "folder_precheck": precheck,
+        }, f)
+    with open("keys.json", "w", encoding="utf-8") as f:
+        json.dump({f"新着 {name}": {"description": "", "expected_frequency": "daily", "last_received": None}
+                   for name in names}, f, ensure_ascii=False)
+
+    monitor = EmailMonitor(ConfigManager())
+    try:
+        first = _cycle(monitor, server)
+        quiet = [_cycle(monitor, server) for _ in range(options["cycles"])]
+        for name in names[:options["active"]]:
+            mailboxes[name].append(_message(f"新着 {name}"))
+        active = _cycle(monitor, server)
+        logins = server.stats.snapshot()["logins"]
+    finally:
+        monitor.close()
+        server.stop()
+
+    return {
+        "first_seconds": first["seconds"],
+        "quiet_p50_seconds": percentile([cycle["seconds"] for cycle in quiet], 50),
+        "quiet_commands": quiet[-1]["commands"],
+        "quiet_total_commands": quiet[-1]["total_commands"],
+        "quiet_folders_skipped": quiet[-1]["folders_skipped"],
+        "active_seconds": active["seconds"],
+        "active_total_commands": active["total_commands"],
+        "active_folders_skipped": active["folders_skipped"],
+        "active_detected": active["detected"],
+        "logins": logins,
+    }
+
+
+def run(options: Dict) -> Dict:
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": options,
+        },
+        "without": run_mode(options, False),
+        "with": run_mode(options, True),
+    }
+
+
+def check(result: Dict) -> list:
+    """満たしていない条件の一覧"""
+    options, without, with_ = result["meta"]["options"], result["without"], result["with"]
+    problems = []
+    if with_["active_detected"] != without["active_detected"] or len(with_["active_detected"]) != options["active"]:
+        problems.append("新着のあるサイクルの検出が一致しません")
+    if with_["quiet_folders_skipped"] != options["folders"]:
+        problems.append("新着の無いサイクルで走査を省略しなかったフォルダがあります")
+    if with_["active_folders_skipped"] != options["folders"] - options["active"]:
+        problems.append("新着のあるサイクルで省略したフォルダの数が合いません")
+    if max(without["logins"], with_["logins"]) > options["concurrency"]:
+        problems.append("同時実行数を超える数のセッションでログインしました")
+    return problems
+
+
+def report(result: Dict, problems: list) -> None:
+    options = result["meta"]["options"]
+    print(f"commit {result['meta']['commit']}  フォルダ {options['folders']} 個, 応答の遅延 {options['latency'] * 1000:g} ms, "
+          f"同時実行 {options['concurrency']}{', CONDSTORE' if options['condstore'] else ''}")
+    for name, label in (("without", "事前確認なし"), ("with", "事前確認あり")):
+        row = result[name]
+        commands = ", ".join(f"{command} {count}" for command, count in sorted(row["quiet_commands"].items()))
+        print(f"  {label}  新着なし p50 {row['quiet_p50_seconds'] * 1000:7.1f} ms  コマンド {row['quiet_total_commands']:4d} "
+              f"({commands})  省略 {row['quiet_folders_skipped']} フォルダ  ログイン {row['logins']} 回")
+        print(f"  {'':<6}  新着あり     {row['active_seconds'] * 1000:7.1f} ms  コマンド {row['active_total_commands']:4d}  "
+              f"検出 {len(row['active_detected'])} キー")
+    for problem in problems:
+        print(f"  NG: {problem}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folders", type=int, default=40, help="フォルダの数")
+    parser.add_argument("--messages", type=int, default=20, help="各フォルダに最初からあるメール数")
+    parser.add_argument("--cycles", type=int, default=5, help="新着の無いサイクルの回数")
+    parser.add_argument("--active", type=int, default=2, help="最後のサイクルで新着のあるフォルダの数")
+    parser.add_argument("--latency", type=float, default=0.005, help="サーバー応答ごとの遅延（秒）")
+    parser.add_argument("--concurrency", type=int, default=4, help="max_concurrency")
+    parser.add_argument("--condstore", action="store_true", help="サーバーが CONDSTORE に対応する")
+    parser.add_argument("--output", help="結果の保存先（既定 benchmarks/results/precheck-<commit>-<日時>.json）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    options = {"folders": args.folders, "messages": args.messages, "cycles": args.cycles, "active": args.active,
+               "latency": args.latency, "concurrency": args.concurrency, "condstore": args.condstore}
+    result = run(options)
+    problems = check(result)
+    result["problems"] = problems
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"precheck-{result['meta']['commit']}-{datetime.datetime.now():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    report(result, problems)
+    print(f"結果を保存しました: {output}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
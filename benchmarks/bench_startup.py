@@ -0,0 +1,181 @@
+"""
+コマンドラインの起動時間ベンチマーク
+
+一時ディレクトリに K 個のキーを用意し、list / add / remove を python -m email_monitor で
+繰り返し起動して実行時間の p50 / 最小を計測する（python -c pass の時間も併せて出力する）。
+また python -X importtime の出力から import にかかった時間と上位のモジュールを集計し、
+これらのコマンドで IMAP・MIME・SSL などのモジュールが読み込まれていないかを確認する。
+読み込まれていた場合は終了コード 1 で終わる。結果は JSON に保存し、--compare で以前の
+結果との差分を表示する。
+
+    python benchmarks/bench_startup.py --keys 1000 --runs 20
+    python benchmarks/bench_startup.py --compare benchmarks/results/前回.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BENCH_DIR, "..", "src"))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_check import _git_commit, percentile  # noqa: E402
+
+COMMANDS = {
+    "list": ["list"],
+    "add": ["add", "bench-startup-key", "ベンチマーク", "daily"],
+    "remove": ["remove", "bench-startup-key"],
+}
+
+# list / add / remove で読み込まれてはいけないモジュール
+FORBIDDEN = [
+    "imaplib", "ssl", "email.parser", "email.header", "http.server", "asyncio",
+    "multiprocessing", "concurrent.futures", "email_monitor.monitor",
+]
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SRC_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def _run(args: List[str], workdir: str) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=workdir, env=_env(), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def parse_importtime(stderr: str) -> Dict[str, Dict[str, int]]:
+    """
+    -X importtime の出力を {モジュール名: {"self_us": ..., "cumulative_us": ...}} にする
+
+    "import time:      self [us] | cumulative | imported package" の形式の行を読む。
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        modules[name.strip()] = {"self_us": int(self_us), "cumulative_us": int(cumulative_us)}
+    return modules
+
+
+def measure_imports(args: List[str], workdir: str, top: int) -> Dict:
+    result = subprocess.run([sys.executable, "-X", "importtime"] + args, cwd=workdir, env=_env(), check=True,
+                            capture_output=True, text=True)
+    modules = parse_importtime(result.stderr)
+    ranked = sorted(modules.items(), key=lambda item: item[1]["cumulative_us"], reverse=True)
+    return {
+        "modules": len(modules),
+        "total_self_us": sum(m["self_us"] for m in modules.values()),
+        "top": [{"module": name, **times} for name, times in ranked[:top]],
+        "forbidden": [name for name in FORBIDDEN if name in modules],
+    }
+
+
+def run(options: Dict) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    config = {"imap_server": "imap.example.com", "email": "bench@example.com", "password": "password",
+              "check_interval": 3600, "folder": "INBOX"}
+    config.update(options["set"])
+    with open(os.path.join(workdir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    keys = {f"key-{i:05d}": {"description": "", "expected_frequency": "daily", "last_received": None,
+                             "history": []} for i in range(options["keys"])}
+    with open(os.path.join(workdir, "keys.json"), "w", encoding="utf-8") as f:
+        json.dump(keys, f)
+
+    baseline = [_run(["-c", "pass"], workdir) for _ in range(options["runs"])]
+    commands = {}
+    for name, argv in COMMANDS.items():
+        args = ["-m", "email_monitor"] + argv
+        _run(args, workdir)  # バイトコードのキャッシュを作る
+        seconds = []
+        for _ in range(options["runs"]):
+            seconds.append(_run(args, workdir))
+            if name == "add":
+                # 次の add が上書きにならないように戻す
+                _run(["-m", "email_monitor"] + COMMANDS["remove"], workdir)
+        commands[name] = {
+            "p50_seconds": percentile(seconds, 50),
+            "min_seconds": min(seconds),
+            "imports": measure_imports(args, workdir, options["top"]),
+        }
+        if name == "add":
+            _run(["-m", "email_monitor"] + COMMANDS["remove"], workdir)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": options,
+        },
+        "python_startup": {"p50_seconds": percentile(baseline, 50), "min_seconds": min(baseline)},
+        "commands": commands,
+    }
+
+
+def report(result: Dict, baseline: Dict = None) -> None:
+    startup = result["python_startup"]["p50_seconds"]
+    print(f"commit {result['meta']['commit']}  python -c pass: {startup * 1000:.1f} ms")
+    for name, data in result["commands"].items():
+        imports = data["imports"]
+        line = (f"  {name:<8} p50 {data['p50_seconds'] * 1000:8.1f} ms  "
+                f"import {imports['total_self_us'] / 1000:7.1f} ms ({imports['modules']} モジュール)")
+        if baseline is not None and name in baseline["commands"]:
+            before = baseline["commands"][name]["p50_seconds"]
+            change = (data["p50_seconds"] - before) / before * 100 if before else 0.0
+            line += f"   (前回 {before * 1000:.1f} ms, {change:+.1f}%)"
+        print(line)
+        for entry in imports["top"]:
+            print(f"      {entry['cumulative_us'] / 1000:7.1f} ms  {entry['module']}")
+        if imports["forbidden"]:
+            print(f"    読み込まれてはいけないモジュール: {', '.join(imports['forbidden'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=1000, help="keys.json に用意するキーの数")
+    parser.add_argument("--runs", type=int, default=20, help="コマンドごとの起動回数")
+    parser.add_argument("--top", type=int, default=10, help="表示する import の上位モジュール数")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=JSON",
+                        help="config.json の値を上書きする（例: --set storage=\\\"sqlite\\\"）")
+    parser.add_argument("--output", help="結果の保存先（既定 benchmarks/results/startup-<commit>-<日時>.json）")
+    parser.add_argument("--compare", help="比較する以前の結果 JSON")
+    args = parser.parse_args()
+
+    options = {"keys": args.keys, "runs": args.runs, "top": args.top, "set": {}}
+    for item in args.set:
+        name, _, value = item.partition("=")
+        options["set"][name] = json.loads(value)
+
+    result = run(options)
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"startup-{result['meta']['commit']}-{datetime.datetime.now():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    print(f"結果を保存しました: {output}")
+    if any(data["imports"]["forbidden"] for data in result["commands"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,833 @@
+"""
+ベンチマーク・動作確認用のローカル IMAP4rev1 サーバー
+
+実サーバーを使わずに check_emails を動かすための最小実装です。
+LOGIN / CAPABILITY / SELECT / EXAMINE / STATUS / (UID) SEARCH / (UID) FETCH /
+NOOP / IDLE / ENABLE / CLOSE / LOGOUT に対応し、送受信バイト数とコマンド数を記録します。
+"""
+import datetime
+import email
+import email.utils
+import os
+import re
+import select
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from email.header import decode_header
+from typing import Dict, List, Optional, Tuple
+
+CRLF = b"\r\n"
+
+
+class FakeMailbox:
+    def __init__(self, name: str, uidvalidity: int = 1):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.modseq = 1
+        self.messages: List[Dict] = []
+        self.lock = threading.Condition()
+
+    def append(self, raw: bytes, internaldate: Optional[datetime.datetime] = None) -> int:
+        """メッセージを追加し、割り当てた UID を返す"""
+        with self.lock:
+            uid = self.uidnext
+            self.uidnext += 1
+            self.modseq += 1
+            msg = email.message_from_bytes(raw)
+            if internaldate is None:
+                date_tuple = email.utils.parsedate_tz(msg["Date"]) if msg["Date"] else None
+                if date_tuple:
+                    internaldate = datetime.datetime.fromtimestamp(email.utils.mktime_tz(date_tuple))
+                else:
+                    internaldate = datetime.datetime.now()
+            self.messages.append({
+                "uid": uid,
+                "raw": raw,
+                "msg": msg,
+                "date": internaldate,
+                "flags": set(),
+                "modseq": self.modseq,
+            })
+            self.lock.notify_all()
+            return uid
+
+    def reset(self, uidvalidity: int) -> None:
+        """UIDVALIDITY を変更して UID を振り直す"""
+        with self.lock:
+            self.uidvalidity = uidvalidity
+            self.uidnext = 1
+            for m in self.messages:
+                m["uid"] = self.uidnext
+                self.uidnext += 1
+            self.modseq += 1
+            self.lock.notify_all()
+
+
+class ServerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.connections = 0
+        self.logins = 0
+        self.commands: Dict[str, int] = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def command(self, name: str) -> None:
+        with self.lock:
+            self.commands[name] = self.commands.get(name, 0) + 1
+
+    def total_commands(self) -> int:
+        with self.lock:
+            return sum(self.commands.values())
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                "connections": self.connections,
+                "logins": self.logins,
+                "commands": dict(self.commands),
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+            }
+
+
+# ---------------------------------------------------------------------------
+# コマンド引数の字句解析
+
+class _ArgReader:
+    """クライアントから受け取ったコマンド行（リテラル展開済み）を解析する"""
+
+    def __init__(self, parts: List):
+        # parts: bytes（テキスト）と ("literal", bytes) の列
+        self.parts = parts
+        self.idx = 0
+        self.pos = 0
+
+    def _cur(self) -> Optional[bytes]:
+        while self.idx < len(self.parts):
+            part = self.parts[self.idx]
+            if isinstance(part, tuple):
+                return None
+            if self.pos < len(part):
+                return part
+            self.idx += 1
+            self.pos = 0
+        return b""
+
+    def _skip_spaces(self) -> None:
+        while True:
+            cur = self._cur()
+            if cur is None or cur == b"":
+                return
+            if cur[self.pos:self.pos + 1] == b" ":
+                self.pos += 1
+            else:
+                return
+
+    def at_end(self) -> bool:
+        self._skip_spaces()
+        cur = self._cur()
+        return cur == b""
+
+    def peek(self) -> bytes:
+        self._skip_spaces()
+        cur = self._cur()
+        if cur is None:
+            return b"{"
+        return cur[self.pos:self.pos + 1]
+
+    def read(self):
+        """アトム・文字列・リテラル・括弧リストを 1 つ読む"""
+        self._skip_spaces()
+        cur = self._cur()
+        if cur is None:
+            value = self.parts[self.idx][1]
+            self.idx += 1
+            self.pos = 0
+            # リテラル直前の "{n}" はテキスト側で読み飛ばし済み
+            return value
+        if cur == b"":
+            raise ValueError("unexpected end of command")
+        ch = cur[self.pos:self.pos + 1]
+        if ch == b"(":
+            self.pos += 1
+            items = []
+            while True:
+                if self.peek() == b")":
+                    self._skip_spaces()
+                    self.pos += 1
+                    return items
+                items.append(self.read())
+        if ch == b'"':
+            self.pos += 1
+            out = bytearray()
+            while self.pos < len(cur):
+                c = cur[self.pos:self.pos + 1]
+                if c == b"\\":
+                    out += cur[self.pos + 1:self.pos + 2]
+                    self.pos += 2
+                    continue
+                if c == b'"':
+                    self.pos += 1
+                    return bytes(out)
+                out += c
+                self.pos += 1
+            raise ValueError("unterminated quoted string")
+        if ch == b"{":
+            # "{n}" はリテラル本体が次のパートにある
+            end = cur.index(b"}", self.pos)
+            self.pos = end + 1
+            self._cur()
+            return self.read()
+        start = self.pos
+        depth = 0
+        while self.pos < len(cur):
+            c = cur[self.pos:self.pos + 1]
+            if c == b"[":
+                depth += 1
+            elif c == b"]":
+                depth -= 1
+            elif depth == 0 and c in (b" ", b")", b"("):
+                break
+            self.pos += 1
+        return cur[start:self.pos]
+
+
+# ---------------------------------------------------------------------------
+# レスポンス生成用ユーティリティ
+
+def _quote(value) -> bytes:
+    if value is None:
+        return b"NIL"
+    if isinstance(value, str):
+        value = value.encode("utf-8", "surrogateescape")
+    if all(32 <= b < 127 for b in value):
+        return b'"' + value.replace(b"\\", b"\\\\").replace(b'"', b'\\"') + b'"'
+    return b"{%d}\r\n" % len(value) + value
+
+
+def _raw_payload(part) -> bytes:
+    # get_payload() は 8bit 本文を charset で復号してしまうため、生の値を参照する
+    payload = part._payload
+    if isinstance(payload, list):
+        data = part.as_bytes()
+        idx = data.find(b"\n\n")
+        return data[idx + 2:] if idx >= 0 else b""
+    return payload.encode("ascii", "surrogateescape")
+
+
+def _params(part) -> bytes:
+    params = part.get_params()
+    if not params or len(params) <= 1:
+        return b"NIL"
+    items = []
+    for name, value in params[1:]:
+        if isinstance(value, tuple):
+            value = email.utils.collapse_rfc2231_value(value)
+        items.append(_quote(name.upper()) + b" " + _quote(str(value)))
+    return b"(" + b" ".join(items) + b")"
+
+
+def _disposition(part) -> bytes:
+    value = part.get("Content-Disposition")
+    if not value:
+        return b"NIL"
+    kind = value.split(";")[0].strip().upper()
+    filename = part.get_filename()
+    params = b"NIL"
+    if filename:
+        params = b'("FILENAME" ' + _quote(filename) + b")"
+    return b"(" + _quote(kind) + b" " + params + b")"
+
+
+def bodystructure(part) -> bytes:
+    """email.message.Message から BODYSTRUCTURE 文字列を組み立てる"""
+    if part.is_multipart():
+        children = b"".join(bodystructure(p) for p in part.get_payload())
+        subtype = part.get_content_subtype().upper()
+        return b"(" + children + b" " + _quote(subtype) + b" " + _params(part) + b" NIL NIL)"
+    maintype = part.get_content_maintype().upper()
+    subtype = part.get_content_subtype().upper()
+    raw = _raw_payload(part)
+    encoding = (part.get("Content-Transfer-Encoding") or "7BIT").strip().upper()
+    fields = [
+        _quote(maintype), _quote(subtype), _params(part),
+        _quote(part.get("Content-ID")), _quote(part.get("Content-Description")),
+        _quote(encoding), b"%d" % len(raw),
+    ]
+    if maintype == "TEXT":
+        fields.append(b"%d" % raw.count(b"\n"))
+    fields += [b"NIL", _disposition(part), b"NIL"]
+    return b"(" + b" ".join(fields) + b")"
+
+
+def _find_part(msg, section: str):
+    part = msg
+    for number in section.split("."):
+        n = int(number)
+        if part.is_multipart():
+            part = part.get_payload()[n - 1]
+        elif n != 1:
+            raise KeyError(section)
+    return part
+
+
+def _split_header(raw: bytes) -> Tuple[bytes, bytes]:
+    for sep in (b"\r\n\r\n", b"\n\n"):
+        idx = raw.find(sep)
+        if idx >= 0:
+            return raw[:idx + len(sep)], raw[idx + len(sep):]
+    return raw, b""
+
+
+def _header_fields(raw_header: bytes, names: List[bytes], negate: bool) -> bytes:
+    wanted = {n.upper() for n in names}
+    out = []
+    keep = False
+    for line in raw_header.splitlines(keepends=True):
+        if not line.strip():
+            continue
+        if line[:1] in (b" ", b"\t"):
+            if keep:
+                out.append(line)
+            continue
+        name = line.split(b":", 1)[0].strip().upper()
+        keep = (name in wanted) != negate
+        if keep:
+            out.append(line)
+    return b"".join(out).replace(b"\r\n", b"\n").replace(b"\n", b"\r\n") + b"\r\n"
+
+
+def _decode(value: Optional[str]) -> str:
+    if not value:
+        return ""
+    out = []
+    for text, charset in decode_header(value):
+        if isinstance(text, bytes):
+            text = text.decode(charset or "utf-8", errors="replace")
+        out.append(text)
+    return "".join(out)
+
+
+def _text_body(msg) -> str:
+    texts = []
+    for part in msg.walk():
+        if part.get_content_maintype() == "text":
+            data = part.get_payload(decode=True) or b""
+            texts.append(data.decode(part.get_content_charset() or "utf-8", errors="replace"))
+    return "\n".join(texts)
+
+
+def _parse_set(spec: bytes, maximum: int) -> List[Tuple[int, int]]:
+    ranges = []
+    for item in spec.decode().split(","):
+        if ":" in item:
+            a, b = item.split(":", 1)
+        else:
+            a = b = item
+        lo = maximum if a == "*" else int(a)
+        hi = maximum if b == "*" else int(b)
+        if lo > hi:
+            lo, hi = hi, lo
+        ranges.append((lo, hi))
+    return ranges
+
+
+def _in_set(value: int, ranges: List[Tuple[int, int]]) -> bool:
+    return any(lo <= value <= hi for lo, hi in ranges)
+
+
+_SET_RE = re.compile(rb"^(\d+|\*)(:(\d+|\*))?(,(\d+|\*)(:(\d+|\*))?)*$")
+
+
+# ---------------------------------------------------------------------------
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "_TCPServer"
+
+    def setup(self):
+        super().setup()
+        self.state = "auth"
+        self.mailbox: Optional[FakeMailbox] = None
+        self.readonly = False
+        with self.server.owner.stats.lock:
+            self.server.owner.stats.connections += 1
+
+    # --- I/O -----------------------------------------------------------------
+
+    def send(self, data: bytes) -> None:
+        if self.server.owner.latency:
+            time.sleep(self.server.owner.latency)
+        self.wfile.write(data)
+        self.wfile.flush()
+        with self.server.owner.stats.lock:
+            self.server.owner.stats.bytes_sent += len(data)
+
+    def readline(self) -> bytes:
+        line = self.rfile.readline()
+        with self.server.owner.stats.lock:
+            self.server.owner.stats.bytes_received += len(line)
+        return line
+
+    def read_command(self) -> Optional[List]:
+        line = self.readline()
+        if not line:
+            return None
+        parts = []
+        while True:
+            body = line.rstrip(b"\r\n")
+            m = re.search(rb"\{(\d+)\+?\}$", body)
+            if not m:
+                parts.append(body)
+                return parts
+            parts.append(body)
+            if not body.endswith(b"+}"):
+                self.send(b"+ Ready for literal data" + CRLF)
+            literal = self.rfile.read(int(m.group(1)))
+            with self.server.owner.stats.lock:
+                self.server.owner.stats.bytes_received += len(literal)
+            parts.append(("literal", literal))
+            line = self.readline()
+
+    # --- メインループ ----------------------------------------------------------
+
+    def handle(self):
+        self.send(b"* OK [CAPABILITY " + self.capability() + b"] Fake IMAP ready" + CRLF)
+        while True:
+            try:
+                parts = self.read_command()
+            except (ConnectionError, OSError):
+                return
+            if parts is None:
+                return
+            reader = _ArgReader(parts)
+            try:
+                tag = reader.read()
+                command = reader.read().upper()
+            except ValueError:
+                self.send(b"* BAD invalid command" + CRLF)
+                continue
+            uid = False
+            if command == b"UID":
+                uid = True
+                command = reader.read().upper()
+            self.server.owner.stats.command(("UID " if uid else "") + command.decode())
+            if self.server.owner.drop_after_commands is not None:
+                if self.server.owner.stats.total_commands() > self.server.owner.drop_after_commands:
+                    self.server.owner.drop_after_commands = None
+                    return
+            handler = getattr(self, "cmd_" + command.decode().lower().replace(".", "_"), None)
+            if handler is None:
+                self.send(tag + b" BAD unknown command" + CRLF)
+                continue
+            try:
+                if handler(tag, reader, uid) is False:
+                    return
+            except (ConnectionError, OSError):
+                return
+            except Exception as e:  # noqa: BLE001 - クライアントへ BAD を返す
+                self.send(tag + b" BAD " + str(e).encode("ascii", "replace") + CRLF)
+
+    def capability(self) -> bytes:
+        return b" ".join(self.server.owner.capabilities)
+
+    # --- コマンド --------------------------------------------------------------
+
+    def cmd_capability(self, tag, reader, uid):
+        self.send(b"* CAPABILITY " + self.capability() + CRLF)
+        self.send(tag + b" OK CAPABILITY completed" + CRLF)
+
+    def cmd_noop(self, tag, reader, uid):
+        self.report_exists()
+        if self.mailbox is not None:
+            with self.mailbox.lock:
+                self._snapshot_status()
+        self.send(tag + b" OK NOOP completed" + CRLF)
+
+    def cmd_login(self, tag, reader, uid):
+        user = reader.read().decode()
+        password = reader.read().decode()
+        owner = self.server.owner
+        if owner.users and owner.users.get(user) != password:
+            self.send(tag + b" NO [AUTHENTICATIONFAILED] Invalid credentials" + CRLF)
+            return
+        with owner.stats.lock:
+            owner.stats.logins += 1
+        self.state = "authenticated"
+        self.send(tag + b" OK [CAPABILITY " + self.capability() + b"] LOGIN completed" + CRLF)
+
+    def cmd_enable(self, tag, reader, uid):
+        enabled = []
+        while not reader.at_end():
+            cap = reader.read().upper()
+            if cap in self.server.owner.capabilities:
+                enabled.append(cap)
+        self.send(b"* ENABLED " + b" ".join(enabled) + CRLF)
+        self.send(tag + b" OK ENABLE completed" + CRLF)
+
+    def cmd_logout(self, tag, reader, uid):
+        self.send(b"* BYE logging out" + CRLF)
+        self.send(tag + b" OK LOGOUT completed" + CRLF)
+        return False
+
+    def _get_mailbox(self, name: bytes) -> FakeMailbox:
+        name = name.decode()
+        if name.upper() == "INBOX":
+            name = "INBOX"
+        mailbox = self.server.owner.mailboxes.get(name)
+        if mailbox is None:
+            raise KeyError(name)
+        return mailbox
+
+    def _condstore(self) -> bool:
+        return b"CONDSTORE" in self.server.owner.capabilities
+
+    def cmd_select(self, tag, reader, uid, readonly=False):
+        try:
+            mailbox = self._get_mailbox(reader.read())
+        except KeyError:
+            self.send(tag + b" NO Mailbox does not exist" + CRLF)
+            return
+        self.mailbox = mailbox
+        self.readonly = readonly
+        self.state = "selected"
+        with mailbox.lock:
+            count = len(mailbox.messages)
+            self.known_exists = count
+            self._snapshot_status()
+            lines = [
+                b"* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)",
+                b"* %d EXISTS" % count,
+                b"* 0 RECENT",
+                b"* OK [UIDVALIDITY %d] UIDs valid" % mailbox.uidvalidity,
+                b"* OK [UIDNEXT %d] Predicted next UID" % mailbox.uidnext,
+            ]
+            if self._condstore():
+                lines.append(b"* OK [HIGHESTMODSEQ %d] Highest" % mailbox.modseq)
+        mode = b"READ-ONLY" if readonly else b"READ-WRITE"
+        self.send(CRLF.join(lines) + CRLF + tag + b" OK [" + mode + b"] SELECT completed" + CRLF)
+
+    def _snapshot_status(self) -> None:
+        """選択中のフォルダの STATUS が返す値（一部のサーバーと同じく NOOP まで更新しない）"""
+        mailbox = self.mailbox
+        self.selected_status = {b"MESSAGES": len(mailbox.messages), b"UIDNEXT": mailbox.uidnext,
+                                b"HIGHESTMODSEQ": mailbox.modseq}
+
+    def cmd_examine(self, tag, reader, uid):
+        return self.cmd_select(tag, reader, uid, readonly=True)
+
+    def cmd_status(self, tag, reader, uid):
+        name = reader.read()
+        items = reader.read()
+        try:
+            mailbox = self._get_mailbox(name)
+        except KeyError:
+            self.send(tag + b" NO Mailbox does not exist" + CRLF)
+            return
+        out = []
+        # 選択中のフォルダには選択（か NOOP）の時点の値を返す（RFC 9051 6.3.11 が新着の確認に
+        # 使うことを禁じている、古い値を返すサーバーの再現）
+        stale = self.selected_status if mailbox is self.mailbox else {}
+        with mailbox.lock:
+            for item in items:
+                item = item.upper()
+                if item == b"MESSAGES":
+                    out.append(b"MESSAGES %d" % stale.get(item, len(mailbox.messages)))
+                elif item == b"UIDNEXT":
+                    out.append(b"UIDNEXT %d" % stale.get(item, mailbox.uidnext))
+                elif item == b"UIDVALIDITY":
+                    out.append(b"UIDVALIDITY %d" % mailbox.uidvalidity)
+                elif item == b"UNSEEN":
+                    unseen = sum(1 for m in mailbox.messages if "\\Seen" not in m["flags"])
+                    out.append(b"UNSEEN %d" % unseen)
+                elif item == b"RECENT":
+                    out.append(b"RECENT 0")
+                elif item == b"HIGHESTMODSEQ" and self._condstore():
+                    out.append(b"HIGHESTMODSEQ %d" % stale.get(item, mailbox.modseq))
+        # SELECT と同じく 1 回で送る（2 回に分けると Nagle と遅延 ACK で 40ms 待つことがある）
+        self.send(b"* STATUS " + _quote(mailbox.name) + b" (" + b" ".join(out) + b")" + CRLF
+                  + tag + b" OK STATUS completed" + CRLF)
+
+    def cmd_close(self, tag, reader, uid):
+        self.mailbox = None
+        self.state = "authenticated"
+        self.send(tag + b" OK CLOSE completed" + CRLF)
+
+    def cmd_unselect(self, tag, reader, uid):
+        self.mailbox = None
+        self.state = "authenticated"
+        self.send(tag + b" OK UNSELECT completed" + CRLF)
+
+    def report_exists(self) -> None:
+        if self.mailbox is None:
+            return
+        with self.mailbox.lock:
+            count = len(self.mailbox.messages)
+        if count != getattr(self, "known_exists", count):
+            self.send(b"* %d EXISTS" % count + CRLF)
+        self.known_exists = count
+
+    def cmd_idle(self, tag, reader, uid):
+        if b"IDLE" not in self.server.owner.capabilities:
+            self.send(tag + b" BAD IDLE not supported" + CRLF)
+            return
+        self.send(b"+ idling" + CRLF)
+        started = time.monotonic()
+        sock = self.connection
+        while True:
+            if self.server.owner.idle_timeout and time.monotonic() - started > self.server.owner.idle_timeout:
+                self.send(b"* BYE IDLE timed out" + CRLF)
+                return False
+            self.report_exists()
+            # クライアントは "+ idling" を受け取るまで DONE を送らないので、読み取りバッファは空
+            ready = (isinstance(sock, ssl.SSLSocket) and sock.pending()) or select.select([sock], [], [], 0.05)[0]
+            if ready:
+                line = self.readline()
+                if not line:
+                    return False
+                if line.strip().upper() == b"DONE":
+                    self.send(tag + b" OK IDLE terminated" + CRLF)
+                    return
+                self.send(tag + b" BAD expected DONE" + CRLF)
+                return
+
+    # --- SEARCH ---------------------------------------------------------------
+
+    def _messages(self) -> List[Tuple[int, Dict]]:
+        with self.mailbox.lock:
+            return list(enumerate(self.mailbox.messages, start=1))
+
+    def cmd_search(self, tag, reader, uid):
+        if self.mailbox is None:
+            self.send(tag + b" BAD no mailbox selected" + CRLF)
+            return
+        criteria = []
+        while not reader.at_end():
+            criteria.append(reader.read())
+        if criteria and isinstance(criteria[0], bytes) and criteria[0].upper() == b"CHARSET":
+            criteria = criteria[2:]
+        messages = self._messages()
+        max_uid = messages[-1][1]["uid"] if messages else 0
+        result = []
+        for seq, m in messages:
+            ctx = {"seq": seq, "msg": m, "max_seq": len(messages), "max_uid": max_uid}
+            items = list(criteria)
+            if self._match_all(items, ctx):
+                result.append(m["uid"] if uid else seq)
+        self.send(b"* SEARCH" + b"".join(b" %d" % n for n in result) + CRLF + tag + b" OK SEARCH completed" + CRLF)
+
+    def _match_all(self, items: List, ctx: Dict) -> bool:
+        ok = True
+        while items:
+            if not self._match_one(items, ctx):
+                ok = False
+        return ok
+
+    def _match_one(self, items: List, ctx: Dict) -> bool:
+        item = items.pop(0)
+        if isinstance(item, list):
+            return self._match_all(list(item), ctx)
+        key = item.upper()
+        m = ctx["msg"]
+        if key == b"ALL":
+            return True
+        if key == b"OR":
+            a = self._match_one(items, ctx)
+            b = self._match_one(items, ctx)
+            return a or b
+        if key == b"NOT":
+            return not self._match_one(items, ctx)
+        if key == b"UID":
+            return _in_set(m["uid"], _parse_set(items.pop(0), ctx["max_uid"]))
+        if key in (b"SINCE", b"BEFORE", b"ON"):
+            day = datetime.datetime.strptime(items.pop(0).decode(), "%d-%b-%Y").date()
+            date = m["date"].date()
+            return {b"SINCE": date >= day, b"BEFORE": date < day, b"ON": date == day}[key]
+        if key in (b"SUBJECT", b"BODY", b"TEXT", b"FROM", b"TO"):
+            needle = items.pop(0).decode("utf-8", "replace").lower()
+            msg = m["msg"]
+            if key == b"SUBJECT":
+                return needle in _decode(msg["Subject"]).lower()
+            if key == b"FROM":
+                return needle in _decode(msg["From"]).lower()
+            if key == b"TO":
+                return needle in _decode(msg["To"]).lower()
+            body = _text_body(msg).lower()
+            if key == b"BODY":
+                return needle in body
+            headers = " ".join(_decode(v) for v in msg.values()).lower()
+            return needle in body or needle in headers
+        if key == b"HEADER":
+            name = items.pop(0).decode()
+            needle = items.pop(0).decode("utf-8", "replace").lower()
+            return any(needle in _decode(value).lower() for value in m["msg"].get_all(name) or [])
+        if key in (b"SEEN", b"UNSEEN"):
+            return ("\\Seen" in m["flags"]) == (key == b"SEEN")
+        if key == b"MODSEQ":
+            return m["modseq"] >= int(items.pop(0))
+        if _SET_RE.match(item):
+            return _in_set(ctx["seq"], _parse_set(item, ctx["max_seq"]))
+        raise ValueError("unsupported search key " + key.decode())
+
+    # --- FETCH ----------------------------------------------------------------
+
+    def cmd_fetch(self, tag, reader, uid):
+        if self.mailbox is None:
+            self.send(tag + b" BAD no mailbox selected" + CRLF)
+            return
+        spec = reader.read()
+        items = reader.read()
+        if not isinstance(items, list):
+            items = [items]
+        items = [i.upper() if isinstance(i, bytes) else i for i in items]
+        macros = {b"ALL": [b"FLAGS", b"INTERNALDATE", b"RFC822.SIZE"],
+                  b"FAST": [b"FLAGS", b"INTERNALDATE", b"RFC822.SIZE"],
+                  b"FULL": [b"FLAGS", b"INTERNALDATE", b"RFC822.SIZE", b"BODYSTRUCTURE"]}
+        if len(items) == 1 and items[0] in macros:
+            items = macros[items[0]]
+        if uid and b"UID" not in items:
+            items = [b"UID"] + items
+        messages = self._messages()
+        if not messages:
+            self.send(tag + b" OK FETCH completed" + CRLF)
+            return
+        ranges = _parse_set(spec, messages[-1][1]["uid"] if uid else len(messages))
+        out = bytearray()
+        for seq, m in messages:
+            if not _in_set(m["uid"] if uid else seq, ranges):
+                continue
+            out += b"* %d FETCH (" % seq + b" ".join(self._fetch_item(m, i) for i in items) + b")" + CRLF
+        self.send(bytes(out) + tag + b" OK FETCH completed" + CRLF)
+
+    def _fetch_item(self, m: Dict, item: bytes) -> bytes:
+        msg = m["msg"]
+        raw = m["raw"]
+        if item == b"UID":
+            return b"UID %d" % m["uid"]
+        if item == b"FLAGS":
+            return b"FLAGS (" + " ".join(sorted(m["flags"])).encode() + b")"
+        if item == b"INTERNALDATE":
+            return b'INTERNALDATE "' + m["date"].strftime("%d-%b-%Y %H:%M:%S +0000").encode() + b'"'
+        if item == b"RFC822.SIZE":
+            return b"RFC822.SIZE %d" % len(raw)
+        if item == b"BODYSTRUCTURE":
+            return b"BODYSTRUCTURE " + bodystructure(msg)
+        if item == b"RFC822":
+            if not self.readonly:
+                m["flags"].add("\\Seen")
+            return b"RFC822 {%d}\r\n" % len(raw) + raw
+        if item == b"RFC822.HEADER":
+            header, _ = _split_header(raw)
+            return b"RFC822.HEADER {%d}\r\n" % len(header) + header
+        if item == b"MODSEQ":
+            return b"MODSEQ (%d)" % m["modseq"]
+        match = re.match(rb"^BODY(\.PEEK)?\[(.*)\](<(\d+)(\.(\d+))?>)?$", item, re.S)
+        if not match:
+            raise ValueError("unsupported fetch item " + item.decode())
+        peek, section = match.group(1), match.group(2).decode()
+        if not peek and not self.readonly:
+            m["flags"].add("\\Seen")
+        data = self._section(msg, raw, section)
+        name = "BODY[" + section + "]"
+        if match.group(3):
+            start = int(match.group(4))
+            length = int(match.group(6)) if match.group(6) else len(data)
+            data = data[start:start + length]
+            name += "<%d>" % start
+        return name.encode() + b" {%d}\r\n" % len(data) + data
+
+    def _section(self, msg, raw: bytes, section: str) -> bytes:
+        upper = section.upper()
+        if upper == "":
+            return raw
+        header, body = _split_header(raw)
+        if upper == "HEADER":
+            return header
+        if upper == "TEXT":
+            return body
+        fields = re.match(r"^HEADER\.FIELDS(\.NOT)?\s*\((.*)\)$", upper)
+        if fields:
+            names = fields.group(2).encode().split()
+            return _header_fields(header, names, bool(fields.group(1)))
+        path = upper
+        mime = False
+        if path.endswith(".MIME"):
+            path, mime = path[:-5], True
+        part = _find_part(msg, path)
+        if mime:
+            data = part.as_bytes()
+            return _split_header(data)[0]
+        return _raw_payload(part)
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeImapServer:
+    """スレッドで動くローカル IMAP サーバー"""
+
+    def __init__(self, mailboxes: Optional[Dict[str, FakeMailbox]] = None,
+                 users: Optional[Dict[str, str]] = None,
+                 host: str = "127.0.0.1", port: int = 0,
+                 ssl_context: Optional[ssl.SSLContext] = None,
+                 capabilities: Optional[List[bytes]] = None,
+                 latency: float = 0.0):
+        self.mailboxes = mailboxes if mailboxes is not None else {"INBOX": FakeMailbox("INBOX")}
+        self.users = users or {}
+        self.capabilities = capabilities or [b"IMAP4rev1", b"IDLE", b"UIDPLUS", b"ENABLE", b"UTF8=ACCEPT", b"UNSELECT"]
+        self.latency = latency
+        self.idle_timeout: Optional[float] = None
+        self.drop_after_commands: Optional[int] = None
+        self.stats = ServerStats()
+        self.ssl_context = ssl_context
+        self._server = _TCPServer((host, port), _Handler)
+        self._server.owner = self
+        if ssl_context is not None:
+            self._server.socket = ssl_context.wrap_socket(self._server.socket, server_side=True)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self) -> "FakeImapServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeImapServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def make_self_signed_context(directory: Optional[str] = None) -> Tuple[ssl.SSLContext, str]:
+    """openssl コマンドで自己署名証明書を作り、サーバー用 SSLContext と証明書パスを返す"""
+    directory = directory or tempfile.mkdtemp(prefix="fake-imap-")
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    if not os.path.exists(cert):
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+             "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1,DNS:localhost",
+             "-keyout", key, "-out", cert],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context, cert
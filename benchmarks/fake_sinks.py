@@ -0,0 +1,131 @@
+"""
+通知の動作確認用のローカル SMTP サーバーと webhook サーバー
+
+どちらもスレッドで動き、受け取った通知を記録する。latency で応答を遅らせ、
+fail_first で最初の N 回を失敗させる（SMTP は 451、webhook は 500 を返す）。
+"""
+import email
+import email.policy
+import http.server
+import json
+import socketserver
+import threading
+import time
+from typing import Dict, List, Tuple
+
+CRLF = b"\r\n"
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def send(self, line: str) -> None:
+        self.wfile.write(line.encode() + CRLF)
+        self.wfile.flush()
+
+    def handle(self):
+        owner = self.server.owner
+        self.send("220 fake-smtp ready")
+        recipients: List[str] = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.send("250 fake-smtp")
+            elif verb == "MAIL":
+                recipients = []
+                self.send("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip(" <>"))
+                self.send("250 OK")
+            elif verb == "DATA":
+                self.send("354 end with .")
+                data = []
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b".\r\n", b".\n", b""):
+                        break
+                    data.append(line[1:] if line.startswith(b"..") else line)
+                time.sleep(owner.latency)
+                if owner.should_fail():
+                    self.send("451 temporary failure")
+                    continue
+                message = email.message_from_bytes(b"".join(data), policy=email.policy.default)
+                with owner.lock:
+                    owner.received.append((recipients, message))
+                self.send("250 queued")
+            elif verb == "QUIT":
+                self.send("221 bye")
+                return
+            else:
+                self.send("250 OK")
+
+
+class _WebhookHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        owner = self.server.owner
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(owner.latency)
+        if owner.should_fail():
+            self.send_response(500)
+            self.end_headers()
+            return
+        with owner.lock:
+            owner.received.append(json.loads(body))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _FakeServer:
+    def __init__(self, handler, latency: float = 0.0, fail_first: int = 0):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.attempts = 0
+        self.received: List = []
+        self.lock = threading.Lock()
+        self._server = _TCPServer(("127.0.0.1", 0), handler)
+        self._server.owner = self
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            self.attempts += 1
+            return self.attempts <= self.fail_first
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeSmtpServer(_FakeServer):
+    def __init__(self, latency: float = 0.0, fail_first: int = 0):
+        super().__init__(_SmtpHandler, latency, fail_first)
+
+    def sink_config(self) -> Dict:
+        host, port = self.address
+        return {"type": "smtp", "host": host, "port": port, "to": ["ops@example.com"]}
+
+
+class FakeWebhookServer(_FakeServer):
+    def __init__(self, latency: float = 0.0, fail_first: int = 0):
+        super().__init__(_WebhookHandler, latency, fail_first)
+
+    def sink_config(self) -> Dict:
+        host, port = self.address
+        return {"type": "webhook", "url": f"http://{host}:{port}/hook"}
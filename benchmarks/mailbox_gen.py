@@ -0,0 +1,127 @@
+"""
+ベンチマーク用の合成メールボックス生成
+
+件数、本文サイズの分布、添付ファイルの割合、multipart と文字コードの混在、
+日本語件名の割合を指定してメールのバイト列を作る。hit_ratio の割合のメールには
+キーのいずれかを件名か本文に埋め込む。同じ seed からは同じメールボックスができる。
+"""
+import datetime
+import email.utils
+import math
+import random
+from email.header import Header
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Dict, Iterator, List, Optional
+
+JA_WORDS = [
+    "請求書", "納品書", "見積書", "領収書", "ご注文確認", "お支払いのお知らせ", "月次報告", "日報",
+    "障害報告", "定期メンテナンス", "会議のご案内", "契約更新", "出荷のお知らせ", "パスワード変更",
+]
+EN_WORDS = [
+    "invoice", "receipt", "order", "report", "alert", "weekly", "newsletter", "update",
+    "meeting", "reminder", "shipment", "account", "security", "summary",
+]
+KANA = "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん"
+KANJI = "東京大阪名古屋福岡札幌仙台広島神戸京都横浜千葉埼玉株式会社部課係担当者様御中各位本日確認送付"
+
+DEFAULT_CHARSETS = {"utf-8": 5, "iso-2022-jp": 3, "shift_jis": 1, "us-ascii": 1}
+
+
+def make_keys(count: int, seed: int = 0) -> List[str]:
+    """照合用のキー（日本語と英数字の混在）"""
+    rng = random.Random(seed)
+    keys = set()
+    while len(keys) < count:
+        if rng.random() < 0.6:
+            keys.add(rng.choice(JA_WORDS) + "".join(rng.choice(KANJI) for _ in range(rng.randint(1, 3))))
+        else:
+            keys.add(f"{rng.choice(EN_WORDS).upper()}-{rng.randint(1000, 99999)}")
+    return sorted(keys)
+
+
+class MailboxGenerator:
+    def __init__(self, seed: int = 0, mean_body_bytes: int = 4000, size_sigma: float = 1.0,
+                 attachment_ratio: float = 0.1, attachment_bytes: int = 200_000,
+                 multipart_ratio: float = 0.3, charsets: Optional[Dict[str, float]] = None,
+                 japanese_subject_ratio: float = 0.7, keys: Optional[List[str]] = None,
+                 hit_ratio: float = 0.05):
+        self.rng = random.Random(seed)
+        self.mean_body_bytes = mean_body_bytes
+        self.size_sigma = size_sigma
+        self.attachment_ratio = attachment_ratio
+        self.attachment_bytes = attachment_bytes
+        self.multipart_ratio = multipart_ratio
+        charsets = charsets or DEFAULT_CHARSETS
+        self.charset_names = list(charsets)
+        self.charset_weights = [charsets[name] for name in self.charset_names]
+        self.japanese_subject_ratio = japanese_subject_ratio
+        self.keys = keys or []
+        self.hit_ratio = hit_ratio
+
+    def _body_size(self) -> int:
+        # 対数正規分布 LN(0, σ) の平均 exp(σ²/2) で割り、平均が mean_body_bytes になるようにする
+        size = self.rng.lognormvariate(0.0, self.size_sigma)
+        return max(16, int(self.mean_body_bytes * size / math.exp(self.size_sigma ** 2 / 2)))
+
+    def _text(self, size: int, japanese: bool) -> str:
+        rng = self.rng
+        parts = []
+        length = 0
+        while length < size:
+            if japanese:
+                word = "".join(rng.choice(KANA) for _ in range(rng.randint(2, 6))) + rng.choice("、。")
+                length += len(word) * 3
+            else:
+                word = rng.choice(EN_WORDS) + " "
+                length += len(word)
+            parts.append(word)
+        return "".join(parts)
+
+    def message(self, date: datetime.datetime) -> bytes:
+        rng = self.rng
+        charset = rng.choices(self.charset_names, self.charset_weights)[0]
+        japanese = charset != "us-ascii"
+        if japanese and rng.random() < self.japanese_subject_ratio:
+            subject = rng.choice(JA_WORDS) + " " + "".join(rng.choice(KANJI) for _ in range(rng.randint(2, 8)))
+        else:
+            subject = f"{rng.choice(EN_WORDS).capitalize()} {rng.randint(1, 9999)}"
+        body = self._text(self._body_size(), japanese)
+
+        if self.keys and rng.random() < self.hit_ratio:
+            key = rng.choice(self.keys)
+            if not japanese and not key.isascii():
+                charset = "utf-8"
+            if rng.random() < 0.5:
+                subject = f"{subject} {key}"
+            else:
+                body = f"{body}\n{key}\n"
+
+        text = MIMEText(body, "plain", charset)
+        if rng.random() < self.attachment_ratio:
+            msg = MIMEMultipart()
+            msg.attach(text)
+            attachment = MIMEApplication(rng.randbytes(self.attachment_bytes), "octet-stream")
+            attachment.add_header("Content-Disposition", "attachment", filename=f"file{rng.randint(1, 999)}.bin")
+            msg.attach(attachment)
+        elif rng.random() < self.multipart_ratio:
+            msg = MIMEMultipart("alternative")
+            msg.attach(text)
+            msg.attach(MIMEText(f"<html><body><p>{body[:200]}</p></body></html>", "html", "utf-8"))
+        else:
+            msg = text
+
+        msg["Subject"] = Header(subject, charset if not subject.isascii() else "us-ascii")
+        msg["From"] = f"sender{rng.randint(1, 50)}@example.com"
+        msg["To"] = "monitor@example.com"
+        msg["Date"] = email.utils.format_datetime(date.astimezone())
+        msg["Message-ID"] = email.utils.make_msgid(idstring=str(rng.getrandbits(48)), domain="example.com")
+        return msg.as_bytes()
+
+    def messages(self, count: int, days: float = 3.0) -> Iterator[bytes]:
+        """直近 days 日に均等に散らばった count 通を古い順に返す"""
+        now = datetime.datetime.now()
+        for i in range(count):
+            offset = datetime.timedelta(days=days * (count - i) / max(count, 1))
+            yield self.message(now - offset)
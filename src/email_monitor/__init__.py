@@ -0,0 +1,8 @@
+"""
+キー文字列を含むメールの受信を IMAP などで監視し、予想される頻度で届かないものを検出する
+
+コマンドラインからの起動を速くするため、ここではサブモジュールを読み込まない
+（email_monitor.monitor.EmailMonitor などを直接 import する）。
+"""
+
+__version__ = "0.2.0"
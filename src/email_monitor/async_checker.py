@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from .local_source import source_id
+from .uid_state import UidState
+
+logger = logging.getLogger("AsyncChecker")
+
+
+class AsyncChecker:
+    """
+    複数のアカウント・フォルダを並行してチェックする
+
+    IMAP の通信とメールの照合はワーカースレッドで行い、同時に走る数を
+    max_concurrency で制限する。各フォルダの走査には account_timeout 秒の
+    制限があり、アカウントごとに上書きできる。キーと UID 状態への反映は
+    イベントループのスレッドだけで行い、1 サイクルの最後にまとめて保存する。
+    local_sources の mbox / Maildir も IMAP のフォルダと並行して走査する。
+    IMAP のフォルダは STATUS が前回と同じなら走査を省略する（EmailMonitor.scan_folder）。
+    only を指定した場合は、そのフォルダ ID（UID 状態と同じ）のものだけを走査する。
+    失敗したフォルダはログに出して数え、UID の位置を進めずに次のサイクルで再試行する。
+    """
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+
+    async def check_all(self, only: Optional[Set[str]] = None, raise_if_all_failed: bool = False) -> Dict:
+        """
+        1 サイクル分のチェックを行い、キーごとの検出の有無を返す
+
+        一部のフォルダが失敗しても残りの結果は反映する。raise_if_all_failed が True の場合だけ、
+        すべてのフォルダが失敗したときに最初の例外を送出する（単発の check コマンド用）。
+        """
+        monitor = self.monitor
+        config = monitor.config_manager.config
+        started = time.perf_counter()
+        keys = monitor.config_manager.keys
+        key_names = list(keys)
+        results = {key: False for key in keys}
+        semaphore = asyncio.Semaphore(config.get("max_concurrency", 4))
+
+        targets = [(account, folder)
+                   for account in monitor.config_manager.get_accounts()
+                   for folder in account["folders"]] if config.get("imap_enabled", True) else []
+        sources = config.get("local_sources") or []
+        if only is not None:
+            targets = [(account, folder) for account, folder in targets
+                       if UidState.folder_id(account, folder) in only]
+            sources = [source for source in sources if source_id(source) in only]
+        logger.info(f"メールチェックを開始 ({len(targets)} フォルダ, ローカル {len(sources)} 件, "
+                    f"同時実行 {config.get('max_concurrency', 4)})")
+
+        outcomes = await asyncio.gather(
+            *(self._check_folder(account, folder, key_names, semaphore) for account, folder in targets),
+            *(self._check_local(source, key_names, results, semaphore) for source in sources),
+            return_exceptions=True,
+        )
+        local_outcomes = outcomes[len(targets):]
+        outcomes = outcomes[:len(targets)]
+
+        scans: List[Dict] = []
+        errors: List[BaseException] = []
+        matches = 0
+        for (account, folder), outcome in zip(targets, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error(f"{account['email']}/{folder} のチェックに失敗: {outcome!r}")
+                errors.append(outcome)
+            else:
+                matches += monitor.apply_scan(outcome, results)
+                scans.append(outcome)
+        for source, outcome in zip(sources, local_outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error(f"{source['path']} のチェックに失敗: {outcome!r}")
+                errors.append(outcome)
+            else:
+                local_scans, local_matches = outcome
+                scans.extend(local_scans)
+                matches += local_matches
+        skipped = sum(1 for scan in scans if scan.get("skipped"))
+        if targets:
+            logger.info(f"{len(targets)} フォルダのうち {skipped} フォルダは前回から変更が無いため走査を省略しました")
+        # 走査をすべて省略した場合は保存するものが無い
+        save_seconds = monitor.save_state() if len(scans) > skipped else 0.0
+        monitor.last_cycle_stats = self._merge_stats(scans, len(errors))
+        monitor.last_cycle_stats["save_seconds"] = save_seconds
+        monitor.observe_cycle(monitor.last_cycle_stats, time.perf_counter() - started, matches, len(errors))
+
+        if errors:
+            logger.warning(f"{len(targets) + len(sources)} 件のうち {len(errors)} 件のチェックに失敗しました。"
+                           f"失敗したものは次のチェックで再試行します")
+            if raise_if_all_failed and not scans:
+                raise errors[0]
+        return results
+
+    async def _check_folder(self, account: Dict, folder: str, key_names: List[str],
+                            semaphore: asyncio.Semaphore) -> Dict:
+        timeout = account.get("account_timeout", 300)
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(
+                    asyncio.to_thread(self.monitor.scan_folder, account, folder, key_names), timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"{account['email']}/{folder} のチェックが {timeout}秒でタイムアウトしました")
+                # 実行中のスレッドはソケットを閉じることで中断させる
+                self.monitor.session_pool(account).invalidate(folder)
+                raise
+
+    async def _check_local(self, source: Dict, key_names: List[str], results: Dict,
+                           semaphore: asyncio.Semaphore) -> Tuple[List[Dict], int]:
+        """
+        mbox / Maildir を local_chunk_bytes ごとに読み、読んだ分ずつ反映・保存する
+
+        大きなファイルでも途中までの位置が保存されるため、中断しても続きから再開できる。
+        """
+        monitor = self.monitor
+        chunk_bytes = monitor.config_manager.config.get("local_chunk_bytes", 64 * 1024 * 1024)
+        scans = []
+        matches = 0
+        while True:
+            async with semaphore:
+                scan = await asyncio.to_thread(monitor.scan_local, source, key_names, chunk_bytes)
+            matches += monitor.apply_scan(scan, results)
+            scans.append(scan)
+            if scan["complete"]:
+                return scans, matches
+            monitor.save_state()
+
+    @staticmethod
+    def _merge_stats(scans: List[Dict], errors: int) -> Dict:
+        merged: Dict = {"folders": {}, "errors": errors}
+        for scan in scans:
+            merged["folders"][scan["folder_id"]] = scan["stats"]
+            for name, value in scan["stats"].items():
+                if isinstance(value, (int, float)):
+                    merged[name] = merged.get(name, 0) + value
+        return merged
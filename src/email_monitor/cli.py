@@ -0,0 +1,152 @@
+"""
+コマンドライン（email-monitor / python -m email_monitor）
+
+list や add はプロビジョニングのスクリプトから頻繁に呼ばれるため、IMAP・MIME・SSL の
+モジュール（monitor 以下）はそれらを使うコマンドでだけ読み込む。起動時間は
+benchmarks/bench_startup.py で確認できる。
+"""
+import logging
+import sys
+import time
+
+from .config_manager import ConfigManager
+from .utils import setup_logging
+
+USAGE = ("使用法: email-monitor [add <key> [description] [frequency]|remove <key>|check [--metrics-json <path>]|"
+         "list|backfill|ingest <mbox|Maildir> [mbox|maildir]|import-json [keys.json]|compact-history|"
+         "coordinator|worker [worker_id]|cluster-status|plan [hours]]")
+
+# IMAP への接続や常駐を伴うコマンド（INFO のログをファイルにも出力する）
+MONITOR_COMMANDS = ("check", "backfill", "ingest", "coordinator", "worker")
+
+
+def _create_monitor(config_manager: ConfigManager):
+    from .monitor import EmailMonitor
+    return EmailMonitor(config_manager)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command is None or command in MONITOR_COMMANDS:
+        setup_logging(logging.INFO, "email_monitor.log")
+    else:
+        setup_logging(logging.WARNING)
+    config_manager = ConfigManager()
+
+    if command is not None:
+        if command == "add" and len(sys.argv) >= 3:
+            description = sys.argv[3] if len(sys.argv) > 3 else None
+            frequency = sys.argv[4] if len(sys.argv) > 4 else "daily"
+            config_manager.add_key(sys.argv[2], description, frequency)
+            # キャッシュ済みのメールから受信履歴を埋める（キャッシュが無ければ何もしない）
+            from .message_cache import backfill, open_message_cache
+            cache = open_message_cache(config_manager.config, create=False)
+            if cache is not None:
+                backfill(config_manager, cache, [sys.argv[2]])
+                cache.close()
+        elif command == "remove" and len(sys.argv) >= 3:
+            config_manager.remove_key(sys.argv[2])
+        elif command == "check":
+            email_monitor = _create_monitor(config_manager)
+            # --metrics-json <path> でチェックのメトリクスを JSON で書き出す（"-" は標準出力）
+            metrics_path = None
+            if "--metrics-json" in sys.argv:
+                index = sys.argv.index("--metrics-json")
+                metrics_path = sys.argv[index + 1] if len(sys.argv) > index + 1 else "-"
+                email_monitor.metrics.enabled = True
+            results = email_monitor.check_emails(raise_if_all_failed=True)
+            missing = email_monitor.check_missing_emails()
+            email_monitor.notifier.missing(missing)
+            # 通知の送信が終わるまで待つ
+            email_monitor.close()
+            print(f"チェック結果: {results}")
+            print(f"未着メール: {missing}")
+            if metrics_path == "-":
+                print(email_monitor.metrics.to_json())
+            elif metrics_path:
+                with open(metrics_path, "w", encoding="utf-8") as f:
+                    f.write(email_monitor.metrics.to_json())
+        elif command == "backfill":
+            email_monitor = _create_monitor(config_manager)
+            added = email_monitor.backfill()
+            for key, count in added.items():
+                print(f"キー: {key}  追加した履歴: {count} 件")
+        elif command == "ingest" and len(sys.argv) >= 3:
+            # mbox / Maildir のアーカイブから受信履歴を作る（種類を省略した場合は自動判定）
+            source = {"path": sys.argv[2]}
+            if len(sys.argv) > 3:
+                source["type"] = sys.argv[3]
+            email_monitor = _create_monitor(config_manager)
+            results = email_monitor.ingest(source)
+            email_monitor.close()
+            print(f"取り込み結果: {results}")
+        elif command == "import-json":
+            # keys.json の内容を SQLite バックエンドに取り込む（storage が "sqlite" の場合のみ）
+            json_path = sys.argv[2] if len(sys.argv) > 2 else config_manager.keys_path
+            if not hasattr(config_manager.store, "import_json"):
+                print("import-json は storage が \"sqlite\" の場合に使用します")
+                return
+            count = config_manager.store.import_json(json_path)
+            print(f"{count} 個のキーを取り込みました")
+        elif command == "compact-history":
+            # 検出ログを現在の履歴だけに書き直す（storage が "json" の場合のみ。保存時にも自動で行う）
+            if not hasattr(config_manager.store, "compact"):
+                print("compact-history は storage が \"json\" の場合に使用します")
+                return
+            config_manager.compact_history()
+            print(f"検出ログを書き直しました: {config_manager.store.log.records} 件")
+        elif command == "coordinator":
+            # 作業項目を登録し、ワーカーの検出結果をキーの状態に統合する
+            from .cluster import Coordinator
+            email_monitor = _create_monitor(config_manager)
+            email_monitor.start_metrics_server()
+            Coordinator(email_monitor).run()
+        elif command == "worker":
+            from .cluster import Worker
+            worker_id = sys.argv[2] if len(sys.argv) > 2 else None
+            Worker(_create_monitor(config_manager), worker_id).run()
+        elif command == "cluster-status":
+            from .cluster import LeaseStore
+            store = LeaseStore(config_manager.config.get("cluster_path", "cluster.db"))
+            status = store.status()
+            store.close()
+            now = time.time()
+            for item in status["items"]:
+                owner = f"{item['owner']} (残り {item['lease_until'] - now:.0f}秒)" if item["owner"] else "-"
+                print(f"{item['item_id']}  担当: {owner}  UID: {item['last_uid']}  "
+                      f"次回: {max(item['next_run'] - now, 0):.0f}秒後  失敗: {item['failures']}")
+            for worker in status["workers"]:
+                print(f"ワーカー {worker['worker_id']}  処理 {worker['items_done']} 件  "
+                      f"最終応答 {now - worker['heartbeat']:.0f}秒前")
+            print(f"未統合の検出: {status['pending_detections']} 件")
+        elif command == "plan":
+            # poll_mode が "adaptive" の場合のチェック予定を、新着が無いものとして表示する（IMAP には接続しない）
+            from .cluster import work_items
+            from .poll_scheduler import PollScheduler, format_plan
+            hours = float(sys.argv[2]) if len(sys.argv) > 2 else 24
+            scheduler = PollScheduler(config_manager.config)
+            scheduler.refresh(config_manager.keys)
+            folder_ids = [item_id for item_id, _, _ in work_items(config_manager)]
+            print(f"基本の間隔: {scheduler.base_interval:.0f}秒")
+            for line in format_plan(scheduler.plan(folder_ids, time.time(), hours),
+                                    config_manager.config["check_interval"], hours):
+                print(line)
+        elif command == "list":
+            keys = config_manager.list_keys()
+            for key, data in keys.items():
+                print(f"キー: {key}")
+                print(f"  説明: {data['description']}")
+                print(f"  予想頻度: {data['expected_frequency']}")
+                print(f"  最終受信: {data['last_received'] or '未受信'}")
+                print("")
+        else:
+            print(USAGE)
+        return
+
+    email_monitor = _create_monitor(config_manager)
+    email_monitor.start_metrics_server()
+    if config_manager.config.get("idle", False):
+        email_monitor.run_idle_daemon()
+    else:
+        email_monitor.run_scheduled_check()
+
@@ -0,0 +1,464 @@
+"""
+コーディネーター / ワーカーによる分散チェック
+
+監視するフォルダ（アカウント × フォルダ、local_sources の mbox / Maildir）を作業項目として
+共有の SQLite（cluster_path、既定 cluster.db）に登録し、複数のワーカープロセスが期限付きの
+リースで 1 件ずつ取得して既存の走査処理（scan_folder / scan_local）で処理する。
+ワーカーが停止するとリースが切れ、別のワーカーが同じ項目を取得する。
+
+UID の位置（folder_precheck の STATUS の結果を含む）と処理済みメールの索引も同じデータベースに置き、走査結果の反映はリースを
+取得したときのトークンが変わっていない場合だけ 1 トランザクションで行う（リースが
+切れて別のワーカーが取得した後の古い結果は捨てる）。検出結果はコーディネーターが
+まとめてキーの状態に統合する。
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .local_source import source_id
+from .uid_state import UidState
+
+logger = logging.getLogger("Cluster")
+
+IMAP = "imap"
+LOCAL = "local"
+
+
+class LeaseStore:
+    """作業項目・リース・UID の位置・処理済みメール・未統合の検出結果を保存する"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS work_items (
+            item_id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            interval REAL NOT NULL,
+            next_run REAL NOT NULL DEFAULT 0,
+            owner TEXT,
+            lease_until REAL NOT NULL DEFAULT 0,
+            token INTEGER NOT NULL DEFAULT 0,
+            uidvalidity INTEGER,
+            last_uid INTEGER,
+            status TEXT,
+            last_done REAL,
+            failures INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS work_items_next_run ON work_items(next_run);
+        CREATE TABLE IF NOT EXISTS seen (
+            message_key TEXT PRIMARY KEY,
+            seen_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS seen_age ON seen(seen_at);
+        CREATE TABLE IF NOT EXISTS detections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT NOT NULL,
+            date TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            worker TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS workers (
+            worker_id TEXT PRIMARY KEY,
+            heartbeat REAL NOT NULL,
+            items_done INTEGER NOT NULL DEFAULT 0
+        );
+    """
+
+    def __init__(self, path: str = "cluster.db"):
+        self.path = path
+        # トランザクションは BEGIN IMMEDIATE で明示的に始める
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        """以前のバージョンで作ったデータベースに無い列を追加する"""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(work_items)")}
+        if "status" not in columns:
+            self.conn.execute("ALTER TABLE work_items ADD COLUMN status TEXT")
+
+    @staticmethod
+    def _encode_status(status: Optional[Dict[str, int]]) -> Optional[str]:
+        return None if status is None else json.dumps(status, sort_keys=True)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def sync_items(self, items: List[Tuple[str, str, float]], watermarks: Dict[str, Dict]) -> Tuple[int, int]:
+        """
+        (項目 ID, 種類, 間隔) の一覧に作業項目を合わせ、(追加数, 削除数) を返す
+
+        新しい項目の UID の位置は watermarks（単独で動かしていたときの UID 状態）から引き継ぐ。
+        """
+        with self._transaction() as conn:
+            existing = {row[0] for row in conn.execute("SELECT item_id FROM work_items")}
+            wanted = {item_id for item_id, _, _ in items}
+            for item_id, kind, interval in items:
+                if item_id in existing:
+                    conn.execute("UPDATE work_items SET kind = ?, interval = ? WHERE item_id = ?",
+                                 (kind, interval, item_id))
+                    continue
+                state = watermarks.get(item_id) or {}
+                conn.execute(
+                    """INSERT INTO work_items (item_id, kind, interval, uidvalidity, last_uid, status)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (item_id, kind, interval, state.get("uidvalidity"), state.get("last_uid"),
+                     self._encode_status(state.get("status"))))
+            removed = existing - wanted
+            conn.executemany("DELETE FROM work_items WHERE item_id = ?", [(item_id,) for item_id in removed])
+        return len(wanted - existing), len(removed)
+
+    def claim(self, worker_id: str, lease_seconds: float, now: Optional[float] = None) -> Optional[Dict]:
+        """実行時刻を過ぎていてリースの無い（切れた）項目を 1 件取得する"""
+        now = time.time() if now is None else now
+        with self._transaction() as conn:
+            conn.execute(
+                """INSERT INTO workers (worker_id, heartbeat) VALUES (?, ?)
+                   ON CONFLICT(worker_id) DO UPDATE SET heartbeat = excluded.heartbeat""", (worker_id, now))
+            row = conn.execute(
+                """SELECT item_id, kind, interval, token, uidvalidity, last_uid, status, failures, owner FROM work_items
+                   WHERE next_run <= ? AND (owner IS NULL OR lease_until < ?)
+                   ORDER BY next_run LIMIT 1""", (now, now)).fetchone()
+            if row is None:
+                return None
+            item_id, kind, interval, token, uidvalidity, last_uid, status, failures, previous_owner = row
+            conn.execute("UPDATE work_items SET owner = ?, lease_until = ?, token = ? WHERE item_id = ?",
+                         (worker_id, now + lease_seconds, token + 1, item_id))
+        if previous_owner is not None:
+            logger.warning(f"{item_id}: {previous_owner} のリースが切れたため引き継ぎます")
+        return {"item_id": item_id, "kind": kind, "interval": interval, "token": token + 1,
+                "uidvalidity": uidvalidity, "last_uid": last_uid, "status": json.loads(status) if status else None,
+                "failures": failures}
+
+    def renew(self, item: Dict, worker_id: str, lease_seconds: float) -> bool:
+        """リースを延長する。別のワーカーに取得されていた場合は False"""
+        now = time.time()
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE work_items SET lease_until = ? WHERE item_id = ? AND owner = ? AND token = ?",
+                (now + lease_seconds, item["item_id"], worker_id, item["token"])).rowcount
+            conn.execute("UPDATE workers SET heartbeat = ? WHERE worker_id = ?", (now, worker_id))
+        return updated == 1
+
+    def complete(self, item: Dict, worker_id: str, scan: Dict, next_run: float) -> Optional[int]:
+        """
+        走査結果を反映してリースを返し、記録した検出の数を返す
+
+        リースを失っていた場合は何も反映せず None を返す。他のフォルダで先に処理済みに
+        なったメールの検出は記録しない。
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, token FROM work_items WHERE item_id = ?", (item["item_id"],)).fetchone()
+            if row is None or row[0] != worker_id or row[1] != item["token"]:
+                return None
+            new_keys = set()
+            for message_key in scan["message_keys"]:
+                if conn.execute("INSERT OR IGNORE INTO seen VALUES (?, ?)", (message_key, now)).rowcount:
+                    new_keys.add(message_key)
+            rows = [(key, email_date.isoformat(), subject, item["item_id"], worker_id)
+                    for key, email_date, subject, message_key in scan["detections"] if message_key in new_keys]
+            conn.executemany(
+                "INSERT INTO detections (key, date, subject, item_id, worker) VALUES (?, ?, ?, ?, ?)", rows)
+            if scan.get("skipped"):
+                # STATUS が前回と同じで走査を省略した
+                uidvalidity, last_uid, status = item["uidvalidity"], item["last_uid"], item["status"]
+            elif scan["uidvalidity"] is not None and scan["last_uid"] is not None:
+                uidvalidity, last_uid, status = scan["uidvalidity"], scan["last_uid"], scan.get("status")
+            else:
+                # 位置が決まらなかった走査（空のフォルダなど）は前回の位置のままにし、次回も走査する
+                uidvalidity, last_uid, status = item["uidvalidity"], item["last_uid"], None
+            conn.execute(
+                """UPDATE work_items SET owner = NULL, lease_until = 0, next_run = ?, last_done = ?, failures = 0,
+                       uidvalidity = ?, last_uid = ?, status = ? WHERE item_id = ?""",
+                (next_run, now, uidvalidity, last_uid, self._encode_status(status), item["item_id"]))
+            conn.execute("UPDATE workers SET heartbeat = ?, items_done = items_done + 1 WHERE worker_id = ?",
+                         (now, worker_id))
+        return len(rows)
+
+    def release(self, item: Dict, worker_id: str, retry_at: float, failed: bool = True) -> None:
+        """走査できなかった項目のリースを返し、retry_at 以降に再実行させる"""
+        with self._transaction() as conn:
+            conn.execute(
+                """UPDATE work_items SET owner = NULL, lease_until = 0, next_run = ?, failures = failures + ?
+                   WHERE item_id = ? AND owner = ? AND token = ?""",
+                (retry_at, 1 if failed else 0, item["item_id"], worker_id, item["token"]))
+
+    def pending_detections(self, limit: int = 10000) -> List[Tuple[int, str, str, str]]:
+        """未統合の検出結果 (id, キー, 日付, 件名) を古い順に返す"""
+        return self.conn.execute("SELECT id, key, date, subject FROM detections ORDER BY id LIMIT ?",
+                                 (limit,)).fetchall()
+
+    def delete_detections(self, max_id: int) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM detections WHERE id <= ?", (max_id,))
+
+    def prune_seen(self, max_entries: int, max_age_days: float) -> int:
+        """max_age_days 日より前と、max_entries 件を超えた古い処理済みメールを削除する"""
+        with self._transaction() as conn:
+            deleted = conn.execute("DELETE FROM seen WHERE seen_at < ?",
+                                   (time.time() - max_age_days * 86400,)).rowcount
+            deleted += conn.execute(
+                """DELETE FROM seen WHERE message_key IN (
+                       SELECT message_key FROM seen ORDER BY seen_at DESC LIMIT -1 OFFSET ?)""",
+                (max_entries,)).rowcount
+        return deleted
+
+    def status(self) -> Dict:
+        items = [dict(zip(("item_id", "kind", "next_run", "owner", "lease_until", "last_uid", "last_done", "failures"),
+                          row))
+                 for row in self.conn.execute(
+                     """SELECT item_id, kind, next_run, owner, lease_until, last_uid, last_done, failures
+                        FROM work_items ORDER BY item_id""")]
+        workers = [dict(zip(("worker_id", "heartbeat", "items_done"), row))
+                   for row in self.conn.execute("SELECT worker_id, heartbeat, items_done FROM workers ORDER BY 1")]
+        pending = self.conn.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+        return {"items": items, "workers": workers, "pending_detections": pending}
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def work_items(config_manager) -> List[Tuple[str, str, float]]:
+    """設定から作業項目 (項目 ID, 種類, 間隔) の一覧を作る（ID は UID 状態のフォルダ ID と同じ）"""
+    config = config_manager.config
+    items = []
+    if config.get("imap_enabled", True):
+        for account in config_manager.get_accounts():
+            for folder in account["folders"]:
+                items.append((UidState.folder_id(account, folder), IMAP, account["check_interval"]))
+    for source in config.get("local_sources") or []:
+        items.append((source_id(source), LOCAL, source.get("check_interval", config["check_interval"])))
+    return items
+
+
+class LeaseKeeper(threading.Thread):
+    """
+    走査中にリースを延長し続けるスレッド（SQLite の接続はスレッドごとに持つ）
+
+    timeout 秒を過ぎたら延長をやめて on_timeout を呼ぶ（走査が止まったままリースを
+    持ち続けないようにする）。
+    """
+
+    def __init__(self, path: str, item: Dict, worker_id: str, lease_seconds: float, timeout: float, on_timeout):
+        super().__init__(daemon=True)
+        self.path = path
+        self.item = item
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.deadline = time.monotonic() + timeout
+        self.on_timeout = on_timeout
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        store = LeaseStore(self.path)
+        try:
+            while not self._stop_event.wait(self.lease_seconds / 3):
+                if time.monotonic() >= self.deadline:
+                    logger.error(f"{self.item['item_id']}: 走査がタイムアウトしました")
+                    self.on_timeout()
+                    return
+                if not store.renew(self.item, self.worker_id, self.lease_seconds):
+                    logger.warning(f"{self.item['item_id']}: リースを失いました")
+                    self.lost = True
+                    return
+        except sqlite3.Error as e:
+            # 延長できなければリースが切れて別のワーカーが引き継ぐ
+            logger.error(f"{self.item['item_id']}: リースの延長に失敗: {e}")
+        finally:
+            store.close()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+class Worker:
+    """
+    作業項目を 1 件ずつリースで取得し、EmailMonitor の走査処理で処理するワーカー
+
+    項目を取得する前に設定とキーの変更を取り込む（EmailMonitor.reload）。
+    """
+
+    def __init__(self, monitor, worker_id: Optional[str] = None):
+        self.monitor = monitor
+        config = monitor.config_manager.config
+        self.path = config.get("cluster_path", "cluster.db")
+        self.store = LeaseStore(self.path)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = config.get("lease_seconds", 60)
+        self.poll_seconds = config.get("worker_poll_seconds", 5)
+        self.retry_seconds = config.get("worker_retry_seconds", 30)
+        self.chunk_bytes = config.get("local_chunk_bytes", 64 * 1024 * 1024)
+        self.targets: Dict[str, Tuple] = {}
+        self._load_targets()
+
+    def _load_targets(self) -> None:
+        config = self.monitor.config_manager.config
+        self.targets = {}
+        for account in self.monitor.config_manager.get_accounts():
+            for folder in account["folders"]:
+                self.targets[UidState.folder_id(account, folder)] = (account, folder)
+        for source in config.get("local_sources") or []:
+            self.targets[source_id(source)] = (source, None)
+
+    def run_once(self) -> bool:
+        """項目を 1 件処理する。実行できる項目が無ければ False"""
+        if self.monitor.reload()[0]:
+            self._load_targets()
+        item = self.store.claim(self.worker_id, self.lease_seconds)
+        if item is None:
+            return False
+        item_id = item["item_id"]
+        target = self.targets.get(item_id)
+        if target is None:
+            # 設定の異なるワーカーが混在している。この項目は他のワーカーに任せる
+            logger.warning(f"{item_id} はこのワーカーの設定にありません")
+            self.store.release(item, self.worker_id, time.time() + self.poll_seconds, failed=False)
+            return True
+
+        started = time.perf_counter()
+        scan = self._scan(item, target)
+        if scan is None:
+            return True
+        next_run = time.time() + item["interval"]
+        if item["kind"] == LOCAL and not scan["complete"]:
+            # 読み残しがあれば続きをすぐに処理する（他のワーカーが取得してもよい）
+            next_run = time.time()
+        matches = self.store.complete(item, self.worker_id, scan, next_run)
+        if matches is None:
+            logger.warning(f"{item_id}: リースが他のワーカーに移ったため結果を破棄しました")
+            return True
+        stats = scan["stats"]
+        if scan.get("skipped"):
+            logger.info(f"{item_id}: 前回から変更が無いため走査を省略しました")
+            return True
+        logger.info(f"{item_id}: 処理完了 (取得 {stats['messages_fetched']} 件, 検出 {matches} 件, "
+                    f"{time.perf_counter() - started:.2f}秒)")
+        return True
+
+    def _scan(self, item: Dict, target: Tuple) -> Optional[Dict]:
+        """リースを延長しながら走査する。失敗した場合はリースを返して None"""
+        monitor = self.monitor
+        item_id = item["item_id"]
+        # UID の位置は共有のデータベースのものを使う（state.json は使わない）
+        monitor.uid_state.folders.pop(item_id, None)
+        if item["uidvalidity"] is not None:
+            monitor.uid_state.update(item_id, item["uidvalidity"], item["last_uid"], item["status"])
+        key_names = list(monitor.config_manager.keys)
+
+        if item["kind"] == IMAP:
+            account, folder = target
+            timeout = account.get("account_timeout", 300)
+            on_timeout = lambda: monitor.session_pool(account).invalidate(folder)  # noqa: E731
+        else:
+            timeout = monitor.config_manager.config.get("account_timeout", 300)
+            on_timeout = lambda: None  # noqa: E731  ローカルの読み込みは止めない
+        keeper = LeaseKeeper(self.path, item, self.worker_id, self.lease_seconds, timeout, on_timeout)
+        keeper.start()
+        try:
+            if item["kind"] == IMAP:
+                return monitor.scan_folder(account, folder, key_names)
+            return monitor.scan_local(target[0], key_names, self.chunk_bytes)
+        except KeyboardInterrupt:
+            # リースの期限を待たずに他のワーカーが引き継げるようにする
+            self.store.release(item, self.worker_id, time.time(), failed=False)
+            raise
+        except Exception as e:
+            logger.error(f"{item_id} のチェックに失敗: {e!r}")
+            retry = min(item["interval"], self.retry_seconds * 2 ** min(item["failures"], 6))
+            self.store.release(item, self.worker_id, time.time() + retry)
+            return None
+        finally:
+            keeper.stop()
+
+    def run(self) -> None:
+        logger.info(f"ワーカー {self.worker_id} を開始 (リース {self.lease_seconds}秒)")
+        try:
+            while True:
+                if not self.run_once():
+                    time.sleep(self.poll_seconds)
+        except KeyboardInterrupt:
+            logger.info(f"ワーカー {self.worker_id} を停止しました")
+        finally:
+            self.monitor.close()
+            self.store.close()
+
+
+class Coordinator:
+    """
+    作業項目を設定に合わせて登録し、ワーカーの検出結果をキーの状態に統合する
+
+    キーの保存と未着の報告はコーディネーターだけが行う。統合は merge_history で行うため、
+    保存後・削除前に停止して同じ検出を再度統合しても履歴は重複しない。
+    """
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        config = monitor.config_manager.config
+        self.store = LeaseStore(config.get("cluster_path", "cluster.db"))
+        self.merge_interval = config.get("cluster_merge_interval", 10)
+
+    def sync(self) -> None:
+        added, removed = self.store.sync_items(work_items(self.monitor.config_manager),
+                                               self.monitor.uid_state.folders)
+        logger.info(f"作業項目を同期しました (追加 {added} 件, 削除 {removed} 件)")
+
+    def merge(self) -> int:
+        """未統合の検出結果をキーの状態に反映して保存し、追加した履歴の数を返す"""
+        config_manager = self.monitor.config_manager
+        rows = self.store.pending_detections()
+        if not rows:
+            return 0
+        entries: Dict[str, List[Dict]] = {}
+        for _, key, date, subject in rows:
+            if key in config_manager.keys:
+                entries.setdefault(key, []).append({"date": date, "subject": subject})
+        added = sum(config_manager.merge_history(key, key_entries) for key, key_entries in entries.items())
+        for key, key_entries in entries.items():
+            for entry in key_entries:
+                self.monitor.notifier.detected(key, entry["date"], entry["subject"])
+        config_manager.save_keys()
+        self.store.delete_detections(rows[-1][0])
+        for key in entries:
+            logger.info(f"キー '{key}' を含むメールを検出 ({len(entries[key])} 件)")
+        logger.info(f"{len(rows)} 件の検出結果を統合しました (追加した履歴 {added} 件)")
+        return added
+
+    def run(self) -> None:
+        logger.info("コーディネーターを開始")
+        config = self.monitor.config_manager.config
+        self.sync()
+        last_prune = 0.0
+        try:
+            while True:
+                if self.monitor.reload()[0]:
+                    # 監視するアカウント・フォルダが変わっていれば作業項目に反映する
+                    self.sync()
+                self.merge()
+                self.monitor._report_missing()
+                if time.monotonic() - last_prune > 3600:
+                    self.store.prune_seen(config.get("seen_max_entries", 100000),
+                                          config.get("seen_max_age_days", 30))
+                    last_prune = time.monotonic()
+                time.sleep(self.monitor._seconds_until_next_deadline(self.merge_interval))
+        except KeyboardInterrupt:
+            logger.info("コーディネーターを停止しました")
+        finally:
+            self.monitor.close()
+            self.store.close()
@@ -0,0 +1,298 @@
+import json
+import os
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from .history import Detection, History
+from .key_store import KeyChanges, atomic_write_json, create_key_store, file_signature
+from .schedule import DeadlineIndex, parse_received
+
+logger = logging.getLogger("ConfigManager")
+
+class ConfigManager:
+    def __init__(self, config_path: str = "config.json", keys_path: str = "keys.json"):
+        self.config_path = config_path
+        self.keys_path = keys_path
+        self.config = self._load_config()
+        # 他のプロセス（add や手での編集）による変更の検出に使う
+        self._config_signature = file_signature(config_path)
+        self.store = create_key_store(self.config, keys_path)
+        # 0 以下は無制限
+        self.history_limit = self.config.get("history_limit", 10)
+        with self.store.lock():
+            self.keys = self._load_keys()
+            self._keys_signature = self.store.signature()
+        self._changes = KeyChanges()
+        # 受信の期限。キーの受信記録が変わるたびにそのキーだけ更新する
+        self.deadlines = DeadlineIndex()
+        self.deadlines.rebuild(self.keys)
+        # キー集合か照合範囲が変わるたびに増やす（照合エンジンの再構築判定に使う）
+        self.keys_version = 0
+
+    def _load_config(self) -> Dict:
+        if not os.path.exists(self.config_path):
+            default_config = {
+                "imap_server": "imap.example.com",
+                "email": "your_email@example.com",
+                "password": "your_password",
+                "check_interval": 3600,
+                "folder": "INBOX",
+                "state_path": "state.json",
+                "fetch_batch_size": 200,
+                "fetch_mode": "full",
+                "body_max_bytes": 0,
+                "match_strategy": "auto",
+                "idle": False,
+                "idle_timeout": 1500,
+                "storage": "json",
+                "history_limit": 10
+            }
+            atomic_write_json(self.config_path, default_config)
+            logger.info(f"デフォルト設定ファイルを作成しました: {self.config_path}")
+            return default_config
+
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            logger.info("設定を読み込みました")
+            return config
+        except Exception as e:
+            logger.error(f"設定ファイルの読み込みに失敗: {e}")
+            raise
+
+    def _load_keys(self) -> Dict:
+        try:
+            keys = self.store.load()
+            logger.info(f"{len(keys)} 個のキーを読み込みました")
+            return keys
+        except Exception as e:
+            logger.error(f"キーファイルの読み込みに失敗: {e}")
+            raise
+
+    def save_keys(self) -> None:
+        """
+        前回の保存以降の変更をバックエンドに書き込む
+
+        読み込み後に他のプロセスがキーを変更していた場合は、上書きしないよう先に取り込む。
+        """
+        try:
+            with self.store.lock():
+                if self.store.signature() != self._keys_signature:
+                    try:
+                        self._merge_stored_keys()
+                    except ValueError as e:
+                        # 手で編集中などで読み込めない。変更は次の保存まで持ち越す
+                        logger.warning(f"キーファイルを読み込めないため保存を見送ります: {e}")
+                        return
+                self.store.save(self.keys, self._changes)
+                self._keys_signature = self.store.signature()
+            self._changes = KeyChanges()
+            logger.info("キーデータを保存しました")
+        except Exception as e:
+            logger.error(f"キーデータの保存に失敗: {e}")
+            raise
+
+    def compact_history(self) -> None:
+        """
+        検出ログを現在の履歴だけに書き直す（storage が "json" の場合のみ）
+
+        save_keys と同じロックの中で、他のプロセスが保存した検出を取り込んでから書き直す。
+        未保存の変更は書き直す前にログへ追記する。
+        """
+        with self.store.lock():
+            if self.store.signature() != self._keys_signature:
+                self._merge_stored_keys()
+            self.store.save(self.keys, self._changes)
+            self.store.compact(self.keys)
+            self._keys_signature = self.store.signature()
+        self._changes = KeyChanges()
+
+    def reload(self) -> Tuple[Set[str], Set[str]]:
+        """
+        他のプロセスによる config.json / keys.json の変更を取り込み、(変更された設定の名前, 変更されたキー) を返す
+
+        ファイルの inode・更新時刻・大きさ（SQLite は data_version）を比べるだけなので、
+        変更が無ければ読み込まない。キーは変更のあったものだけ期限を計算し直し、
+        キー集合か照合範囲が変わった場合だけ keys_version を増やす。
+        """
+        config_names = self._reload_config()
+        key_names: Set[str] = set()
+        if self.store.signature() != self._keys_signature:
+            with self.store.lock():
+                try:
+                    key_names = self._merge_stored_keys()
+                except ValueError as e:
+                    logger.warning(f"キーファイルを読み込めないため変更の取り込みを見送ります: {e}")
+        return config_names, key_names
+
+    def _reload_config(self) -> Set[str]:
+        signature = file_signature(self.config_path)
+        if signature == self._config_signature or signature is None:
+            return set()
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except ValueError as e:
+            # 書きかけの可能性がある。シグネチャを更新しないため次の確認で読み直す
+            logger.warning(f"設定ファイルを読み込めないため変更の取り込みを見送ります: {e}")
+            return set()
+        self._config_signature = signature
+        names = {name for name in self.config.keys() | config.keys() if self.config.get(name) != config.get(name)}
+        if names:
+            # 設定の dict を参照している各部が新しい値を読むよう、置き換えずに中身を入れ替える
+            self.config.clear()
+            self.config.update(config)
+            logger.info(f"設定の変更を取り込みました: {', '.join(sorted(names))}")
+        return names
+
+    def _merge_stored_keys(self) -> Set[str]:
+        """
+        保存されているキーを読み直し、未保存の変更を重ねて現在のキーとする（ロックを取得して呼ぶ）
+
+        他のプロセスが削除したキーへの未保存の検出は捨てる。このプロセスで作り直したキー
+        （add_key / merge_history）は、このプロセスの内容を優先する。変更されたキーを返す。
+        """
+        stored = self.store.load()
+        self._keys_signature = self.store.signature()
+        changes = self._changes
+        pending: Dict[str, List[Detection]] = {}
+        for key, entry in changes.history:
+            pending.setdefault(key, []).append(entry)
+
+        merged = {}
+        for key, data in stored.items():
+            if key in changes.removed:
+                # このプロセスで削除した、または作り直したキー
+                if key in changes.upserted:
+                    merged[key] = self.keys[key]
+                continue
+            if key in pending:
+                for entry in pending[key]:
+                    data["history"].append(entry)
+                ours = self.keys[key]["last_received"]
+                if ours and (not data["last_received"] or ours > data["last_received"]):
+                    data["last_received"] = ours
+            merged[key] = data
+        for key in changes.upserted:
+            if key in changes.removed and key not in merged:
+                # このプロセスで追加したキー
+                merged[key] = self.keys[key]
+        dropped = [key for key in changes.upserted if key not in merged]
+        for key in dropped:
+            logger.warning(f"キー '{key}' は他のプロセスで削除されたため、未保存の検出を破棄します")
+            changes.upserted.discard(key)
+        changes.history = [(key, entry) for key, entry in changes.history if key in merged]
+
+        def fields(data: Optional[Dict]) -> Optional[Dict]:
+            return None if data is None else {name: value for name, value in data.items() if name != "history"}
+
+        changed = {key for key in self.keys.keys() | merged.keys()
+                   if fields(self.keys.get(key)) != fields(merged.get(key))}
+        rematch = self.keys.keys() != merged.keys() or any(
+            (self.keys.get(key) or {}).get("scope") != (merged.get(key) or {}).get("scope") for key in changed)
+        # キーの dict を参照している各部が新しい内容を読むよう、置き換えずに中身を入れ替える
+        for key in [key for key in self.keys if key not in merged]:
+            del self.keys[key]
+            self.deadlines.remove(key)
+        for key, data in merged.items():
+            self.keys[key] = data
+            if key in changed:
+                self.deadlines.update(key, data)
+        if rematch:
+            self.keys_version += 1
+        if changed:
+            logger.info(f"他のプロセスによるキーの変更を取り込みました ({len(changed)} 個)")
+        return changed
+
+    def add_key(self, key: str, description: Optional[str] = None, expected_frequency: Optional[str] = None) -> None:
+        if key in self.keys:
+            logger.warning(f"キー '{key}' は既に存在します。上書きします。")
+
+        self.keys[key] = {
+            "description": description or "",
+            "expected_frequency": expected_frequency or "daily",
+            "last_received": None,
+            "history": History(self.history_limit)
+        }
+        self._changes.remove(key)
+        self._changes.upsert(key)
+        self.deadlines.update(key, self.keys[key])
+        self.keys_version += 1
+        self.save_keys()
+        logger.info(f"キー '{key}' を追加しました")
+
+    def remove_key(self, key: str) -> bool:
+        if key in self.keys:
+            del self.keys[key]
+            self._changes.remove(key)
+            self.deadlines.remove(key)
+            self.keys_version += 1
+            self.save_keys()
+            logger.info(f"キー '{key}' を削除しました")
+            return True
+        logger.warning(f"キー '{key}' は存在しません")
+        return False
+
+    def list_keys(self) -> Dict:
+        return self.keys
+
+    def record_detection(self, key: str, date: str, subject: str) -> None:
+        """
+        キーを含むメールの受信を記録する（履歴は history_limit 件までのリングバッファ）
+
+        アーカイブの取り込みなどで古いメールを後から記録しても last_received は戻さない。
+        """
+        data = self.keys[key]
+        entry = Detection.from_iso(date, subject)
+        if not data["last_received"] or date > data["last_received"]:
+            data["last_received"] = date
+        data["history"].append(entry)
+        self._changes.add_history(key, entry)
+        self.deadlines.update(key, data)
+
+    def merge_history(self, key: str, entries: List[Dict]) -> int:
+        """
+        過去のメールの検出結果（{"date", "subject"} のリスト）を履歴に日付順で統合し、
+        追加した件数を返す（バックフィル用）
+
+        日付と件名が同じ履歴は追加しない。
+        """
+        data = self.keys[key]
+        known = set(data["history"])
+        added = {entry for entry in (Detection.from_iso(item["date"], item["subject"]) for item in entries)
+                 if entry not in known}
+        if not added:
+            return 0
+        history = sorted(list(data["history"]) + list(added), key=lambda entry: (entry.timestamp, entry.subject))
+        if self.history_limit > 0:
+            history = history[-self.history_limit:]
+        # 保持件数を超えて押し出された古いメールは追加しなかったものとして数える
+        added_count = sum(1 for entry in history if entry not in known)
+        if not added_count:
+            return 0
+        data["history"] = History(self.history_limit, history)
+        last = history[-1]
+        if not data["last_received"] or last.timestamp > parse_received(data["last_received"]).timestamp():
+            data["last_received"] = last.date
+        # 履歴の並びが変わるため、このキーの履歴は保存時に書き直す
+        self._changes.remove(key)
+        for entry in history:
+            self._changes.add_history(key, entry)
+        self.deadlines.update(key, data)
+        return added_count
+
+    def get_accounts(self) -> List[Dict]:
+        """
+        監視するアカウントの一覧を返す
+
+        accounts が無い場合は従来の imap_server / email / folder を 1 アカウントとして扱う。
+        各アカウントにはトップレベルの設定（fetch_batch_size など）が引き継がれ、
+        アカウント側の同名の設定で上書きできる。
+        """
+        base = {name: value for name, value in self.config.items() if name != "accounts"}
+        accounts = []
+        for account in self.config.get("accounts") or [{}]:
+            merged = dict(base, **account)
+            merged["folders"] = account.get("folders") or [merged.get("folder", "INBOX")]
+            accounts.append(merged)
+        return accounts
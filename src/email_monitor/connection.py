@@ -0,0 +1,186 @@
+import imaplib
+import logging
+import random
+import ssl
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("ImapConnection")
+
+# セッションの接続先を決める設定（変わったらセッションを張り直す）
+CONNECTION_SETTINGS = ("imap_server", "imap_port", "imap_ssl", "imap_ca_file", "email", "password")
+
+class ImapConnectionManager:
+    """
+    IMAP セッションをチェック間で使い回す
+
+    get() は既存のセッションを NOOP で確認してから返し、切れていれば
+    指数バックオフ（ジッター付き）で再接続する。
+    """
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.mail = None
+        self.connected_at: Optional[float] = None
+        self.reconnects = 0
+        # 接続（TLS ハンドシェイクとログインを含む）にかかった時間の合計
+        self.connect_seconds = 0.0
+        self._ever_connected = False
+
+    @property
+    def age(self) -> float:
+        """現在のセッションの接続経過秒数"""
+        if self.connected_at is None:
+            return 0.0
+        return time.monotonic() - self.connected_at
+
+    def _open(self):
+        config = self.config
+        if config.get("imap_ssl", True):
+            # imap_ca_file を指定した場合はその CA 証明書で検証する（社内 CA や自己署名の証明書用）
+            context = ssl.create_default_context(cafile=config.get("imap_ca_file"))
+            mail = imaplib.IMAP4_SSL(config["imap_server"], config.get("imap_port", imaplib.IMAP4_SSL_PORT),
+                                     ssl_context=context)
+        else:
+            mail = imaplib.IMAP4(config["imap_server"], config.get("imap_port", imaplib.IMAP4_PORT))
+        try:
+            mail.login(config["email"], config["password"])
+        except Exception:
+            mail.shutdown()
+            raise
+        return mail
+
+    def get(self, verify: bool = True):
+        """
+        有効なセッションを返す。必要なら再接続する
+
+        verify が False なら既存のセッションを NOOP で確かめずに返す（呼び出し側の最初の
+        コマンドが生存確認を兼ね、失敗したら invalidate してから呼び直す場合）。
+        """
+        if self.mail is not None and not verify:
+            return self.mail
+        if self.mail is not None:
+            try:
+                typ, _ = self.mail.noop()
+                if typ == 'OK':
+                    logger.info(f"IMAP セッションを再利用します (接続経過 {self.age:.0f}秒, 再接続 {self.reconnects} 回)")
+                    return self.mail
+                logger.warning(f"NOOP が失敗しました: {typ}")
+            except (imaplib.IMAP4.error, OSError) as e:
+                logger.warning(f"IMAP セッションが無効になりました (接続経過 {self.age:.0f}秒): {e}")
+            self.invalidate()
+        return self._connect_with_backoff()
+
+    def _connect_with_backoff(self):
+        base_delay = self.config.get("reconnect_base_delay", 1)
+        max_delay = self.config.get("reconnect_max_delay", 300)
+        max_retries = self.config.get("reconnect_max_retries", 5)
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                self.mail = self._open()
+            except (imaplib.IMAP4.error, OSError) as e:
+                self.connect_seconds += time.perf_counter() - started
+                attempt += 1
+                if attempt > max_retries:
+                    logger.error(f"IMAP 接続に {attempt} 回失敗しました: {e}")
+                    raise
+                # フルジッター: [0, min(上限, 基準 * 2^n)] の一様乱数だけ待つ
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+                logger.warning(f"IMAP 接続に失敗 ({attempt} 回目): {e}。{delay:.1f}秒後に再試行します")
+                time.sleep(delay)
+                continue
+
+            self.connect_seconds += time.perf_counter() - started
+            self.connected_at = time.monotonic()
+            if self._ever_connected:
+                self.reconnects += 1
+            self._ever_connected = True
+            logger.info(f"IMAP に接続しました: {self.config['imap_server']} (再接続 {self.reconnects} 回)")
+            return self.mail
+
+    def invalidate(self) -> None:
+        """エラー後のセッションを破棄する（次の get() で再接続される）"""
+        if self.mail is not None:
+            try:
+                self.mail.shutdown()
+            except OSError:
+                pass
+        self.mail = None
+        self.connected_at = None
+
+    def close(self) -> None:
+        if self.mail is not None:
+            try:
+                self.mail.logout()
+            except (imaplib.IMAP4.error, OSError):
+                pass
+            logger.info(f"IMAP 接続を終了しました (接続経過 {self.age:.0f}秒, 再接続 {self.reconnects} 回)")
+        self.mail = None
+        self.connected_at = None
+
+
+def pool_key(config: Dict) -> Tuple:
+    """セッションを共有できるアカウントの識別子（接続先の設定が同じなら同じ）"""
+    return tuple(config.get(name) for name in CONNECTION_SETTINGS)
+
+
+class ImapSessionPool:
+    """
+    1 つのアカウントの IMAP セッションを最大 size 個（max_concurrency）まで使い回す
+
+    フォルダごとにセッションを持つとフォルダの数だけ同時にログインし、サーバーの
+    ユーザーあたりの接続数の上限を超えてしまう。フォルダの走査は checkout() で空いている
+    セッションを借り、終わったら checkin() で返す。空きが無く size 個に達していれば
+    返されるまで待つ。借りたセッションは前に使ったフォルダを選択したままのことがあるため、
+    使う側で SELECT し直す。
+    """
+
+    def __init__(self, config: Dict, size: int):
+        self.config = config
+        self.size = max(size, 1)
+        self._idle: List[ImapConnectionManager] = []
+        # 使用中のセッション（フォルダ → セッション）
+        self._busy: Dict[str, ImapConnectionManager] = {}
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def checkout(self, folder: str) -> ImapConnectionManager:
+        """folder の走査に使うセッションを借りる（接続は呼び出し側が get() で行う）"""
+        with self._cond:
+            while not self._idle and len(self._busy) >= self.size:
+                self._cond.wait()
+            connection = self._idle.pop() if self._idle else ImapConnectionManager(self.config)
+            # 再接続の間隔などは最新の設定を使う
+            connection.config = self.config
+            self._busy[folder] = connection
+            return connection
+
+    def checkin(self, folder: str) -> None:
+        with self._cond:
+            connection = self._busy.pop(folder, None)
+            if connection is None:
+                return
+            keep = not self._closed and len(self._idle) + len(self._busy) < self.size
+            if keep:
+                self._idle.append(connection)
+            self._cond.notify()
+        if not keep:
+            connection.close()
+
+    def invalidate(self, folder: str) -> None:
+        """folder を走査中のセッションを破棄する（タイムアウトした走査を別のスレッドから中断する）"""
+        with self._cond:
+            connection = self._busy.get(folder)
+        if connection is not None:
+            connection.invalidate()
+
+    def close(self) -> None:
+        """空いているセッションを閉じる。使用中のものは返されたときに閉じる"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
@@ -0,0 +1,226 @@
+"""
+受信履歴
+
+キーごとの履歴は固定容量のリングバッファ（History）に、受信時刻をエポック秒で持つ
+小さなレコード（Detection）として保持する。JSON 保存では履歴を keys.json に含めず、
+追記専用のバイナリログ（DetectionLog）に検出ごとに 1 レコード追記し、
+古いレコードが溜まったら現在の履歴だけに書き直す（コンパクション）。
+"""
+import datetime
+import logging
+import os
+import struct
+import tempfile
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .schedule import parse_received
+
+logger = logging.getLogger("History")
+
+
+class Detection:
+    """履歴の 1 件（受信時刻のエポック秒と件名）"""
+
+    __slots__ = ("timestamp", "subject")
+
+    def __init__(self, timestamp: float, subject: str):
+        self.timestamp = timestamp
+        self.subject = subject
+
+    @classmethod
+    def from_iso(cls, date: str, subject: str) -> "Detection":
+        return cls(parse_received(date).timestamp(), subject)
+
+    @property
+    def date(self) -> str:
+        """ローカル時刻（タイムゾーン無し）の ISO 文字列"""
+        return datetime.datetime.fromtimestamp(self.timestamp).isoformat()
+
+    def to_dict(self) -> Dict:
+        return {"date": self.date, "subject": self.subject}
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, Detection)
+                and (self.timestamp, self.subject) == (other.timestamp, other.subject))
+
+    def __hash__(self) -> int:
+        return hash((self.timestamp, self.subject))
+
+    def __repr__(self) -> str:
+        return f"Detection({self.date!r}, {self.subject!r})"
+
+
+class History:
+    """
+    古い順に並んだ固定容量のリングバッファ
+
+    容量を超えて追加すると最も古い 1 件を上書きする（リストを作り直さない）。
+    capacity が 0 以下なら無制限。
+    """
+
+    __slots__ = ("capacity", "_items", "_start")
+
+    def __init__(self, capacity: int, entries: Iterable[Detection] = ()):
+        self.capacity = capacity
+        self._items: List[Detection] = []
+        self._start = 0
+        for entry in entries:
+            self.append(entry)
+
+    def append(self, entry: Detection) -> None:
+        if self.capacity <= 0 or len(self._items) < self.capacity:
+            self._items.append(entry)
+        else:
+            self._items[self._start] = entry
+            self._start = (self._start + 1) % self.capacity
+
+    def __iter__(self) -> Iterator[Detection]:
+        items, start = self._items, self._start
+        if not start:
+            return iter(items)
+        return iter(items[start:] + items[:start])
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def last(self) -> Optional[Detection]:
+        """最も新しく追加した 1 件"""
+        if not self._items:
+            return None
+        return self._items[self._start - 1]
+
+    def to_list(self) -> List[Dict]:
+        """従来の keys.json と同じ {"date", "subject"} のリスト"""
+        return [entry.to_dict() for entry in self]
+
+
+# ファイルの先頭に置く識別子（形式を変えたら番号を上げる）
+MAGIC = b"MCDL\x01\n"
+# CRC32 の後に キーのバイト数, 件名のバイト数, エポック秒 が続き、その後にキーと件名の UTF-8
+_CRC = struct.Struct("<I")
+_HEADER = struct.Struct("<HHd")
+# 件名のバイト数がこの値のレコードは、そのキーの履歴の消去（キーの削除・作り直し）
+TOMBSTONE = 0xFFFF
+_MAX_BYTES = TOMBSTONE - 1
+
+
+def _encode(text: str) -> bytes:
+    data = text.encode("utf-8")
+    if len(data) > _MAX_BYTES:
+        # 文字の途中で切らないよう、切り詰めたあと不完全な末尾を捨てる
+        data = data[:_MAX_BYTES].decode("utf-8", "ignore").encode("utf-8")
+    return data
+
+
+def _record(key: str, timestamp: float, subject: Optional[str]) -> bytes:
+    key_bytes = _encode(key)
+    subject_bytes = b"" if subject is None else _encode(subject)
+    body = (_HEADER.pack(len(key_bytes), TOMBSTONE if subject is None else len(subject_bytes), timestamp)
+            + key_bytes + subject_bytes)
+    return _CRC.pack(zlib.crc32(body)) + body
+
+
+class DetectionLog:
+    """
+    追記専用の検出ログ
+
+    保存のたびに前回以降の検出だけを末尾に追記する。書き込み途中で停止して末尾の
+    レコードが壊れていた場合は、読み込み時に最後の完全なレコードの後ろで切り詰める。
+    records はファイル内のレコード数で、現在の履歴の件数と比べてコンパクションの要否を決める。
+    """
+
+    # 現在の履歴の件数の何倍を超えたら書き直すか（小さなログは書き直さない）
+    COMPACT_RATIO = 2
+    COMPACT_MIN_RECORDS = 4096
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def load(self, capacity: int) -> Dict[str, History]:
+        """ログを先頭から再生してキーごとの履歴を作る"""
+        histories: Dict[str, History] = {}
+        self.records = 0
+        if not self.exists():
+            return histories
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError(f"検出ログの形式が不明です: {self.path}")
+
+        names: Dict[bytes, str] = {}
+        offset, end = len(MAGIC), len(data)
+        while offset < end:
+            body_start = offset + _CRC.size
+            if body_start + _HEADER.size > end:
+                break
+            key_length, subject_length, timestamp = _HEADER.unpack_from(data, body_start)
+            key_start = body_start + _HEADER.size
+            subject_start = key_start + key_length
+            record_end = subject_start + (0 if subject_length == TOMBSTONE else subject_length)
+            if record_end > end or zlib.crc32(data[body_start:record_end]) != _CRC.unpack_from(data, offset)[0]:
+                break
+            key_bytes = data[key_start:subject_start]
+            # 同じキーの文字列は 1 つを共有する
+            key = names.get(key_bytes)
+            if key is None:
+                key = names[key_bytes] = key_bytes.decode("utf-8")
+            if subject_length == TOMBSTONE:
+                histories.pop(key, None)
+            else:
+                history = histories.get(key)
+                if history is None:
+                    history = histories[key] = History(capacity)
+                history.append(Detection(timestamp, data[subject_start:record_end].decode("utf-8")))
+            self.records += 1
+            offset = record_end
+
+        if offset < end:
+            logger.warning(f"検出ログの末尾 {end - offset} バイトが壊れているため切り捨てます: {self.path}")
+            os.truncate(self.path, offset)
+        return histories
+
+    def append(self, removed: Iterable[str], entries: List[Tuple[str, Detection]]) -> None:
+        """削除されたキーの消去レコードと、追加された履歴を追記する"""
+        chunks = [_record(key, 0.0, None) for key in removed]
+        chunks.extend(_record(key, entry.timestamp, entry.subject) for key, entry in entries)
+        if not chunks:
+            return
+        with open(self.path, "ab") as f:
+            if f.tell() == 0:
+                f.write(MAGIC)
+            f.write(b"".join(chunks))
+            f.flush()
+            os.fsync(f.fileno())
+        self.records += len(chunks)
+
+    def should_compact(self, live: int) -> bool:
+        return self.records > max(live * self.COMPACT_RATIO, self.COMPACT_MIN_RECORDS)
+
+    def rewrite(self, histories: Dict[str, Iterable[Detection]]) -> None:
+        """現在の履歴だけのログを一時ファイルに書いてから置き換える"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".log", dir=directory)
+        records = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(MAGIC)
+                for key, history in histories.items():
+                    chunk = [_record(key, entry.timestamp, entry.subject) for entry in history]
+                    f.write(b"".join(chunk))
+                    records += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        logger.info(f"検出ログを書き直しました ({self.records} 件 -> {records} 件): {self.path}")
+        self.records = records
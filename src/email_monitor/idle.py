@@ -0,0 +1,77 @@
+import re
+import select
+import ssl
+import logging
+import time
+
+logger = logging.getLogger("Idle")
+
+_EXISTS = re.compile(rb'^\* \d+ EXISTS')
+
+
+def _has_buffered_data(mail) -> bool:
+    """imaplib の読み取りバッファまたはソケットに読めるデータがあるか（ブロックしない）"""
+    sock = mail.sock
+    if isinstance(sock, ssl.SSLSocket) and sock.pending():
+        return True
+    previous = sock.gettimeout()
+    sock.settimeout(0.0)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(previous)
+
+
+def _wait_readable(mail, timeout: float) -> bool:
+    if _has_buffered_data(mail):
+        return True
+    readable, _, _ = select.select([mail.sock], [], [], max(timeout, 0))
+    return bool(readable)
+
+
+def idle_wait(mail, timeout: float) -> bool:
+    """
+    IDLE コマンドで新着を待つ
+
+    EXISTS 通知を受け取ったら True、timeout 秒経過したら False を返す。
+    どちらの場合も DONE を送って IDLE を終了してから戻る。
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+
+    # 継続応答 "+ idling" を待つ
+    while True:
+        line = mail._get_line()
+        if line.startswith(b'+'):
+            break
+        if line.startswith(tag):
+            raise mail.error(f"IDLE に失敗: {line!r}")
+
+    got_exists = False
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not _wait_readable(mail, remaining):
+            break
+        line = mail._get_line()
+        if _EXISTS.match(line):
+            got_exists = True
+            break
+        if line.startswith(b'* BYE'):
+            raise mail.abort(f"IDLE 中にサーバーが切断しました: {line!r}")
+    mail.send(b'DONE\r\n')
+
+    # DONE に対するタグ付き応答までを読み捨てる（その間に届いた EXISTS も拾う）
+    while True:
+        line = mail._get_line()
+        if line.startswith(tag):
+            if not line[len(tag):].strip().startswith(b'OK'):
+                raise mail.error(f"IDLE の終了に失敗: {line!r}")
+            break
+        if _EXISTS.match(line):
+            got_exists = True
+    # _new_tag() が登録したタグを imaplib の管理表から外す
+    mail.tagged_commands.pop(tag, None)
+    return got_exists
@@ -0,0 +1,296 @@
+import re
+import time
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .metrics import add_time
+
+logger = logging.getLogger("ImapFetch")
+
+class _Literal(bytes):
+    """FETCH レスポンス中のリテラル（{n} で送られたデータ）"""
+
+
+# 括弧トークン（引用符付き文字列の "(" と区別するための番兵）
+_OPEN = object()
+_CLOSE = object()
+
+
+def compress_uids(uids: Iterable[int]) -> str:
+    """UID のリストを "1001:1200,1205" 形式のシーケンスセットにまとめる"""
+    ranges = []
+    for uid in sorted(set(int(u) for u in uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in ranges)
+
+
+def chunk_uids(uids: List[int], size: int) -> Iterator[List[int]]:
+    for i in range(0, len(uids), max(size, 1)):
+        yield uids[i:i + size]
+
+
+def _segments(data) -> Iterator[bytes]:
+    # imaplib はリテラルを (直前の行, リテラル) のタプルで返す
+    for item in data:
+        if isinstance(item, tuple):
+            yield item[0]
+            yield _Literal(item[1])
+        elif item is not None:
+            yield item
+
+
+_ATOM_END = re.compile(rb'[\s()"]')
+
+
+def _tokenize(data) -> Iterator:
+    for segment in _segments(data):
+        if isinstance(segment, _Literal):
+            yield segment
+            continue
+        pos = 0
+        length = len(segment)
+        while pos < length:
+            ch = segment[pos:pos + 1]
+            if ch.isspace():
+                pos += 1
+            elif ch == b"(":
+                yield _OPEN
+                pos += 1
+            elif ch == b")":
+                yield _CLOSE
+                pos += 1
+            elif ch == b'"':
+                out = bytearray()
+                pos += 1
+                while pos < length and segment[pos:pos + 1] != b'"':
+                    if segment[pos:pos + 1] == b"\\":
+                        pos += 1
+                    out += segment[pos:pos + 1]
+                    pos += 1
+                pos += 1
+                yield out.decode('utf-8', errors='replace')
+            elif ch == b"{" and segment.endswith(b"}") and re.fullmatch(rb"\{\d+\}", segment[pos:]):
+                # 次のセグメントがリテラル本体
+                pos = length
+            else:
+                # BODY[HEADER.FIELDS (DATE SUBJECT)]<0> のように [] 内の空白はアトムに含める
+                start = pos
+                depth = 0
+                while pos < length:
+                    c = segment[pos:pos + 1]
+                    if c == b"[":
+                        depth += 1
+                    elif c == b"]":
+                        depth -= 1
+                    elif depth == 0 and _ATOM_END.match(c):
+                        break
+                    pos += 1
+                atom = segment[start:pos].decode('ascii', errors='replace')
+                yield None if atom.upper() == "NIL" else atom
+
+
+def _parse_tokens(tokens: Iterator) -> List:
+    """トークン列を入れ子のリストに組み立てる"""
+    stack: List[List] = [[]]
+    for token in tokens:
+        if token is _OPEN:
+            stack.append([])
+        elif token is _CLOSE:
+            if len(stack) == 1:
+                continue
+            items = stack.pop()
+            stack[-1].append(items)
+        else:
+            stack[-1].append(token)
+    while len(stack) > 1:
+        items = stack.pop()
+        stack[-1].append(items)
+    return stack[0]
+
+
+def parse_fetch_response(data) -> Dict[int, Dict[str, object]]:
+    """
+    複数メッセージ分の FETCH レスポンスを UID ごとの属性辞書に変換する
+
+    属性名は大文字に正規化され、リテラルは bytes、括弧リストは list で返される。
+    UID を含まない（要求していない）FETCH レスポンスは無視する。
+    """
+    messages = {}
+    items = _parse_tokens(_tokenize(data))
+    for i in range(0, len(items) - 1):
+        attrs = items[i + 1]
+        if not isinstance(attrs, list) or isinstance(items[i], list):
+            continue
+        parsed = {}
+        for j in range(0, len(attrs) - 1, 2):
+            name = attrs[j]
+            if isinstance(name, str):
+                parsed[name.upper()] = attrs[j + 1]
+        if "UID" in parsed:
+            messages[int(parsed["UID"])] = parsed
+    return messages
+
+
+def fetch_batched(mail, uids: List[int], items: str, batch_size: int, stats: Dict) -> Iterator[Tuple[int, Dict]]:
+    """
+    UID をまとめて UID FETCH し、(uid, 属性辞書) を UID 順に返す
+
+    stats["fetch_commands"] / stats["messages_fetched"] / stats["bytes_fetched"] と
+    FETCH（応答の解析を含む）にかかった時間 stats["fetch_seconds"] を更新する。
+    """
+    for chunk in chunk_uids(sorted(uids), batch_size):
+        started = time.perf_counter()
+        typ, data = mail.uid('fetch', compress_uids(chunk), f'(UID {items})')
+        stats["fetch_commands"] = stats.get("fetch_commands", 0) + 1
+        if typ != 'OK':
+            logger.error(f"UID FETCH に失敗: {typ} {data}")
+            continue
+        messages = parse_fetch_response(data)
+        add_time(stats, "fetch", started)
+        for uid in chunk:
+            attrs = messages.get(uid)
+            if attrs is None:
+                # 取得までの間に削除されたメッセージ
+                continue
+            stats["messages_fetched"] = stats.get("messages_fetched", 0) + 1
+            stats["bytes_fetched"] = stats.get("bytes_fetched", 0) + sum(
+                len(value) for value in attrs.values() if isinstance(value, bytes)
+            )
+            yield uid, attrs
+
+
+def fetch_sizes(mail, uids: List[int], batch_size: int, stats: Dict) -> Dict[int, int]:
+    """RFC822.SIZE だけを取得し、{uid: バイト数} を返す（本文は取得しない）"""
+    sizes: Dict[int, int] = {}
+    for chunk in chunk_uids(sorted(uids), max(batch_size, 1000)):
+        started = time.perf_counter()
+        typ, data = mail.uid('fetch', compress_uids(chunk), '(UID RFC822.SIZE)')
+        stats["fetch_commands"] = stats.get("fetch_commands", 0) + 1
+        if typ != 'OK':
+            logger.error(f"UID FETCH に失敗: {typ} {data}")
+            continue
+        for uid, attrs in parse_fetch_response(data).items():
+            sizes[uid] = int(attrs.get("RFC822.SIZE") or 0)
+        add_time(stats, "fetch", started)
+    return sizes
+
+
+def chunk_uids_by_size(uids: List[int], sizes: Dict[int, int], batch_size: int,
+                       max_bytes: int) -> Iterator[Tuple[List[int], int]]:
+    """
+    件数が batch_size 以下、合計サイズが max_bytes 以下になるように UID を分割し、
+    (UID の列, 合計サイズ) を返す（max_bytes を超える 1 通はそれだけで 1 つにする）
+    """
+    chunk: List[int] = []
+    total = 0
+    for uid in sorted(uids):
+        size = sizes.get(uid, 0)
+        if chunk and (len(chunk) >= batch_size or total + size > max_bytes):
+            yield chunk, total
+            chunk, total = [], 0
+        chunk.append(uid)
+        total += size
+    if chunk:
+        yield chunk, total
+
+
+def get_section(attrs: Dict, section: str):
+    """BODY[section] または BODY[section]<n> の値を返す"""
+    name = f"BODY[{section.upper()}]"
+    for attr, value in attrs.items():
+        if attr == name or attr.startswith(name + "<"):
+            return value
+    return None
+
+
+def get_header_fields(attrs: Dict) -> bytes:
+    # サーバーによってはフィールド名の書き方を変えて返すため前方一致で探す
+    for attr, value in attrs.items():
+        if attr.startswith("BODY[HEADER.FIELDS"):
+            return value or b""
+    return b""
+
+
+def _walk_bodystructure(structure: List, prefix: str = "") -> Iterator[Tuple[str, List]]:
+    if structure and isinstance(structure[0], list):
+        # multipart: 子パートの並びの後にサブタイプが続く
+        number = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            number += 1
+            yield from _walk_bodystructure(child, f"{prefix}.{number}" if prefix else str(number))
+    else:
+        yield prefix or "1", structure
+
+
+def find_text_part(structure) -> Optional[Tuple[str, str, Optional[str]]]:
+    """
+    BODYSTRUCTURE から最初の（添付ではない）text/plain パートを探す
+
+    Returns:
+        (セクション番号, Content-Transfer-Encoding, charset) または None
+    """
+    if not isinstance(structure, list):
+        return None
+    for section, part in _walk_bodystructure(structure):
+        if len(part) < 7 or not isinstance(part[0], str) or not isinstance(part[1], str):
+            continue
+        if part[0].upper() != "TEXT" or part[1].upper() != "PLAIN":
+            continue
+        # text/* は lines の後に md5, disposition が続く
+        disposition = part[9] if len(part) > 9 else None
+        if isinstance(disposition, list) and disposition and str(disposition[0]).upper() == "ATTACHMENT":
+            continue
+        params = part[2] if isinstance(part[2], list) else []
+        charset = None
+        for i in range(0, len(params) - 1, 2):
+            if str(params[i]).upper() == "CHARSET":
+                charset = params[i + 1]
+        return section, part[5] or "7bit", charset
+    return None
+
+
+def part_size(structure, section: str) -> Optional[int]:
+    """BODYSTRUCTURE に書かれたセクションの（転送エンコード後の）バイト数を返す"""
+    if not isinstance(structure, list):
+        return None
+    for number, part in _walk_bodystructure(structure):
+        if number == section:
+            size = part[6] if len(part) > 6 else None
+            return int(size) if isinstance(size, (int, str)) and str(size).isdigit() else None
+    return None
+
+
+def fetch_sections(mail, sections: Dict[int, str], max_bytes: int, batch_size: int, stats: Dict) -> Dict[int, bytes]:
+    """
+    メッセージごとに指定したセクションだけを BODY.PEEK で取得する
+
+    同じセクション番号のメッセージは 1 回の UID FETCH にまとめる。
+    max_bytes が正の場合は <0.max_bytes> の部分取得にする。
+    """
+    groups: Dict[str, List[int]] = {}
+    for uid, section in sections.items():
+        groups.setdefault(section, []).append(uid)
+
+    partial = f"<0.{max_bytes}>" if max_bytes and max_bytes > 0 else ""
+    bodies = {}
+    for section, uids in groups.items():
+        for chunk in chunk_uids(sorted(uids), batch_size):
+            started = time.perf_counter()
+            typ, data = mail.uid('fetch', compress_uids(chunk), f'(UID BODY.PEEK[{section}]{partial})')
+            stats["fetch_commands"] = stats.get("fetch_commands", 0) + 1
+            if typ != 'OK':
+                logger.error(f"UID FETCH に失敗: {typ} {data}")
+                continue
+            for uid, attrs in parse_fetch_response(data).items():
+                value = get_section(attrs, section)
+                if isinstance(value, bytes):
+                    bodies[uid] = value
+                    stats["sections_fetched"] = stats.get("sections_fetched", 0) + 1
+                    stats["bytes_fetched"] = stats.get("bytes_fetched", 0) + len(value)
+            add_time(stats, "fetch", started)
+    return bodies
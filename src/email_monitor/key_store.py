@@ -0,0 +1,323 @@
+import contextlib
+import json
+import os
+import logging
+import tempfile
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows ではファイルのロックを行わない
+    fcntl = None
+
+from .history import Detection, DetectionLog, History
+from .schedule import parse_received
+
+logger = logging.getLogger("KeyStore")
+
+
+def atomic_write_json(path: str, data) -> None:
+    """
+    一時ファイルに書いてから os.replace で置き換える
+
+    書き込み中に停止しても元のファイルが途中までの内容で壊れることはない。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """変更の検出に使うファイルの (inode, 更新時刻, 大きさ)。ファイルが無ければ None"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class FileLock:
+    """
+    fcntl.flock による排他ロック（with 文で使う）
+
+    同じファイルを書き換える複数のプロセス（常駐中のデーモンと add など）の
+    読み込み〜保存を直列にする。同じプロセス内で入れ子にしないこと。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+class KeyChanges:
+    """前回の保存以降に変更されたキーと追加された履歴"""
+
+    def __init__(self):
+        self.upserted: Set[str] = set()
+        self.removed: Set[str] = set()
+        self.history: List[Tuple[str, Detection]] = []
+
+    def upsert(self, key: str) -> None:
+        # remove() の後に upsert() した場合は、削除してから作り直す（履歴も消える）
+        self.upserted.add(key)
+
+    def remove(self, key: str) -> None:
+        self.removed.add(key)
+        self.upserted.discard(key)
+        self.history = [(name, entry) for name, entry in self.history if name != key]
+
+    def add_history(self, key: str, entry: Detection) -> None:
+        self.upsert(key)
+        self.history.append((key, entry))
+
+    def __bool__(self) -> bool:
+        return bool(self.upserted or self.removed or self.history)
+
+
+class JsonKeyStore:
+    """
+    keys.json にキーと最終受信日時を、受信履歴は検出ログ（既定は keys.json と同じ場所の keys.history）に
+    保存する（既定のバックエンド）
+
+    keys.json は保存のたびに全体を書き直すが、履歴は前回以降の検出だけをログに追記する。
+    履歴を keys.json に含めていた以前の形式は、ログが無ければ読み込み時にログへ移す。
+    """
+
+    def __init__(self, path: str, history_limit: int = 10, log_path: Optional[str] = None):
+        self.path = path
+        self.history_limit = history_limit
+        self.log = DetectionLog(log_path or os.path.splitext(path)[0] + ".history")
+
+    def load(self) -> Dict:
+        if not os.path.exists(self.path):
+            empty_keys = {}
+            atomic_write_json(self.path, empty_keys)
+            logger.info(f"空のキーファイルを作成しました: {self.path}")
+            return empty_keys
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            keys = json.load(f)
+        legacy = {key: data.pop("history") for key, data in keys.items() if "history" in data}
+        if self.log.exists():
+            histories = self.log.load(self.history_limit)
+        else:
+            histories = {key: History(self.history_limit, (Detection.from_iso(entry["date"], entry["subject"])
+                                                           for entry in entries))
+                         for key, entries in legacy.items() if entries}
+            if histories:
+                self.log.rewrite(histories)
+                logger.info(f"keys.json の履歴を検出ログに移しました: {self.log.path}")
+        for key, data in keys.items():
+            data["history"] = histories.get(key) or History(self.history_limit)
+            # ログへの追記の後、keys.json を書き直す前に停止した場合は最終受信日時を履歴から戻す
+            last = data["history"].last()
+            if last is not None and (not data.get("last_received")
+                                     or parse_received(data["last_received"]).timestamp() < last.timestamp):
+                data["last_received"] = last.date
+        self._compact(keys)
+        return keys
+
+    def save(self, keys: Dict, changes: KeyChanges) -> None:
+        self.log.append(changes.removed, changes.history)
+        # JSON は差分更新できないため、変更内容に関係なく全体を書き直す（履歴は含めない）
+        atomic_write_json(self.path, {key: {name: value for name, value in data.items() if name != "history"}
+                                      for key, data in keys.items()})
+        self._compact(keys)
+
+    def lock(self) -> FileLock:
+        """keys.json と検出ログの読み込み〜保存を他のプロセスと直列にするロック（keys.json.lock）"""
+        return FileLock(self.path + ".lock")
+
+    def signature(self):
+        """keys.json が他のプロセスに書き換えられたかの判定に使う値"""
+        return file_signature(self.path)
+
+    def _compact(self, keys: Dict) -> None:
+        if self.log.should_compact(sum(len(data["history"]) for data in keys.values())):
+            self.compact(keys)
+
+    def compact(self, keys: Dict) -> None:
+        """検出ログを現在の履歴だけに書き直す"""
+        self.log.rewrite({key: data["history"] for key, data in keys.items() if len(data["history"])})
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteKeyStore:
+    """
+    SQLite (WAL モード) にキーと履歴を保存する
+
+    保存時は変更のあったキーだけを UPSERT し、履歴は行として追加する。
+    1 回の保存は 1 トランザクションで、history_limit を超えた古い履歴はその中で削除する。
+    照合範囲（scope）は文字列かそのリストのため JSON で保存する（未指定は NULL）。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS keys (
+            key TEXT PRIMARY KEY,
+            description TEXT NOT NULL DEFAULT '',
+            expected_frequency TEXT NOT NULL DEFAULT 'daily',
+            last_received TEXT,
+            scope TEXT
+        );
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT NOT NULL REFERENCES keys(key) ON DELETE CASCADE,
+            date TEXT NOT NULL,
+            subject TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS history_key ON history(key, id);
+    """
+
+    def __init__(self, path: str, history_limit: int = 10):
+        self.path = path
+        self.history_limit = history_limit
+        self._locked = False
+        import sqlite3  # JSON 保存のときは読み込まない
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(self.SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        """以前のバージョンで作ったデータベースに無い列を追加する"""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(keys)")}
+        if "scope" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE keys ADD COLUMN scope TEXT")
+            logger.info(f"キーのデータベースに scope 列を追加しました: {self.path}")
+
+    def load(self) -> Dict:
+        keys = {}
+        for key, description, frequency, last_received, scope in self.conn.execute(
+                "SELECT key, description, expected_frequency, last_received, scope FROM keys"):
+            keys[key] = {
+                "description": description,
+                "expected_frequency": frequency,
+                "last_received": last_received,
+                "history": History(self.history_limit)
+            }
+            if scope is not None:
+                keys[key]["scope"] = json.loads(scope)
+        for key, date, subject in self.conn.execute("SELECT key, date, subject FROM history ORDER BY id"):
+            keys[key]["history"].append(Detection.from_iso(date, subject))
+        return keys
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        BEGIN IMMEDIATE で書き込みロックを取り、読み込み〜保存を他のプロセスと直列にする
+
+        ブロックの中の save は同じトランザクションで書き込み、ブロックを抜けるときにコミットする
+        （例外の場合はロールバック）。同じストアで入れ子にしないこと。
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        self._locked = True
+        try:
+            yield
+        except BaseException:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+        finally:
+            self._locked = False
+
+    def signature(self):
+        """他の接続がコミットするたびに変わる値（PRAGMA data_version。自分のコミットでは変わらない）"""
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def save(self, keys: Dict, changes: KeyChanges) -> None:
+        if not changes:
+            return
+        if self._locked:
+            # lock() のトランザクションの中。コミットは lock() を抜けるときに行う
+            self._write(keys, changes)
+            return
+        with self.conn:
+            self._write(keys, changes)
+
+    def _write(self, keys: Dict, changes: KeyChanges) -> None:
+        if changes.removed:
+            # history は ON DELETE CASCADE で消える
+            self.conn.executemany("DELETE FROM keys WHERE key = ?", [(key,) for key in changes.removed])
+        self.conn.executemany(
+            """INSERT INTO keys (key, description, expected_frequency, last_received, scope)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(key) DO UPDATE SET
+                   description = excluded.description,
+                   expected_frequency = excluded.expected_frequency,
+                   last_received = excluded.last_received,
+                   scope = excluded.scope""",
+            [(key, keys[key].get("description", ""), keys[key].get("expected_frequency", "daily"),
+              keys[key].get("last_received"), self._encode_scope(keys[key].get("scope")))
+             for key in changes.upserted if key in keys])
+        self.conn.executemany(
+            "INSERT INTO history (key, date, subject) VALUES (?, ?, ?)",
+            [(key, entry.date, entry.subject) for key, entry in changes.history])
+        if self.history_limit > 0:
+            self._prune({key for key, _ in changes.history})
+
+    @staticmethod
+    def _encode_scope(scope) -> Optional[str]:
+        return None if scope is None else json.dumps(scope, ensure_ascii=False)
+
+    def _prune(self, keys: Set[str]) -> None:
+        self.conn.executemany(
+            """DELETE FROM history WHERE key = ? AND id NOT IN (
+                   SELECT id FROM history WHERE key = ? ORDER BY id DESC LIMIT ?)""",
+            [(key, key, self.history_limit) for key in keys])
+
+    def import_json(self, json_path: str) -> int:
+        """keys.json と検出ログの内容を取り込み、取り込んだキーの数を返す（既存のキーは上書き）"""
+        keys = JsonKeyStore(json_path, self.history_limit).load()
+        changes = KeyChanges()
+        for key, data in keys.items():
+            changes.remove(key)
+            changes.upsert(key)
+            for entry in data["history"]:
+                changes.history.append((key, entry))
+        self.save(keys, changes)
+        logger.info(f"{json_path} から {len(keys)} 個のキーを取り込みました")
+        return len(keys)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def create_key_store(config: Dict, keys_path: str):
+    """config の storage に応じてバックエンドを作る（"json" または "sqlite"）"""
+    history_limit = config.get("history_limit", 10)
+    storage = config.get("storage", "json")
+    if storage == "sqlite":
+        return SqliteKeyStore(config.get("sqlite_path", "keys.db"), history_limit)
+    if storage != "json":
+        raise ValueError(f"不明な storage です: {storage}")
+    return JsonKeyStore(keys_path, history_limit, config.get("history_log_path"))
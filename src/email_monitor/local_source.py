@@ -0,0 +1,115 @@
+import mmap
+import os
+import logging
+from typing import Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger("LocalSource")
+
+MBOX = "mbox"
+MAILDIR = "maildir"
+
+
+def source_type(source: Dict) -> str:
+    """type が無い場合は cur/new を持つディレクトリを Maildir、それ以外を mbox とみなす"""
+    if source.get("type"):
+        return source["type"]
+    path = source["path"]
+    if os.path.isdir(os.path.join(path, "cur")) or os.path.isdir(os.path.join(path, "new")):
+        return MAILDIR
+    return MBOX
+
+
+def source_id(source: Dict) -> str:
+    """UID 状態のフォルダ ID に相当する識別子"""
+    return f"{source_type(source)}:{os.path.abspath(source['path'])}"
+
+
+def source_generation(source: Dict) -> int:
+    """
+    ファイル（ディレクトリ）の inode 番号
+
+    UIDVALIDITY の代わりに使い、ローテーションなどで別のファイルに置き換わった場合は
+    先頭から読み直す。
+    """
+    return os.stat(source["path"]).st_ino
+
+
+def iter_mbox(path: str, start: int) -> Iterator[Tuple[int, bytes]]:
+    """
+    mbox を mmap で読み、start バイト目以降のメールを (次のメールの開始位置, メールのバイト列) で返す
+
+    行頭の "From " でメールを区切り、ファイル全体はコピーせずにメール 1 通分ずつ取り出す
+    （エンベロープの From_ 行は除く）。末尾が改行で終わっていないメールは書き込み途中と
+    みなして返さない。
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if start >= size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[start:start + 5] != b"From ":
+                logger.warning(f"{path}: 位置 {start} がメールの先頭ではないため先頭から読み直します")
+                start = 0
+            position = start
+            while position < size:
+                separator = mm.find(b"\nFrom ", position)
+                end = size if separator < 0 else separator + 1
+                if separator < 0 and mm[size - 1:size] != b"\n":
+                    break
+                body_start = mm.find(b"\n", position, end) + 1 or end
+                yield end, mm[body_start:end]
+                position = end
+
+
+def iter_maildir(path: str, since_ns: Optional[int]) -> Iterator[Tuple[int, bytes]]:
+    """
+    Maildir の new/ と cur/ にあるメールを更新時刻の順に (更新時刻 ns, メールのバイト列) で返す
+
+    since_ns 以降に更新されたものだけが対象。同じ時刻のメールを取りこぼさないよう
+    since_ns と同じ時刻のものも返す（処理済みかどうかは呼び出し側で判定する）。
+    new/ から cur/ への移動では更新時刻は変わらない。
+    """
+    entries = []
+    for subdir in ("new", "cur"):
+        directory = os.path.join(path, subdir)
+        if not os.path.isdir(directory):
+            continue
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime_ns
+                except FileNotFoundError:
+                    # 読み込みまでの間に移動・削除されたメール
+                    continue
+                if entry.is_file() and (since_ns is None or mtime >= since_ns):
+                    entries.append((mtime, entry.path))
+
+    for mtime, file_path in sorted(entries):
+        raw = _read_message(file_path)
+        if raw is not None:
+            yield mtime, raw
+
+
+def _read_message(file_path: str) -> Optional[bytes]:
+    """メールを読む。new/ から cur/ に移動済みの場合は移動先を読む"""
+    candidates = [file_path]
+    directory, name = os.path.split(file_path)
+    if os.path.basename(directory) == "new":
+        cur = os.path.join(os.path.dirname(directory), "cur")
+        candidates += [os.path.join(cur, moved) for moved in _listdir(cur) if moved.startswith(name + ":")]
+    for candidate in candidates:
+        try:
+            with open(candidate, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _listdir(path: str):
+    try:
+        return os.listdir(path)
+    except FileNotFoundError:
+        return []
@@ -0,0 +1,91 @@
+import binascii
+import datetime
+import email
+import email.parser
+import email.utils
+import quopri
+from email.header import decode_header
+from typing import Optional, Tuple
+
+
+def decode_header_value(value: Optional[str]) -> str:
+    """MIME エンコードされたヘッダ値（件名など）を文字列に復号する"""
+    if not value:
+        return ""
+    parts = []
+    for text, encoding in decode_header(value):
+        if isinstance(text, bytes):
+            text = decode_text(text, encoding)
+        parts.append(text)
+    return "".join(parts)
+
+
+def parse_date(value: Optional[str]) -> datetime.datetime:
+    date_tuple = email.utils.parsedate_tz(value) if value else None
+    if date_tuple:
+        return datetime.datetime.fromtimestamp(email.utils.mktime_tz(date_tuple))
+    return datetime.datetime.now()
+
+
+def decode_text(data: bytes, charset: Optional[str]) -> str:
+    try:
+        return data.decode(charset or 'utf-8', errors='replace')
+    except LookupError:
+        # 未知の charset は UTF-8 として扱う
+        return data.decode('utf-8', errors='replace')
+
+
+def decode_transfer_encoding(data: bytes, encoding: Optional[str]) -> bytes:
+    """
+    Content-Transfer-Encoding を解除する
+
+    部分取得（<0.N>）で途中までしか無いデータも扱えるよう、
+    base64 は 4 文字単位に切り詰めてから復号する。
+    """
+    encoding = (encoding or '7bit').lower()
+    if encoding == 'base64':
+        compact = b"".join(data.split())
+        compact = compact[:len(compact) - len(compact) % 4]
+        try:
+            return binascii.a2b_base64(compact)
+        except binascii.Error:
+            return b""
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(data)
+    return data
+
+
+def extract_text_body(msg) -> str:
+    """最初の text/plain パートを復号して返す"""
+    if msg.is_multipart():
+        for part in msg.walk():
+            if part.get_content_type() == "text/plain":
+                body_bytes = part.get_payload(decode=True)
+                if body_bytes:
+                    return decode_text(body_bytes, part.get_content_charset())
+    else:
+        body_bytes = msg.get_payload(decode=True)
+        if body_bytes:
+            return decode_text(body_bytes, msg.get_content_charset())
+    return ""
+
+
+def decode_message(raw: bytes, with_body: bool = True) -> Tuple[datetime.datetime, str, str]:
+    """
+    メール全体のバイト列から (日付, 件名, 本文) を取り出す
+
+    with_body が False の場合はヘッダだけを解析し、本文は空文字列にする（MIME 構造は解析しない）。
+    """
+    if not with_body:
+        msg = email.parser.BytesHeaderParser().parsebytes(raw)
+        return parse_date(msg['Date']), decode_header_value(msg['Subject']), ""
+    msg = email.message_from_bytes(raw)
+    return parse_date(msg['Date']), decode_header_value(msg['Subject']), extract_text_body(msg)
+
+
+def decode_partial_message(header: bytes, body: Optional[bytes], encoding: Optional[str],
+                           charset: Optional[str]) -> Tuple[datetime.datetime, str, str]:
+    """partial モードで取得したヘッダと本文パートから (日付, 件名, 本文) を取り出す"""
+    msg = email.message_from_bytes(header)
+    text = decode_text(decode_transfer_encoding(body, encoding), charset) if body is not None else ""
+    return parse_date(msg['Date']), decode_header_value(msg['Subject']), text
@@ -0,0 +1,190 @@
+import logging
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger("Matcher")
+
+# キーの照合範囲（keys.json の scope。文字列またはそのリスト）
+SCOPE_ANY = "any"          # 件名または本文（既定）
+SCOPE_SUBJECT = "subject"
+SCOPE_FROM = "from"
+SCOPE_BODY = "body"
+SCOPE_HEADER = "header:"   # header:X-Mailer のように任意のヘッダを指定する
+
+
+class KeyMatcher:
+    """
+    Aho-Corasick 法による複数キーの一括検索
+
+    キー集合からオートマトンを一度だけ構築し、テキストを 1 回走査するだけで
+    含まれるすべてのキーを見つける。Python の str は Unicode のコードポイント単位で
+    走査されるため、日本語のキーもそのまま扱える。
+
+    キーが少ない場合は C 実装の `key in text` を繰り返す方が速いため、
+    linear_scan_max_keys 個以下ではオートマトンを作らずに線形走査する
+    （benchmarks/bench_matcher.py で約 300 キーが損益分岐点）。
+    """
+
+    LINEAR_SCAN_MAX_KEYS = 256
+
+    def __init__(self, keys: Iterable[str], linear_scan_max_keys: Optional[int] = None):
+        self.keys = frozenset(keys)
+        if linear_scan_max_keys is None:
+            linear_scan_max_keys = self.LINEAR_SCAN_MAX_KEYS
+        self.linear = len(self.keys) <= linear_scan_max_keys
+        # 空文字列のキーは従来の `key in text` と同じく常に一致させる
+        self._always = [key for key in self.keys if key == ""]
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+        if self.linear:
+            return
+        for key in self.keys:
+            if key:
+                self._insert(key)
+        self._build_links()
+
+    def _insert(self, key: str) -> None:
+        node = 0
+        for ch in key:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(key)
+
+    def _build_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                # 失敗リンク先で一致するキーもこのノードで報告する
+                if self._out[self._fail[child]]:
+                    self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text: str) -> Set[str]:
+        """テキストに含まれるキーの集合を返す"""
+        if self.linear:
+            return {key for key in self.keys if key in text}
+        found = set(self._always)
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        node = 0
+        for ch in text:
+            while True:
+                nxt = goto[node].get(ch)
+                if nxt is not None:
+                    node = nxt
+                    break
+                if node == 0:
+                    break
+                node = fail[node]
+            if out[node]:
+                found.update(out[node])
+                if len(found) == len(self.keys):
+                    break
+        return found
+
+
+def _reuse(reusable: Dict[frozenset, KeyMatcher], names: List[str]) -> KeyMatcher:
+    """同じキーの集合の KeyMatcher があれば使い回す"""
+    matcher = reusable.get(frozenset(names))
+    return matcher if matcher is not None else KeyMatcher(names)
+
+
+def key_scopes(data: Dict) -> List[str]:
+    scope = data.get("scope") or SCOPE_ANY
+    scopes = [scope] if isinstance(scope, str) else list(scope)
+    return [scope.strip().lower() for scope in scopes] or [SCOPE_ANY]
+
+
+class ScopedMatcher:
+    """
+    キーごとの照合範囲（件名、差出人、任意のヘッダ、本文）を考慮した照合
+
+    ヘッダだけで判定できるキーを先に照合し、本文を対象とするキーのうち
+    まだ一致していないものが残っている場合だけ本文を取得・復号すればよいかを
+    needs_body() で判定できるようにする。範囲ごとに KeyMatcher を作る。
+    previous を渡すと、キーの集合が変わっていない範囲はその KeyMatcher を使い回す
+    （キーの追加・削除で作り直すのは、そのキーを含む範囲のオートマトンだけ）。
+    """
+
+    def __init__(self, keys: Dict[str, Dict], previous: Optional["ScopedMatcher"] = None):
+        header_keys: Dict[str, List[str]] = {}
+        body_keys: List[str] = []
+        # キー -> サーバー側 SEARCH の検索項目
+        self.search_fields: Dict[str, List[str]] = {}
+        for key, data in keys.items():
+            fields = []
+            for scope in key_scopes(data):
+                if scope.startswith(SCOPE_HEADER) and scope[len(SCOPE_HEADER):]:
+                    name = scope[len(SCOPE_HEADER):]
+                    header_keys.setdefault(name, []).append(key)
+                    fields.append(f"HEADER {name}")
+                    continue
+                if scope not in (SCOPE_ANY, SCOPE_SUBJECT, SCOPE_FROM, SCOPE_BODY):
+                    logger.warning(f"キー '{key}' の照合範囲 '{scope}' は不明なため件名と本文を照合します")
+                    scope = SCOPE_ANY
+                if scope in (SCOPE_ANY, SCOPE_SUBJECT):
+                    header_keys.setdefault("subject", []).append(key)
+                    fields.append("SUBJECT")
+                if scope in (SCOPE_ANY, SCOPE_BODY):
+                    body_keys.append(key)
+                    fields.append("BODY")
+                if scope == SCOPE_FROM:
+                    header_keys.setdefault("from", []).append(key)
+                    fields.append("FROM")
+            self.search_fields[key] = list(dict.fromkeys(fields))
+        self.keys = frozenset(keys)
+        reusable = {}
+        if previous is not None:
+            for matcher in list(previous.header_matchers.values()) + [previous.body_matcher]:
+                reusable[matcher.keys] = matcher
+        self.header_matchers = {name: _reuse(reusable, names) for name, names in header_keys.items()}
+        self.body_keys = frozenset(body_keys)
+        self.body_matcher = _reuse(reusable, body_keys)
+
+    @property
+    def header_names(self) -> List[str]:
+        """照合に使うヘッダ名"""
+        return list(self.header_matchers)
+
+    def match_headers(self, headers: Dict[str, str]) -> Set[str]:
+        """
+        ヘッダを対象とするキーのうち一致したもの
+
+        headers は header_names の各ヘッダの復号済みの値（複数ある場合は連結したもの）。
+        """
+        found: Set[str] = set()
+        for name, matcher in self.header_matchers.items():
+            value = headers.get(name)
+            if value:
+                found |= matcher.find(value)
+        return found
+
+    def needs_body(self, found: Set[str]) -> bool:
+        """本文を対象とするキーのうち、まだ一致していないものが残っているか"""
+        return not self.body_keys <= found
+
+    def match_body(self, body: str, found: Set[str]) -> Set[str]:
+        """ヘッダで一致したキーに本文で一致したキーを加える"""
+        return found | self.body_matcher.find(body)
+
+    def match_text(self, subject: str, body: str) -> Set[str]:
+        """
+        件名と本文だけで照合する（キャッシュからのバックフィル用）
+
+        差出人や任意のヘッダを対象とするキーは照合できない。
+        """
+        found = self.header_matchers["subject"].find(subject) if "subject" in self.header_matchers else set()
+        return self.match_body(body, found)
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .matcher import ScopedMatcher
+
+logger = logging.getLogger("MessageCache")
+
+
+class MessageCache:
+    """
+    取得・復号したメール（日付, 件名, 本文）のディスクキャッシュ
+
+    フォルダ / UIDVALIDITY / UID をキーに保存し、合計サイズが max_bytes を超えたら
+    最も長く参照されていないものから削除する。キーを追加したときにこのキャッシュを
+    照合すれば、IMAP に接続せずに過去のメールから受信履歴を埋められる。
+    走査中のワーカースレッドから書き込むため、接続はロックで保護する。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            folder_id TEXT NOT NULL,
+            uidvalidity INTEGER NOT NULL,
+            uid INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            last_access REAL NOT NULL,
+            PRIMARY KEY (folder_id, uidvalidity, uid)
+        );
+        CREATE INDEX IF NOT EXISTS messages_lru ON messages(last_access);
+    """
+
+    def __init__(self, path: str = "messages.db", max_bytes: int = 32 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+
+    def put_many(self, folder_id: str, uidvalidity: Optional[int], records: List[Tuple[int, str, str, str]]) -> None:
+        """(uid, 日付, 件名, 本文) の列を保存する"""
+        if uidvalidity is None or not records:
+            return
+        now = time.time()
+        rows = []
+        for uid, date, subject, body in records:
+            compressed = zlib.compress(body.encode('utf-8'))
+            rows.append((folder_id, uidvalidity, uid, date, subject, compressed,
+                         len(compressed) + len(subject.encode('utf-8')), now))
+        with self._lock, self.conn:
+            # UIDVALIDITY が変わったフォルダの古い UID は無効
+            self.conn.execute("DELETE FROM messages WHERE folder_id = ? AND uidvalidity != ?", (folder_id, uidvalidity))
+            self.conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        evicted = 0
+        cursor = self.conn.execute("SELECT rowid, size FROM messages ORDER BY last_access")
+        rowids = []
+        for rowid, size in cursor:
+            if self.total_bytes <= self.max_bytes:
+                break
+            rowids.append((rowid,))
+            self.total_bytes -= size
+            evicted += 1
+        self.conn.executemany("DELETE FROM messages WHERE rowid = ?", rowids)
+        logger.info(f"メールキャッシュから {evicted} 件を削除しました (残り {self.total_bytes} バイト)")
+
+    def iter_messages(self) -> Iterator[Tuple[str, str, str]]:
+        """キャッシュ内のすべてのメールの (日付, 件名, 本文) を日付順に返し、参照時刻を更新する"""
+        with self._lock:
+            rows = self.conn.execute("SELECT date, subject, body FROM messages ORDER BY date").fetchall()
+            with self.conn:
+                self.conn.execute("UPDATE messages SET last_access = ?", (time.time(),))
+        for date, subject, body in rows:
+            yield date, subject, zlib.decompress(body).decode('utf-8')
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def open_message_cache(config: Dict, create: bool = True) -> Optional[MessageCache]:
+    """
+    設定に従ってメールキャッシュを開く。message_cache_max_bytes が 0 なら None
+
+    create が False の場合、キャッシュのファイルがまだ無ければ作らずに None を返す。
+    """
+    max_bytes = config.get("message_cache_max_bytes", 32 * 1024 * 1024)
+    path = config.get("message_cache_path", "messages.db")
+    if max_bytes <= 0 or (not create and not os.path.exists(path)):
+        return None
+    return MessageCache(path, max_bytes)
+
+
+def backfill(config_manager, cache: Optional[MessageCache], key_names: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    メールキャッシュを照合して受信履歴を埋める（IMAP には接続しない）
+
+    key_names を省略した場合はすべてのキーが対象。キーごとに追加した履歴の件数を返す。
+    """
+    keys = config_manager.keys
+    key_names = [key for key in (key_names if key_names is not None else keys) if key in keys]
+    if cache is None or not key_names:
+        return {key: 0 for key in key_names}
+
+    # キャッシュには件名と本文しか無いため、差出人や任意のヘッダを対象とするキーは埋められない
+    matcher = ScopedMatcher({key: keys[key] for key in key_names})
+    matches: Dict[str, List[Dict]] = {key: [] for key in key_names}
+    scanned = 0
+    for date, subject, body in cache.iter_messages():
+        scanned += 1
+        for key in matcher.match_text(subject, body):
+            matches[key].append({"date": date, "subject": subject})
+
+    added = {key: config_manager.merge_history(key, entries) for key, entries in matches.items()}
+    config_manager.save_keys()
+    logger.info(f"キャッシュ内の {scanned} 件のメールから {sum(added.values())} 件の履歴を追加しました")
+    return added
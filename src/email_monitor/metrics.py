@@ -0,0 +1,139 @@
+import json
+import logging
+import threading
+import time
+from typing import Dict
+
+logger = logging.getLogger("Metrics")
+
+PREFIX = "mailchecker"
+
+# 走査の stats に "<フェーズ>_seconds" として記録される時間
+PHASES = ("connect", "status", "select", "search", "fetch", "decode", "match", "save")
+
+# 走査の stats のうちカウンタとして積算する項目
+SCAN_COUNTERS = {
+    "messages_fetched": "messages_scanned",
+    "bytes_fetched": "bytes_fetched",
+    "fetch_commands": "fetch_commands",
+    "search_commands": "search_commands",
+    "duplicates_skipped": "duplicates_skipped",
+    "body_decodes_avoided": "body_decodes_avoided",
+    "reconnects": "reconnects",
+    "status_commands": "status_commands",
+    "unselect_commands": "unselect_commands",
+    "folders_skipped": "folders_skipped",
+}
+
+
+class Metrics:
+    """
+    チェックの計測値（フェーズごとの時間、カウンタ、ゲージ）
+
+    フェーズの時間は各処理が走査の stats に記録したものを observe_cycle() で集計する。
+    並行して走査したフォルダの時間は合算するため、フェーズの合計はサイクルの経過時間を
+    超えることがある（decode は復号ワーカーでの処理時間の合計）。
+    enabled が False の間は集計も出力もせず、呼び出しはすぐに戻る。
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {"cycles": 0, "matches": 0, "errors": 0}
+        self.gauges: Dict[str, float] = {}
+        self.phase_seconds: Dict[str, float] = {phase: 0.0 for phase in PHASES}
+        self.last_cycle: Dict[str, float] = {}
+
+    def inc(self, name: str, value: float = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe_cycle(self, stats: Dict, cycle_seconds: float, matches: int, errors: int) -> None:
+        """1 回のチェックの集計済み stats を取り込む"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters["cycles"] += 1
+            self.counters["matches"] += matches
+            self.counters["errors"] += errors
+            for name, counter in SCAN_COUNTERS.items():
+                self.counters[counter] = self.counters.get(counter, 0) + stats.get(name, 0)
+            last = {"cycle": cycle_seconds}
+            for phase in PHASES:
+                seconds = stats.get(f"{phase}_seconds", 0.0)
+                self.phase_seconds[phase] += seconds
+                last[phase] = seconds
+            self.last_cycle = last
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "phase_seconds_total": dict(self.phase_seconds),
+                "last_cycle_seconds": dict(self.last_cycle),
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=4, ensure_ascii=False)
+
+    def to_prometheus(self) -> str:
+        """Prometheus のテキスト形式"""
+        data = self.to_dict()
+        lines = []
+        for name, value in sorted(data["counters"].items()):
+            metric = f"{PREFIX}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, value in sorted(data["gauges"].items()):
+            metric = f"{PREFIX}_{name}"
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        metric = f"{PREFIX}_phase_seconds_total"
+        lines.append(f"# TYPE {metric} counter")
+        for phase, value in data["phase_seconds_total"].items():
+            lines.append(f'{metric}{{phase="{phase}"}} {value}')
+        metric = f"{PREFIX}_last_cycle_phase_seconds"
+        lines.append(f"# TYPE {metric} gauge")
+        for phase, value in data["last_cycle_seconds"].items():
+            lines.append(f'{metric}{{phase="{phase}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+def add_time(stats: Dict, phase: str, started: float) -> None:
+    """started（time.perf_counter() の値）からの経過時間を stats のフェーズ時間に加える"""
+    key = f"{phase}_seconds"
+    stats[key] = stats.get(key, 0.0) + (time.perf_counter() - started)
+
+
+def serve_metrics(metrics: Metrics, port: int, host: str = "127.0.0.1"):
+    """/metrics で Prometheus 形式を返す HTTP サーバーをバックグラウンドで起動する"""
+    # http.server は email なども読み込むため、常駐モードで使うときだけ読み込む
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"メトリクスを http://{host}:{server.server_address[1]}/metrics で公開します")
+    return server
+
@@ -0,0 +1,879 @@
+import asyncio
+import imaplib
+import re
+import email
+import email.parser
+import datetime
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from .config_manager import ConfigManager
+from .uid_state import UidState
+from .imap_fetch import (chunk_uids, chunk_uids_by_size, fetch_batched, fetch_sections, fetch_sizes, find_text_part,
+                        get_header_fields, part_size)
+from .matcher import ScopedMatcher
+from .server_search import SERVER, choose_strategy, server_search_uids
+from .idle import idle_wait
+from .connection import ImapConnectionManager, ImapSessionPool, pool_key
+from .async_checker import AsyncChecker
+from .seen_index import SeenIndex
+from .schedule import parse_received
+from .message_cache import backfill, open_message_cache
+from .mail_parser import decode_header_value, decode_message, decode_partial_message
+from .pipeline import ByteBudget, run_pipeline
+from .metrics import Metrics, add_time, serve_metrics
+from .local_source import MBOX, iter_maildir, iter_mbox, source_generation, source_id, source_type
+from .poll_scheduler import PollScheduler
+from .notifier import Notifier
+from .cluster import work_items
+
+logger = logging.getLogger("EmailMonitor")
+
+# partial モードで最初に取得するヘッダ（これに照合範囲のヘッダを加える。本文は取得しない）
+PARTIAL_HEADER_FIELDS = ["DATE", "SUBJECT", "MESSAGE-ID", "FROM"]
+
+# folder_precheck で STATUS に指定する項目（CONDSTORE に対応していれば HIGHESTMODSEQ を加える）
+STATUS_ITEMS = ["MESSAGES", "UIDNEXT", "UIDVALIDITY"]
+STATUS_PATTERN = re.compile(r"(MESSAGES|UIDNEXT|UIDVALIDITY|HIGHESTMODSEQ) (\d+)", re.IGNORECASE)
+
+# 起動時にだけ読む設定（変更しても再起動するまで反映されない）
+RESTART_SETTINGS = ("storage", "sqlite_path", "history_limit", "history_log_path", "state_path", "seen_index_path",
+                    "seen_max_entries", "seen_max_age_days", "message_cache_path", "message_cache_max_bytes",
+                    "metrics_port", "metrics_host", "idle", "cluster_path")
+
+class EmailMonitor:
+    def __init__(self, config: ConfigManager):
+        self.config_manager = config
+        self.uid_state = UidState(config.config.get("state_path", "state.json"))
+        self.seen_index = SeenIndex(
+            config.config.get("seen_index_path", "seen.json"),
+            config.config.get("seen_max_entries", 100000),
+            config.config.get("seen_max_age_days", 30),
+        )
+        self.last_cycle_stats: Dict = {}
+        self.message_cache = open_message_cache(config.config)
+        # アカウント（接続先の設定）ごとのセッションのプール
+        self._pools: Dict[Tuple, ImapSessionPool] = {}
+        self._decode_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._decode_pool_lock = threading.Lock()
+        self._matcher: Optional[ScopedMatcher] = None
+        self._matcher_version = -1
+        self.metrics = Metrics(bool(config.config.get("metrics", False) or config.config.get("metrics_port")))
+        self.poll_scheduler = PollScheduler(config.config)
+        self.notifier = Notifier(config.config)
+        # 設定の変更で置き換えた Notifier の送信待ちを送り終えるスレッド
+        self._closing_notifiers: List[threading.Thread] = []
+        # 最後に判定した未着のキー（IDLE では変わったときだけログに出す）
+        self._logged_missing: Optional[Set[str]] = None
+
+    def check_emails(self, only: Optional[Set[str]] = None, raise_if_all_failed: bool = False) -> Dict:
+        """すべて（only を指定した場合はそのフォルダ ID）のアカウント・フォルダをチェックする（AsyncChecker の同期ラッパー）"""
+        return asyncio.run(AsyncChecker(self).check_all(only, raise_if_all_failed))
+
+    def folder_ids(self) -> List[str]:
+        """チェックするフォルダ・ローカルのメールボックスの ID（UID 状態と同じ）"""
+        return [item_id for item_id, _, _ in work_items(self.config_manager)]
+
+    def reload(self) -> Tuple[Set[str], Set[str]]:
+        """
+        config.json / keys.json の変更を取り込み、(変更された設定の名前, 変更されたキー) を返す
+
+        照合エンジンは次のチェックで変更のあった範囲だけ作り直す。IMAP セッションは
+        接続先の設定が変わったフォルダと、監視しなくなったフォルダのものだけを閉じる。
+        """
+        config_names, key_names = self.config_manager.reload()
+        if config_names:
+            self._apply_config(config_names)
+        return config_names, key_names
+
+    def _apply_config(self, names: Set[str]) -> None:
+        config = self.config_manager.config
+        restart = sorted(names.intersection(RESTART_SETTINGS))
+        if restart:
+            logger.warning(f"次の設定の変更は再起動するまで反映されません: {', '.join(restart)}")
+        if "metrics" in names:
+            self.metrics.enabled = bool(config.get("metrics", False) or config.get("metrics_port"))
+        if "check_interval" in names or any(name.startswith("poll_") for name in names):
+            # フォルダごとの静穏の回数と次のチェック時刻は引き継ぐ
+            scheduler = PollScheduler(config)
+            scheduler.quiet, scheduler.next_poll = self.poll_scheduler.quiet, self.poll_scheduler.next_poll
+            self.poll_scheduler = scheduler
+        if names & {"notifications", "notify_repeat_hours"}:
+            # 以前の送信先への送信待ちはチェックを止めないよう別のスレッドで送り終える。
+            # 通知済みの未着は再通知しない
+            alerted = self.notifier._alerted
+            self._closing_notifiers.append(self.notifier.close_in_background())
+            self.notifier = Notifier(config)
+            self.notifier._alerted = alerted
+
+        accounts = {pool_key(account): account for account in self.config_manager.get_accounts()}
+        for key, pool in list(self._pools.items()):
+            account = accounts.get(key)
+            if account is not None:
+                # 再接続の間隔や同時実行数などはそのまま新しい値を使う
+                pool.config = account
+                pool.size = max(account.get("max_concurrency", 4), 1)
+                continue
+            logger.info(f"{pool.config['email']}@{pool.config['imap_server']}: "
+                        f"接続先の設定が変わったため IMAP セッションを閉じます")
+            pool.close()
+            del self._pools[key]
+
+    def _wait(self, seconds: float) -> None:
+        """seconds 秒待つ。その間も reload_interval 秒（既定 60、0 は無効）ごとに設定とキーの変更を取り込む"""
+        end = time.monotonic() + seconds
+        while True:
+            remaining = end - time.monotonic()
+            interval = self.config_manager.config.get("reload_interval", 60)
+            if remaining <= 0:
+                return
+            if interval <= 0 or remaining <= interval:
+                time.sleep(remaining)
+                return
+            time.sleep(interval)
+            self.reload()
+
+    def close(self) -> None:
+        """IMAP セッションを終了し、送信待ちの通知を送る"""
+        self.notifier.close()
+        for thread in self._closing_notifiers:
+            thread.join()
+        self._closing_notifiers = []
+        for pool in self._pools.values():
+            pool.close()
+        if self._decode_pool is not None:
+            self._decode_pool.shutdown()
+            self._decode_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+            self._process_pool = None
+
+    def session_pool(self, account: Dict) -> ImapSessionPool:
+        """アカウントのセッションのプール（同時に使うセッションは max_concurrency 個まで）"""
+        key = pool_key(account)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = ImapSessionPool(account, account.get("max_concurrency", 4))
+        return pool
+
+    def scan_folder(self, account: Dict, folder: str, key_names: List[str]) -> Dict:
+        """
+        フォルダのセッションを取得して走査する。ワーカースレッドから呼ばれる
+
+        folder_precheck（既定 True）の場合は先に STATUS を 1 回送り、前回最後まで走査した
+        ときと結果が同じなら SELECT / SEARCH / FETCH を行わない（走査結果の skipped が True）。
+        STATUS がセッションの生存確認を兼ねるため NOOP は送らず、再利用したセッションで
+        STATUS が失敗した場合は接続し直して 1 回だけやり直す。
+        セッションはアカウントのプールから借り、走査が終わったら返す。
+        """
+        pool = self.session_pool(account)
+        connection = pool.checkout(folder)
+        try:
+            return self._scan_with_session(connection, account, folder, key_names)
+        finally:
+            pool.checkin(folder)
+
+    def _scan_with_session(self, connection: ImapConnectionManager, account: Dict, folder: str,
+                           key_names: List[str]) -> Dict:
+        connect_seconds, reconnects = connection.connect_seconds, connection.reconnects
+        use_precheck = account.get("folder_precheck", True)
+        reused = connection.mail is not None
+        mail = connection.get(verify=not use_precheck)
+        folder_id = UidState.folder_id(account, folder)
+        precheck: Dict = {}
+        try:
+            status = None
+            if use_precheck:
+                try:
+                    status = self._folder_status(mail, folder, precheck)
+                except (imaplib.IMAP4.abort, OSError) as e:
+                    if not reused:
+                        raise
+                    logger.warning(f"IMAP セッションが無効になりました (接続経過 {connection.age:.0f}秒): {e}")
+                    connection.invalidate()
+                    mail = connection.get()
+                    status = self._folder_status(mail, folder, precheck)
+            if status is not None and self.uid_state.status_unchanged(folder_id, status):
+                scan = self._unchanged_scan(folder_id, status)
+            else:
+                scan = self._scan_folder(mail, account, folder, key_names)
+                # 走査中に UIDVALIDITY が変わった場合は次回も走査する
+                if status is not None and status["uidvalidity"] == scan["uidvalidity"]:
+                    scan["status"] = status
+        except (imaplib.IMAP4.abort, OSError):
+            connection.invalidate()
+            raise
+        scan["stats"].update(precheck)
+        scan["stats"]["connect_seconds"] = connection.connect_seconds - connect_seconds
+        scan["stats"]["reconnects"] = connection.reconnects - reconnects
+        return scan
+
+    def _folder_status(self, mail, folder: str, stats: Dict) -> Optional[Dict[str, int]]:
+        """
+        STATUS でフォルダの MESSAGES / UIDNEXT / UIDVALIDITY（CONDSTORE に対応していれば
+        HIGHESTMODSEQ も）を取得する。取得できなければ None（通常どおり走査する）
+
+        選択中のフォルダへの STATUS は新着の確認に使えない（RFC 9051 6.3.11。NOOP まで古い値を
+        返すサーバーがある）ため、プールのセッションが前の走査のフォルダを選択したままなら先に閉じる。
+        """
+        items = STATUS_ITEMS + (["HIGHESTMODSEQ"] if "CONDSTORE" in mail.capabilities else [])
+        started = time.perf_counter()
+        stats["status_commands"] = 1
+        try:
+            if mail.state == "SELECTED":
+                self._unselect(mail, folder, stats)
+            typ, data = mail.status(folder, f"({' '.join(items)})")
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as e:
+            logger.warning(f"{folder}: STATUS に失敗したため通常どおり走査します: {e}")
+            return None
+        finally:
+            add_time(stats, "status", started)
+        if typ != 'OK' or not data or not data[0]:
+            return None
+        response = data[0].decode("utf-8", "replace") if isinstance(data[0], bytes) else str(data[0])
+        # フォルダ名に数字が含まれていても誤読しないよう、最後の括弧の中だけを読む
+        status = {name.lower(): int(value)
+                  for name, value in STATUS_PATTERN.findall(response[response.rfind("("):])}
+        if any(item.lower() not in status for item in items):
+            return None
+        return status
+
+    @staticmethod
+    def _unselect(mail, folder: str, stats: Dict) -> None:
+        """選択中のフォルダを EXPUNGE せずに閉じる"""
+        if "UNSELECT" in mail.capabilities:
+            mail.unselect()
+            stats["unselect_commands"] = 1
+        else:
+            # READ-WRITE で選択したままの CLOSE は削除フラグのメールを消去するため、読み取り専用で選択し直して閉じる
+            mail.select(folder, readonly=True)
+            mail.close()
+            stats["unselect_commands"] = 2
+
+    @staticmethod
+    def _unchanged_scan(folder_id: str, status: Dict[str, int]) -> Dict:
+        """STATUS が前回と同じで走査を省略したフォルダの走査結果"""
+        return {
+            "folder_id": folder_id,
+            "uidvalidity": status["uidvalidity"],
+            "last_uid": None,
+            "detections": [],
+            "message_keys": set(),
+            "stats": {"fetch_commands": 0, "messages_fetched": 0, "sections_fetched": 0, "bytes_fetched": 0,
+                      "search_commands": 0, "duplicates_skipped": 0, "body_decodes_avoided": 0,
+                      "round_trips_saved": 0, "new_messages": 0, "folders_skipped": 1},
+            "skipped": True,
+        }
+
+    def _scan_folder(self, mail, account: Dict, folder: str, key_names: List[str]) -> Dict:
+        """
+        フォルダを選択し、ウォーターマーク以降のメールを照合する
+
+        キーと UID 状態は変更せず、検出結果を返す（反映は apply_scan で行う）。
+        """
+        stats = {"fetch_commands": 0, "messages_fetched": 0, "sections_fetched": 0, "bytes_fetched": 0,
+                 "search_commands": 1, "duplicates_skipped": 0, "body_decodes_avoided": 0}
+        started = time.perf_counter()
+        mail.select(folder)
+        add_time(stats, "select", started)
+
+        folder_id = UidState.folder_id(account, folder)
+        uidvalidity = self._get_uidvalidity(mail)
+        watermark = self.uid_state.get_watermark(folder_id, uidvalidity)
+        if not watermark:
+            # UID は 1 から始まる。以前のバージョンが保存した 0 は位置が分からないものとして扱う
+            watermark = None
+        uidnext = self._get_uidnext(mail)
+        criteria = self._search_criteria(watermark)
+        started = time.perf_counter()
+        uids = self._search_new_uids(mail, criteria, watermark)
+        add_time(stats, "search", started)
+        stats["new_messages"] = len(uids)
+        logger.info(f"{folder_id}: {len(uids)} 件の新着メールを確認します (UID > {watermark})")
+
+        matcher = self._get_matcher()
+
+        fetch_uids = uids
+        strategy = choose_strategy(account, key_names, len(uids))
+        if strategy == SERVER and uids:
+            # サーバー側で候補を絞り込み、取得したメールはローカルで再照合する
+            candidates = server_search_uids(mail, key_names, criteria, account, stats, matcher.search_fields)
+            fetch_uids = [uid for uid in uids if uid in candidates]
+        stats["strategy"] = strategy
+        logger.info(f"{folder_id}: 照合方式 {strategy} (キー {len(key_names)} 個, 新着 {len(uids)} 件, 取得対象 {len(fetch_uids)} 件)")
+
+        detections = []
+        message_keys: Set[str] = set()
+        cache_records = []
+        cache_batch_size = account.get("fetch_batch_size", 200)
+        for uid, message_key, hits, need_body, email_date, subject, body in self._iter_messages(
+                mail, account, fetch_uids, matcher, message_keys, stats):
+            self._match_message(matcher, message_key, hits, need_body, email_date, subject, body, detections, stats)
+            # 本文を復号しなかったメールは、後から追加した本文のキーのバックフィルに使えないためキャッシュしない
+            if self.message_cache is not None and need_body:
+                cache_records.append((uid, email_date.isoformat(), subject, body))
+                if len(cache_records) >= cache_batch_size:
+                    self.message_cache.put_many(folder_id, uidvalidity, cache_records)
+                    cache_records = []
+        if self.message_cache is not None:
+            self.message_cache.put_many(folder_id, uidvalidity, cache_records)
+
+        # 1通ずつ FETCH した場合と比べて削減できたラウンドトリップ数
+        stats["round_trips_saved"] = (
+            stats["messages_fetched"] + stats["sections_fetched"] - stats["fetch_commands"]
+        )
+        return {
+            "folder_id": folder_id,
+            "uidvalidity": uidvalidity,
+            "last_uid": self._next_watermark(uids, watermark, uidnext),
+            "detections": detections,
+            "message_keys": message_keys,
+            "stats": stats,
+        }
+
+    def _match_headers(self, matcher: ScopedMatcher, header, stats: Dict) -> Tuple[Set[str], bool]:
+        """
+        ヘッダだけで判定できるキーを照合し、(一致したキー, 本文の照合が必要か) を返す
+
+        取得用のスレッドで呼ばれるため、時間は照合用のスレッドとは別の項目に記録する。
+        """
+        started = time.perf_counter()
+        hits = matcher.match_headers({
+            name: " ".join(decode_header_value(str(value)) for value in header.get_all(name) or [])
+            for name in matcher.header_names
+        })
+        need_body = matcher.needs_body(hits)
+        if not need_body:
+            stats["body_decodes_avoided"] += 1
+        add_time(stats, "header_match", started)
+        return hits, need_body
+
+    @staticmethod
+    def _merge_header_match_time(stats: Dict) -> None:
+        stats["match_seconds"] = stats.get("match_seconds", 0.0) + stats.pop("header_match_seconds", 0.0)
+
+    def _match_message(self, matcher: ScopedMatcher, message_key: str, hits: Set[str], need_body: bool,
+                       email_date: datetime.datetime, subject: str, body: str, detections: List,
+                       stats: Dict) -> None:
+        started = time.perf_counter()
+        found = matcher.match_body(body, hits) if need_body else hits
+        for key in sorted(found):
+            detections.append((key, email_date, subject, message_key))
+        add_time(stats, "match", started)
+
+    def scan_local(self, source: Dict, key_names: List[str], max_bytes: Optional[int] = None,
+                   backlog: bool = False) -> Dict:
+        """
+        mbox / Maildir を IMAP を使わずに走査する（_scan_folder に相当し、結果は apply_scan で反映する）
+
+        読み込んだ位置（mbox はバイトオフセット、Maildir は更新時刻）を処理済み UID の代わりに、
+        inode 番号を UIDVALIDITY の代わりに UID 状態に記録し、次回はその続きから読む。
+        max_bytes を指定した場合はその量を読んだところで止め、scan["complete"] を False にする。
+        件数は読み終わるまで分からないため、backlog（アーカイブの取り込み）の場合に
+        decode_processes のプロセスプールで復号する。
+        """
+        config = self.config_manager.config
+        folder_id = source_id(source)
+        generation = source_generation(source)
+        watermark = self.uid_state.get_watermark(folder_id, generation)
+        kind = source_type(source)
+        logger.info(f"{folder_id}: 位置 {watermark} 以降のメールを確認します")
+
+        stats = {"fetch_commands": 0, "messages_fetched": 0, "sections_fetched": 0, "bytes_fetched": 0,
+                 "search_commands": 0, "duplicates_skipped": 0, "body_decodes_avoided": 0, "strategy": kind}
+        budget = ByteBudget(config.get("max_inflight_bytes", 64 * 1024 * 1024))
+        message_keys: Set[str] = set()
+        progress = {"position": watermark, "complete": False}
+        matcher = self._get_matcher()
+
+        def produce() -> Iterator[Tuple[str, tuple, int]]:
+            if kind == MBOX:
+                messages = iter_mbox(source["path"], watermark or 0)
+            else:
+                messages = iter_maildir(source["path"], watermark)
+            header_parser = email.parser.BytesHeaderParser()
+            for position, raw in messages:
+                # 上限に達したら止める。ただし Maildir の同じ時刻のメールの途中では止めない
+                # （次回は同じ時刻から読み直すため、止めると同じメールを読み続けることがある）
+                if (max_bytes is not None and stats["bytes_fetched"] >= max_bytes
+                        and position != progress["position"]):
+                    return
+                progress["position"] = position
+                stats["messages_fetched"] += 1
+                stats["bytes_fetched"] += len(raw)
+                header = header_parser.parsebytes(raw)
+                message_key = self._unseen_message_key(header, message_keys, stats)
+                if message_key is None:
+                    continue
+                hits, need_body = self._match_headers(matcher, header, stats)
+                budget.acquire(len(raw))
+                yield (message_key, hits, need_body), (raw, need_body), len(raw)
+            progress["complete"] = True
+
+        executor, workers = self._get_decode_executor(
+            config, config.get("process_decode_min_messages", 200) if backlog else 0)
+        detections = []
+        for (message_key, hits, need_body), (email_date, subject, body) in run_pipeline(
+                produce(), decode_message, executor, budget, max(workers, 1) * 4, stats):
+            self._match_message(matcher, message_key, hits, need_body, email_date, subject, body, detections, stats)
+        self._merge_header_match_time(stats)
+        stats["peak_inflight_bytes"] = budget.peak
+        stats["round_trips_saved"] = 0
+        stats["new_messages"] = stats["messages_fetched"]
+
+        last_position = progress["position"]
+        return {
+            "folder_id": folder_id,
+            "uidvalidity": generation,
+            "last_uid": last_position if last_position is not None else 0,
+            "detections": detections,
+            "message_keys": message_keys,
+            "stats": stats,
+            "complete": progress["complete"],
+        }
+
+    def ingest(self, source: Dict) -> Dict:
+        """
+        mbox / Maildir を最後まで取り込む（アーカイブからの受信履歴の作成用）
+
+        local_chunk_bytes（既定 64MB）ごとに反映と保存を行うため、中断しても
+        次回は保存した位置から再開する。
+        """
+        keys = self.config_manager.keys
+        results = {key: False for key in keys}
+        chunk_bytes = self.config_manager.config.get("local_chunk_bytes", 64 * 1024 * 1024)
+        while True:
+            scan = self.scan_local(source, list(keys), chunk_bytes, backlog=True)
+            self.apply_scan(scan, results)
+            self.save_state()
+            if scan["complete"]:
+                return results
+
+    def apply_scan(self, scan: Dict, results: Dict) -> int:
+        """走査結果をキーの状態と UID 状態に反映し（保存はしない）、記録した検出の数を返す"""
+        if scan.get("skipped"):
+            logger.debug(f"{scan['folder_id']}: 前回から変更が無いため走査を省略しました")
+            return 0
+        keys = self.config_manager.keys
+        # 並行して走査した別のフォルダで先に処理済みになったメールは除く
+        already_seen = {message_key for message_key in scan["message_keys"] if message_key in self.seen_index}
+        matches = 0
+        for key, email_date, subject, message_key in scan["detections"]:
+            if key not in keys or message_key in already_seen:
+                continue
+            self.config_manager.record_detection(key, email_date.isoformat(), subject)
+            self.notifier.detected(key, email_date.isoformat(), subject)
+            results[key] = True
+            matches += 1
+            logger.info(f"キー '{key}' を含むメールを検出: {subject}")
+
+        for message_key in scan["message_keys"]:
+            self.seen_index.add(message_key)
+        self.uid_state.update(scan["folder_id"], scan["uidvalidity"], scan["last_uid"], scan.get("status"))
+        stats = scan["stats"]
+        logger.info(
+            f"{scan['folder_id']}: チェック完了 (取得 {stats['messages_fetched']} 件 / {stats['bytes_fetched']} バイト, "
+            f"FETCH {stats['fetch_commands']} 回, 削減ラウンドトリップ {stats['round_trips_saved']} 回, "
+            f"処理済みのためスキップ {stats['duplicates_skipped'] + len(already_seen)} 件, "
+            f"本文の復号を省略 {stats.get('body_decodes_avoided', 0)} 件)"
+        )
+        return matches
+
+    def save_state(self) -> float:
+        """キー・UID 状態・処理済みの記録を保存し、かかった秒数を返す"""
+        started = time.perf_counter()
+        self.config_manager.save_keys()
+        self.uid_state.save()
+        self.seen_index.save()
+        return time.perf_counter() - started
+
+    def observe_cycle(self, stats: Dict, cycle_seconds: float, matches: int, errors: int) -> None:
+        """1 回のチェックの結果をメトリクスに取り込む（メトリクスが無効なら何もしない）"""
+        if not self.metrics.enabled:
+            return
+        self.metrics.observe_cycle(stats, cycle_seconds, matches, errors)
+        self.metrics.set_gauge("keys_tracked", len(self.config_manager.keys))
+        self.metrics.set_gauge("overdue_keys", len(self.config_manager.deadlines.overdue(time.time())))
+        self.metrics.set_gauge("peak_inflight_bytes", stats.get("peak_inflight_bytes", 0))
+
+    def start_metrics_server(self) -> None:
+        """metrics_port が設定されていれば Prometheus 形式のエンドポイントを起動する（常駐モード用）"""
+        config = self.config_manager.config
+        if config.get("metrics_port"):
+            serve_metrics(self.metrics, config["metrics_port"], config.get("metrics_host", "127.0.0.1"))
+
+    def _check_folder(self, mail, account: Dict, folder: str) -> Dict:
+        """1 つのフォルダを走査して結果を反映・保存する（IDLE モード用）"""
+        started = time.perf_counter()
+        keys = self.config_manager.keys
+        results = {key: False for key in keys}
+        scan = self._scan_folder(mail, account, folder, list(keys))
+        matches = self.apply_scan(scan, results)
+        scan["stats"]["save_seconds"] = self.save_state()
+        self.last_cycle_stats = dict(scan["stats"], folders={scan["folder_id"]: scan["stats"]})
+        self.observe_cycle(self.last_cycle_stats, time.perf_counter() - started, matches, 0)
+        return results
+
+    def backfill(self, key_names: Optional[List[str]] = None) -> Dict[str, int]:
+        """メールキャッシュを照合して受信履歴を埋める（message_cache.backfill を参照）"""
+        return backfill(self.config_manager, self.message_cache, key_names)
+
+    def _get_matcher(self) -> ScopedMatcher:
+        """キー集合か照合範囲が変わった場合だけ照合エンジンを再構築する（変わらない範囲は使い回す）"""
+        if self._matcher is None or self._matcher_version != self.config_manager.keys_version:
+            self._matcher = ScopedMatcher(self.config_manager.keys, self._matcher)
+            self._matcher_version = self.config_manager.keys_version
+        return self._matcher
+
+    def _get_uidvalidity(self, mail) -> Optional[int]:
+        _, data = mail.response('UIDVALIDITY')
+        if data and data[0]:
+            return int(data[0])
+        return None
+
+    def _get_uidnext(self, mail) -> Optional[int]:
+        _, data = mail.response('UIDNEXT')
+        if data and data[-1]:
+            return int(data[-1])
+        return None
+
+    @staticmethod
+    def _next_watermark(uids: List[int], watermark: Optional[int], uidnext: Optional[int]) -> Optional[int]:
+        """
+        走査後のウォーターマーク。None なら保存しない
+
+        直近7日分の検索が空だった場合は SELECT の UIDNEXT - 1 とし、それより古いメールを
+        次回以降に取得しないようにする（0 を保存すると次回は UID 1:* で全件を取得してしまう）。
+        """
+        if uids:
+            return max(uids)
+        if watermark is not None:
+            return watermark
+        if uidnext is not None and uidnext > 1:
+            return uidnext - 1
+        return None
+
+    def _search_criteria(self, watermark: Optional[int]) -> str:
+        """ウォーターマークより大きい UID の検索条件。ウォーターマークが無い場合は直近7日分を全件スキャン"""
+        if watermark is None:
+            today = datetime.date.today()
+            since_date = (today - datetime.timedelta(days=7)).strftime("%d-%b-%Y")
+            return f'(SINCE {since_date})'
+        return f'UID {watermark + 1}:*'
+
+    def _search_new_uids(self, mail, criteria: str, watermark: Optional[int]) -> List[int]:
+        _, data = mail.uid('search', None, criteria)
+        # "n:*" は新着が無くても最大 UID を返すため、ウォーターマーク以下を除外する
+        return [int(uid) for uid in data[0].split() if watermark is None or int(uid) > watermark]
+
+    def _unseen_message_key(self, header, processed: Set[str], stats: Dict) -> Optional[str]:
+        """
+        処理済みのメールなら None、未処理ならメッセージキーを返す
+
+        復号と照合の前に呼び、処理済みのメールは読み飛ばす。
+        """
+        message_key = SeenIndex.message_key(header['Message-ID'], header['Date'], header['From'], header['Subject'])
+        if message_key in processed or message_key in self.seen_index:
+            stats["duplicates_skipped"] += 1
+            return None
+        processed.add(message_key)
+        return message_key
+
+    def _iter_messages(self, mail, account: Dict, uids: List[int], matcher: ScopedMatcher, processed: Set[str],
+                       stats: Dict) -> Iterator[Tuple[int, str, Set[str], bool, datetime.datetime, str, str]]:
+        """
+        fetch_mode に応じて未処理のメールを取得し、
+        (uid, メッセージキー, ヘッダで一致したキー, 本文の照合が必要か, 日付, 件名, 本文) を返す
+
+        取得は専用のスレッド、復号はワーカースレッドで並行して行い、取得済みで照合が
+        終わっていないメールの合計が max_inflight_bytes を超えないように取得を止める。
+        ヘッダを対象とするキーは取得用のスレッドで先に照合し、本文を対象とするキーが
+        すべて一致済みのメールは本文を復号しない（partial モードでは取得もしない）。
+        本文を対象とするキーが無い場合は fetch_mode に関わらずヘッダだけを取得する。
+        """
+        batch_size = account.get("fetch_batch_size", 200)
+        budget = ByteBudget(account.get("max_inflight_bytes", 64 * 1024 * 1024))
+
+        if account.get("fetch_mode", "full") == "partial" or not matcher.body_keys:
+            produce = self._produce_partial(mail, account, uids, matcher, batch_size, budget, processed, stats)
+            decode = decode_partial_message
+        else:
+            produce = self._produce_full(mail, uids, matcher, batch_size, budget, processed, stats)
+            decode = decode_message
+
+        executor, workers = self._get_decode_executor(account, len(uids))
+        stats["decode_processes"] = workers if isinstance(executor, ProcessPoolExecutor) else 0
+        for (uid, message_key, hits, need_body), (email_date, subject, body) in run_pipeline(
+                produce, decode, executor, budget, max(workers, 1) * 4, stats):
+            yield uid, message_key, hits, need_body, email_date, subject, body
+        self._merge_header_match_time(stats)
+        stats["peak_inflight_bytes"] = budget.peak
+
+    def _get_decode_executor(self, account: Dict, message_count: int) -> Tuple[Executor, int]:
+        """
+        復号に使うワーカーと並列数を返す（並行して走査するフォルダ間で共有する）
+
+        decode_processes が 1 以上で、対象が process_decode_min_messages 件以上の場合は
+        プロセスプールで復号し、複数のコアを使う。それより少ない場合はプロセスの起動や
+        メールの受け渡しの方が高くつくため、スレッドで復号する。
+        """
+        processes = account.get("decode_processes", 0)
+        with self._decode_pool_lock:
+            if processes > 0 and message_count >= account.get("process_decode_min_messages", 200):
+                if self._process_pool is None:
+                    # 取得用などのスレッドが動いているため fork ではなく spawn で起動する
+                    self._process_pool = ProcessPoolExecutor(
+                        max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+                    logger.info(f"復号用に {processes} 個のプロセスを起動します")
+                return self._process_pool, processes
+
+            workers = max(account.get("decode_workers", 2), 1)
+            if self._decode_pool is None:
+                self._decode_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode")
+            return self._decode_pool, workers
+
+    def _produce_full(self, mail, uids: List[int], matcher: ScopedMatcher, batch_size: int, budget: ByteBudget,
+                      processed: Set[str], stats: Dict) -> Iterator[Tuple[tuple, tuple, int]]:
+        """
+        メール全体を取得する
+
+        先に RFC822.SIZE を取得し、1 回の FETCH の応答が予算の半分を超えないように分割する
+        （残りの半分で前の分の復号・照合と重ねる）。
+        """
+        sizes = fetch_sizes(mail, uids, batch_size, stats)
+        header_parser = email.parser.BytesHeaderParser()
+        for chunk, chunk_bytes in chunk_uids_by_size(uids, sizes, batch_size, budget.limit // 2):
+            budget.acquire(chunk_bytes)
+            unreleased = set(chunk)
+            try:
+                for uid, attrs in fetch_batched(mail, chunk, 'RFC822', batch_size, stats):
+                    unreleased.discard(uid)
+                    raw_email = attrs.get("RFC822")
+                    # MIME 構造を解析する前にヘッダだけで処理済みかを判定し、ヘッダのキーを照合する
+                    header = header_parser.parsebytes(raw_email) if raw_email else None
+                    message_key = self._unseen_message_key(header, processed, stats) if raw_email else None
+                    if message_key is None:
+                        budget.release(sizes.get(uid, 0))
+                        continue
+                    hits, need_body = self._match_headers(matcher, header, stats)
+                    yield (uid, message_key, hits, need_body), (raw_email, need_body), sizes.get(uid, 0)
+            finally:
+                # 取得までの間に削除されたメッセージの分
+                budget.release(sum(sizes.get(uid, 0) for uid in unreleased))
+
+    def _produce_partial(self, mail, account: Dict, uids: List[int], matcher: ScopedMatcher, batch_size: int,
+                         budget: ByteBudget, processed: Set[str], stats: Dict) -> Iterator[Tuple[tuple, tuple, int]]:
+        """
+        ヘッダと BODYSTRUCTURE を先に取得し、本文は text/plain セクションだけを取得する
+
+        BODY.PEEK を使うため \\Seen フラグは変更されない。本文の照合が不要なメールは
+        本文を取得しない（本文を対象とするキーが無い場合は BODYSTRUCTURE も取得しない）。
+        本文は BODYSTRUCTURE のパートのサイズ（無ければ RFC822.SIZE）で見積もり、
+        _produce_full と同じく予算の半分を超えないように分けて、取得の前に予算を確保する。
+        """
+        max_bytes = account.get("body_max_bytes", 0)
+        fields = PARTIAL_HEADER_FIELDS + [name.upper() for name in matcher.header_names
+                                          if name.upper() not in PARTIAL_HEADER_FIELDS]
+        items = f'BODY.PEEK[HEADER.FIELDS ({" ".join(fields)})]'
+        if matcher.body_keys:
+            items = 'BODYSTRUCTURE RFC822.SIZE ' + items
+        for chunk in chunk_uids(sorted(uids), batch_size):
+            headers = {}
+            metas = {}
+            sections = {}
+            text_parts = {}
+            sizes = {}
+            for uid, attrs in fetch_batched(mail, chunk, items, batch_size, stats):
+                header = get_header_fields(attrs)
+                parsed = email.message_from_bytes(header)
+                message_key = self._unseen_message_key(parsed, processed, stats)
+                if message_key is None:
+                    # 処理済みのメールは本文を取得しない
+                    continue
+                headers[uid] = header
+                sizes[uid] = len(header)
+                hits, need_body = self._match_headers(matcher, parsed, stats)
+                metas[uid] = (message_key, hits, need_body)
+                if not need_body:
+                    continue
+                structure = attrs.get("BODYSTRUCTURE")
+                text_part = find_text_part(structure)
+                if text_part:
+                    sections[uid] = text_part[0]
+                    text_parts[uid] = text_part
+                    body_size = part_size(structure, text_part[0])
+                    if body_size is None:
+                        body_size = int(attrs.get("RFC822.SIZE") or 0)
+                    sizes[uid] += min(body_size, max_bytes) if max_bytes and max_bytes > 0 else body_size
+
+            for part, part_bytes in chunk_uids_by_size(list(headers), sizes, batch_size, budget.limit // 2):
+                budget.acquire(part_bytes)
+                unreleased = list(part)
+                try:
+                    bodies = fetch_sections(mail, {uid: sections[uid] for uid in part if uid in sections},
+                                            max_bytes, batch_size, stats)
+                    while unreleased:
+                        uid = unreleased.pop(0)
+                        _, encoding, charset = text_parts.get(uid, (None, None, None))
+                        yield (uid,) + metas[uid], (headers[uid], bodies.get(uid), encoding, charset), sizes[uid]
+                finally:
+                    # 中断された場合にまだ渡していない分
+                    budget.release(sum(sizes[uid] for uid in unreleased))
+
+    def check_missing_emails(self) -> Dict:
+        """期限を過ぎても届いていないキーを返す（期限切れのキーだけを期限の索引から取り出す）"""
+        missing = {}
+        now = datetime.datetime.now()
+        keys = self.config_manager.keys
+
+        for key in self.config_manager.deadlines.overdue(now.timestamp()):
+            data = keys[key]
+            if not data["last_received"]:
+                missing[key] = "未受信"
+                continue
+            last_received = parse_received(data["last_received"])
+            missing[key] = f"{(now - last_received).days}日間未受信"
+
+        return missing
+
+    def _seconds_until_next_deadline(self, limit: float) -> float:
+        """次の期限までの秒数（limit 秒より先なら limit）"""
+        now = time.time()
+        deadline = self.config_manager.deadlines.next_deadline(now)
+        if deadline is None:
+            return limit
+        return min(limit, max(deadline - now, 0) + 0.01)
+
+    def _report_missing(self, log_unchanged: bool = True) -> Dict:
+        """
+        未着を報告し、このサイクルの未着と検出をまとめて通知する（送信は待たない）
+
+        log_unchanged が False の場合、未着のキーが前回と同じならログに出し直さない。
+        """
+        missing = self.check_missing_emails()
+        if missing and (log_unchanged or set(missing) != self._logged_missing):
+            logger.warning(f"未着メール検出: {missing}")
+        self._logged_missing = set(missing)
+        self.notifier.missing(missing)
+        self.notifier.flush()
+        return missing
+
+    def _plan_next_polls(self, checked: List[str]) -> float:
+        """チェックしたフォルダの次のチェック時刻を決め、次のチェックまでの秒数を返す（poll_mode が "adaptive"）"""
+        scheduler = self.poll_scheduler
+        folders = self.last_cycle_stats.get("folders", {})
+        now = time.time()
+        scheduler.refresh(self.config_manager.keys)
+        for folder_id in checked:
+            stats = folders.get(folder_id)
+            delay, reason = scheduler.record(folder_id, stats.get("new_messages", 0) if stats else None, now)
+            logger.debug(f"{folder_id}: 次のチェックは {delay:.0f}秒後 ({reason})")
+        return scheduler.seconds_until_next(self.folder_ids(), now)
+
+    def run_scheduled_check(self):
+        """
+        定期チェック
+
+        poll_mode が "adaptive" の場合はフォルダごとに PollScheduler が決めた時刻に、
+        時刻になったフォルダだけをチェックする。それ以外は check_interval ごとにすべてをチェックする。
+        """
+        logger.info("定期チェックを開始")
+        config = self.config_manager.config
+
+        try:
+            while True:
+                self.reload()
+                adaptive = config.get("poll_mode", "fixed") == "adaptive"
+                due = None
+                if adaptive:
+                    due = self.poll_scheduler.due(self.folder_ids(), time.time())
+                    logger.info(f"{len(due)} 個のフォルダの時刻になりました")
+                self.last_cycle_stats = {}
+                # 受信期限のために起きただけで、時刻になったフォルダが無ければチェックしない。
+                # 失敗したフォルダは check_emails がログに出し、次のチェックで再試行する
+                if due is None or due:
+                    self.check_emails(due)
+                self._report_missing()
+
+                # 次の受信期限が先に来る場合は、その時刻に起きて受信を確認してから未着を報告する
+                limit = self._plan_next_polls(sorted(due)) if adaptive else config["check_interval"]
+                wait = self._seconds_until_next_deadline(limit)
+                logger.info(f"{wait:.0f}秒後に再チェックします")
+                self._wait(wait)
+
+        except KeyboardInterrupt:
+            self.close()
+            logger.info("ユーザーによって定期チェックが停止されました")
+        except Exception as e:
+            logger.error(f"定期チェック中にエラー: {e}")
+            raise
+
+    def run_idle_daemon(self):
+        """
+        IDLE (RFC 2177) で新着を待ち受ける常駐モード
+
+        接続を張ったまま EXISTS 通知を受けたら新着分だけを処理する。サーバーの
+        タイムアウト（29分）より前に idle_timeout 秒で IDLE を出し直し、
+        サーバーが IDLE に対応していない場合は run_scheduled_check に切り替える。
+        accounts を設定している場合、IDLE の対象は最初のアカウントの最初のフォルダ。
+        設定とキーの変更を取り込むため、reload_interval 秒ごとにも IDLE を出し直す。
+        """
+        logger.info("IDLE モードで監視を開始")
+
+        try:
+            while True:
+                config = self.config_manager.config
+                account = self.config_manager.get_accounts()[0]
+                folder = account["folders"][0]
+                folder_id = UidState.folder_id(account, folder)
+                # IDLE の間はプールのセッションを 1 つ借りたままにする
+                pool = self.session_pool(account)
+                connection = pool.checkout(folder)
+                try:
+                    mail = connection.get()
+                    if "IDLE" not in mail.capabilities:
+                        break
+
+                    self._check_folder(mail, account, folder)
+                    self._report_missing()
+                    while True:
+                        timeout = config.get("idle_timeout", 1500)
+                        if config.get("reload_interval", 60) > 0:
+                            timeout = min(timeout, config.get("reload_interval", 60))
+                        woke = idle_wait(mail, self._seconds_until_next_deadline(timeout))
+                        # 他のプロセスが追加したキーで新着を照合できるよう、チェックの前に取り込む
+                        if self.reload()[0]:
+                            target = self.config_manager.get_accounts()[0]
+                            if (self._pools.get(pool_key(target)) is not pool
+                                    or UidState.folder_id(target, target["folders"][0]) != folder_id):
+                                # 監視するフォルダか接続先が変わった（新着は次の接続の最初のチェックで拾う）
+                                break
+                            # 取得の設定などは新しい値を使う
+                            account = target
+                        if woke:
+                            logger.info("新着メールの通知を受信しました")
+                            self._check_folder(mail, account, folder)
+                        # 期限を過ぎた未着の通知のため毎回判定する（ログは未着が変わったときだけ）
+                        self._report_missing(log_unchanged=False)
+                except (imaplib.IMAP4.abort, OSError) as e:
+                    # 再接続は connection.get() がバックオフ付きで行う
+                    logger.warning(f"IMAP 接続が切断されました。再接続します: {e}")
+                    connection.invalidate()
+                finally:
+                    pool.checkin(folder)
+
+            logger.warning("サーバーが IDLE に対応していないため定期チェックに切り替えます")
+            self.run_scheduled_check()
+        except KeyboardInterrupt:
+            self.close()
+            logger.info("ユーザーによって IDLE 監視が停止されました")
+        except Exception as e:
+            logger.error(f"IDLE 監視中にエラー: {e}")
+            raise
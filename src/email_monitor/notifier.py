@@ -0,0 +1,291 @@
+"""
+未着・検出の通知
+
+チェックのループは Notifier.missing() / detected() で通知を溜め、サイクルの最後に
+flush() で 1 つのバッチにまとめて送信先ごとのキューに入れるだけで、送信は待たない。
+送信は送信先ごとのバックグラウンドスレッドで行うため、遅い SMTP サーバーや webhook が
+チェックの間隔に影響しない。
+"""
+import datetime
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("Notifier")
+
+MISSING = "missing"
+DETECTED = "detected"
+
+
+def _empty_batch() -> Dict:
+    return {MISSING: {}, DETECTED: []}
+
+
+def merge_batches(batches: List[Dict]) -> Dict:
+    """送信待ちのバッチを 1 つにまとめる（未着は新しい内容で上書き、検出は連結）"""
+    merged = _empty_batch()
+    for batch in batches:
+        merged[MISSING].update(batch[MISSING])
+        merged[DETECTED].extend(batch[DETECTED])
+    return merged
+
+
+def format_text(batch: Dict) -> str:
+    lines = []
+    if batch[MISSING]:
+        lines.append(f"未着のキー {len(batch[MISSING])} 件:")
+        lines.extend(f"  {key}: {status}" for key, status in batch[MISSING].items())
+    if batch[DETECTED]:
+        lines.append(f"検出したメール {len(batch[DETECTED])} 件:")
+        lines.extend(f"  {entry['key']}: {entry['subject']} ({entry['date']})" for entry in batch[DETECTED])
+    return "\n".join(lines)
+
+
+class SmtpSink:
+    """メールで通知する（host, port, ssl, starttls, username, password, from, to）"""
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.name = f"smtp:{config.get('host', 'localhost')}"
+
+    def send(self, batch: Dict) -> None:
+        # 通知を使うときだけ読み込む
+        import smtplib
+        from email.message import EmailMessage
+
+        config = self.config
+        message = EmailMessage()
+        message["Subject"] = (f"[mailchecker] 未着 {len(batch[MISSING])} 件 / "
+                              f"検出 {len(batch[DETECTED])} 件")
+        message["From"] = config.get("from", "mailchecker@localhost")
+        recipients = config["to"] if isinstance(config["to"], list) else [config["to"]]
+        message["To"] = ", ".join(recipients)
+        message.set_content(format_text(batch))
+
+        host, timeout = config.get("host", "localhost"), config.get("timeout", 30)
+        if config.get("ssl", False):
+            smtp = smtplib.SMTP_SSL(host, config.get("port", 465), timeout=timeout)
+        else:
+            smtp = smtplib.SMTP(host, config.get("port", 25), timeout=timeout)
+        with smtp:
+            if config.get("starttls", False):
+                smtp.starttls()
+            if config.get("username"):
+                smtp.login(config["username"], config["password"])
+            smtp.send_message(message, to_addrs=recipients)
+
+
+class WebhookSink:
+    """JSON を POST する（url, headers, timeout）。2xx 以外の応答は失敗として再送する"""
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.name = f"webhook:{config['url']}"
+
+    def send(self, batch: Dict) -> None:
+        import urllib.request
+
+        payload = {
+            "host": socket.gethostname(),
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "missing": batch[MISSING],
+            "detected": batch[DETECTED],
+            "text": format_text(batch),
+        }
+        headers = {"Content-Type": "application/json"}
+        headers.update(self.config.get("headers") or {})
+        request = urllib.request.Request(self.config["url"], json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                                         headers, method="POST")
+        # 2xx 以外は HTTPError が送出される
+        with urllib.request.urlopen(request, timeout=self.config.get("timeout", 30)) as response:
+            response.read()
+
+
+SINKS = {"smtp": SmtpSink, "webhook": WebhookSink}
+
+
+class SinkWorker(threading.Thread):
+    """
+    1 つの送信先にバッチを送るスレッド
+
+    送信待ちが複数あればまとめて 1 回で送る。送信は rate_per_minute 回/分まで
+    （トークンバケット。0 か null は無制限）で、失敗したら retry_base 秒から倍々に retry_max 秒まで
+    間隔を空けて retries 回まで再送する。キューが満杯のときは古いバッチに統合する。
+    """
+
+    def __init__(self, sink, config: Dict):
+        super().__init__(daemon=True, name=f"notify-{sink.name}")
+        self.sink = sink
+        # 0 や null（None）は無制限
+        self.rate = max(config.get("rate_per_minute", 10) or 0, 0)
+        self.retries = config.get("retries", 5)
+        self.retry_base = config.get("retry_base", 2.0)
+        self.retry_max = config.get("retry_max", 300.0)
+        self.events = set(config.get("events") or (MISSING, DETECTED))
+        self.queue: "queue.Queue[Optional[Dict]]" = queue.Queue(config.get("queue_size", 100))
+        self.tokens = float(self.rate)
+        self.refilled = time.monotonic()
+        self.sent = 0
+        self.failed = 0
+
+    def submit(self, batch: Dict) -> None:
+        """バッチを送信待ちに入れる（待たない）"""
+        batch = {MISSING: batch[MISSING] if MISSING in self.events else {},
+                 DETECTED: batch[DETECTED] if DETECTED in self.events else []}
+        if not batch[MISSING] and not batch[DETECTED]:
+            return
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            # 取り出した古いバッチと統合して入れ直す（送信中のスレッドと競合しても失うのは古い方だけ）
+            try:
+                batch = merge_batches([self.queue.get_nowait(), batch])
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(batch)
+            except queue.Full:
+                logger.warning(f"{self.sink.name}: 送信待ちが一杯のため通知を破棄しました")
+
+    def _drain(self, first: Dict) -> Dict:
+        """first に続けて送信待ちのバッチをすべて取り出して統合する（終了の指示はキューに戻す）"""
+        batches = [first]
+        stop = False
+        while True:
+            try:
+                batch = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                stop = True
+                break
+            batches.append(batch)
+        merged = merge_batches(batches)
+        if stop:
+            self.queue.put(None)
+        return merged
+
+    def _acquire_token(self) -> None:
+        if not self.rate:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.refilled) * self.rate / 60)
+            self.refilled = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) * 60 / self.rate)
+
+    def run(self) -> None:
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            self._acquire_token()
+            # トークンを待つ間に溜まった分もまとめて送る
+            batch = self._drain(batch)
+            self._send(batch)
+
+    def _send(self, batch: Dict) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                started = time.perf_counter()
+                self.sink.send(batch)
+                self.sent += 1
+                logger.info(f"{self.sink.name}: 通知を送信しました (未着 {len(batch[MISSING])} 件, "
+                            f"検出 {len(batch[DETECTED])} 件, {time.perf_counter() - started:.2f}秒)")
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    break
+                delay = min(self.retry_base * 2 ** attempt, self.retry_max)
+                logger.warning(f"{self.sink.name}: 通知の送信に失敗しました。{delay:.0f}秒後に再送します: {e!r}")
+                time.sleep(delay)
+        self.failed += 1
+        logger.error(f"{self.sink.name}: {self.retries} 回再送しても通知を送信できませんでした")
+
+    def close(self, timeout: Optional[float]) -> None:
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            # 送信が止まったまま終了する（デーモンスレッドのため終了を妨げない）
+            return
+        self.join(timeout)
+
+
+class Notifier:
+    """
+    通知の受け付け（チェックのループのスレッドから呼ぶ）
+
+    同じキーの未着は、そのキーが届くまで notify_repeat_hours 時間（既定 24、0 は再通知しない）
+    ごとに 1 回だけ通知する。notifications が空なら何もしない。
+    """
+
+    def __init__(self, config: Dict):
+        self.repeat = config.get("notify_repeat_hours", 24) * 3600
+        self.workers: List[SinkWorker] = []
+        for sink_config in config.get("notifications") or []:
+            sink_type = sink_config.get("type")
+            if sink_type not in SINKS:
+                raise ValueError(f"不明な通知先です: {sink_type}")
+            self.workers.append(SinkWorker(SINKS[sink_type](sink_config), sink_config))
+        self.enabled = bool(self.workers)
+        self._pending = _empty_batch()
+        self._alerted: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def missing(self, missing: Dict[str, str], now: Optional[float] = None) -> None:
+        """未着のキーの一覧（check_missing_emails の結果）を受け取る"""
+        if not self.enabled:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            for key, status in missing.items():
+                alerted = self._alerted.get(key)
+                if alerted is None or (self.repeat > 0 and now - alerted >= self.repeat):
+                    self._pending[MISSING][key] = status
+                    self._alerted[key] = now
+            # 届いたキーは、次に期限を過ぎたときに改めて通知する
+            for key in [key for key in self._alerted if key not in missing]:
+                del self._alerted[key]
+
+    def detected(self, key: str, date: str, subject: str) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._pending[DETECTED].append({"key": key, "date": date, "subject": subject})
+
+    def flush(self) -> None:
+        """溜めた通知を 1 つのバッチとして各送信先のキューに入れる（送信は待たない）"""
+        if not self.enabled:
+            return
+        with self._lock:
+            batch, self._pending = self._pending, _empty_batch()
+        if not batch[MISSING] and not batch[DETECTED]:
+            return
+        if not self._started:
+            for worker in self.workers:
+                worker.start()
+            self._started = True
+        for worker in self.workers:
+            worker.submit(batch)
+
+    def close_in_background(self, timeout: Optional[float] = 30) -> threading.Thread:
+        """close を別のスレッドで行い、そのスレッドを返す（送信先が遅くても呼び出し側は待たない）"""
+        thread = threading.Thread(target=self.close, args=(timeout,), daemon=True, name="notify-close")
+        thread.start()
+        return thread
+
+    def close(self, timeout: Optional[float] = 30) -> None:
+        """溜めた通知を送り、送信が終わるまで最大 timeout 秒待つ"""
+        self.flush()
+        if self._started:
+            deadline = time.monotonic() + (timeout or 0)
+            for worker in self.workers:
+                worker.close(max(deadline - time.monotonic(), 0) if timeout is not None else None)
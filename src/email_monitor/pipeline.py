@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import Executor
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger("Pipeline")
+
+
+class PipelineStopped(Exception):
+    """パイプラインが中断されたときに取得側のスレッドで送出される"""
+
+
+class ByteBudget:
+    """
+    処理中（取得済みで照合が終わっていない）のバイト数の上限
+
+    acquire() は上限を超える間ブロックする。上限より大きい 1 通は、
+    他に処理中のものが無ければ通す。
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.peak = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self, size: int) -> None:
+        with self._cond:
+            while not self._closed and self.in_flight > 0 and self.in_flight + size > self.limit:
+                self._cond.wait()
+            if self._closed:
+                raise PipelineStopped()
+            self.in_flight += size
+            self.peak = max(self.peak, self.in_flight)
+
+    def release(self, size: int) -> None:
+        with self._cond:
+            self.in_flight -= size
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _timed(decode: Callable, *args) -> Tuple[float, object]:
+    """復号ワーカー（スレッドまたはプロセス）で decode を実行し、(処理時間, 戻り値) を返す"""
+    started = time.perf_counter()
+    result = decode(*args)
+    return time.perf_counter() - started, result
+
+
+def run_pipeline(produce: Iterable[Tuple[object, tuple, int]], decode: Callable, executor: Executor,
+                 budget: ByteBudget, max_pending: int,
+                 stats: Optional[Dict] = None) -> Iterator[Tuple[object, object]]:
+    """
+    取得 → 復号 → 照合 のパイプライン
+
+    produce は取得用のスレッドで反復され、(メタ情報, decode の引数, バイト数) を返す。
+    バイト数は produce 側で budget.acquire() 済みのもので、呼び出し側が yield された
+    結果の処理を終えた時点で解放する。復号は executor で並行して行い、結果は取得順に
+    (メタ情報, decode の戻り値) として返す。段の間のキューはどちらも max_pending 件まで。
+    stats を渡した場合は復号ワーカーでの処理時間の合計を stats["decode_seconds"] に加える。
+    """
+    fetched: "queue.Queue" = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+
+    def put(entry) -> None:
+        while not stop.is_set():
+            try:
+                fetched.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise PipelineStopped()
+
+    def fetch_stage() -> None:
+        try:
+            for entry in produce:
+                put(entry)
+            put(_DONE)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            try:
+                put(_Failure(e))
+            except PipelineStopped:
+                pass
+
+    fetcher = threading.Thread(target=fetch_stage, name="pipeline-fetch", daemon=True)
+    fetcher.start()
+
+    pending = deque()
+    finished = False
+    try:
+        while True:
+            # 復号待ちが上限に達するまで取得済みのものを投入する。復号待ちがある間は
+            # 取得を待たない（照合して予算を解放しないと取得側が進めないため）
+            while not finished and len(pending) < max_pending:
+                try:
+                    entry = fetched.get() if not pending else fetched.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _DONE:
+                    finished = True
+                elif isinstance(entry, _Failure):
+                    raise entry.error
+                else:
+                    meta, args, size = entry
+                    pending.append((meta, size, executor.submit(_timed, decode, *args)))
+            if not pending:
+                if finished:
+                    return
+                continue
+            meta, size, future = pending.popleft()
+            try:
+                elapsed, result = future.result()
+                if stats is not None:
+                    stats["decode_seconds"] = stats.get("decode_seconds", 0.0) + elapsed
+                yield meta, result
+            finally:
+                budget.release(size)
+    finally:
+        stop.set()
+        budget.close()
+        for _, _, future in pending:
+            future.cancel()
+        fetcher.join()
@@ -0,0 +1,150 @@
+import bisect
+import datetime
+import logging
+import random
+from typing import Dict, List, Optional, Set, Tuple
+
+from .schedule import Schedule, parse_received, parse_schedule
+
+logger = logging.getLogger("PollScheduler")
+
+# next_delay() が返す理由
+WINDOW = "到着予定"
+WINDOW_START = "到着予定の開始"
+BASE = "基本"
+QUIET = "静穏"
+
+
+class PollScheduler:
+    """
+    フォルダごとの次のチェック時刻を決める（poll_mode が "adaptive" の場合）
+
+    基本の間隔はキーの予想頻度のうち最も短い周期を poll_per_period で割ったもの
+    （poll_min_interval 〜 poll_max_interval に収める）。いずれかのキーの到着予定
+    （Schedule.expected）の前後 poll_window 秒は poll_min_interval でチェックし、
+    それ以外で新着の無いチェックが続いたフォルダは間隔を 2 倍ずつ poll_max_interval まで延ばす。
+    新着があれば基本の間隔に戻す。多数のデーモンのチェックが揃わないよう、
+    間隔には ±poll_jitter の割合のゆらぎを加える。
+    """
+
+    def __init__(self, config: Dict, rng: Optional[random.Random] = None):
+        self.min_interval = config.get("poll_min_interval", 120)
+        self.max_interval = config.get("poll_max_interval", 6 * 3600)
+        self.window = config.get("poll_window", 900)
+        self.per_period = config.get("poll_per_period", 24)
+        self.jitter = config.get("poll_jitter", 0.1)
+        self.default_interval = config["check_interval"]
+        self.rng = rng or random.Random()
+        # フォルダ ID -> 新着の無かった連続チェック数 / 次のチェック時刻
+        self.quiet: Dict[str, int] = {}
+        self.next_poll: Dict[str, float] = {}
+        self.base_interval = self.default_interval
+        self._arrivals: List[float] = []
+        self._schedules: Dict[Optional[str], Optional[Schedule]] = {}
+
+    def refresh(self, keys: Dict) -> None:
+        """キーの受信記録から到着予定と基本の間隔を計算し直す（チェックのたびに呼ぶ）"""
+        arrivals = []
+        shortest = None
+        for data in keys.values():
+            spec = data.get("expected_frequency")
+            if spec not in self._schedules:
+                self._schedules[spec] = parse_schedule(spec)
+            schedule = self._schedules[spec]
+            if schedule is None or not data.get("last_received"):
+                continue
+            last_received = parse_received(data["last_received"])
+            expected = schedule.expected(last_received)
+            if expected is None:
+                continue
+            arrivals.append(expected.timestamp())
+            period = (expected - last_received).total_seconds()
+            shortest = period if shortest is None else min(shortest, period)
+        arrivals.sort()
+        self._arrivals = arrivals
+        base = shortest / self.per_period if shortest else self.default_interval
+        self.base_interval = min(max(base, self.min_interval), self.max_interval)
+
+    def next_delay(self, folder_id: str, now: float) -> Tuple[float, str]:
+        """次のチェックまでの秒数（ゆらぎを加える前）と理由"""
+        arrivals = self._arrivals
+        # now の前後 window 秒に到着予定があれば詰めてチェックする
+        index = bisect.bisect_left(arrivals, now - self.window)
+        if index < len(arrivals) and arrivals[index] <= now + self.window:
+            return self.min_interval, WINDOW
+
+        quiet = min(self.quiet.get(folder_id, 0), 32)
+        delay = self.base_interval * 2 ** quiet
+        reason = f"{QUIET} ×{2 ** quiet}" if quiet else BASE
+        if delay >= self.max_interval:
+            delay, reason = self.max_interval, f"{QUIET} (上限)"
+        # 次の到着予定の前後 window 秒の区間に入るときには起きる
+        if index < len(arrivals) and arrivals[index] - self.window < now + delay:
+            return max(arrivals[index] - self.window - now, self.min_interval), WINDOW_START
+        return delay, reason
+
+    def _jittered(self, delay: float, reason: str) -> float:
+        if reason == WINDOW_START:
+            # 区間の開始より前に起きると、開始までの短い待ちを繰り返すため遅らせる方向にだけずらす
+            return delay + self.rng.uniform(0, self.jitter * self.min_interval)
+        return max(delay * (1 + self.rng.uniform(-self.jitter, self.jitter)), 1.0)
+
+    def record(self, folder_id: str, new_messages: Optional[int], now: float) -> Tuple[float, str]:
+        """
+        チェックの結果から次のチェック時刻を決め、(間隔, 理由) を返す
+
+        new_messages が None（チェックに失敗）の場合は静穏の回数を変えない。
+        到着予定の区間でのチェックは静穏の回数に数えない。
+        """
+        if new_messages:
+            self.quiet[folder_id] = 0
+        elif new_messages is not None and self.next_delay(folder_id, now)[1] != WINDOW:
+            self.quiet[folder_id] = self.quiet.get(folder_id, 0) + 1
+        delay, reason = self.next_delay(folder_id, now)
+        delay = self._jittered(delay, reason)
+        self.next_poll[folder_id] = now + delay
+        return delay, reason
+
+    def due(self, folder_ids: List[str], now: float) -> Set[str]:
+        """チェックの時刻になったフォルダ（まだチェックしていないフォルダを含む）"""
+        return {folder_id for folder_id in folder_ids if self.next_poll.get(folder_id, now) <= now}
+
+    def seconds_until_next(self, folder_ids: List[str], now: float) -> float:
+        polls = [self.next_poll.get(folder_id, now) for folder_id in folder_ids]
+        return max(min(polls, default=now + self.default_interval) - now, 0.0)
+
+    def plan(self, folder_ids: List[str], start: float, hours: float) -> List[Tuple[float, str, float, str]]:
+        """
+        新着が無いものとして start から hours 時間のチェック予定を返す（dry-run 用）
+
+        (時刻, フォルダ ID, 次までの間隔, 理由) の時刻順のリスト。状態は変更しない。
+        """
+        quiet, next_poll = self.quiet, self.next_poll
+        self.quiet, self.next_poll = dict(quiet), dict(next_poll)
+        try:
+            end = start + hours * 3600
+            timeline = []
+            for folder_id in folder_ids:
+                at = max(self.next_poll.get(folder_id, start), start)
+                while at < end:
+                    delay, reason = self.record(folder_id, 0, at)
+                    timeline.append((at, folder_id, delay, reason))
+                    at += delay
+            timeline.sort()
+            return timeline
+        finally:
+            self.quiet, self.next_poll = quiet, next_poll
+
+
+def format_plan(timeline: List[Tuple[float, str, float, str]], fixed_interval: float, hours: float) -> List[str]:
+    """plan() の結果を表示用の行にする（末尾に固定間隔の場合との回数の比較）"""
+    lines = []
+    counts: Dict[str, int] = {}
+    for at, folder_id, delay, reason in timeline:
+        counts[folder_id] = counts.get(folder_id, 0) + 1
+        lines.append(f"{datetime.datetime.fromtimestamp(at):%m-%d %H:%M:%S}  {folder_id}  "
+                     f"次まで {delay:.0f}秒  ({reason})")
+    fixed = int(hours * 3600 // fixed_interval) + 1
+    for folder_id, count in counts.items():
+        lines.append(f"{folder_id}: {hours:g} 時間で {count} 回 (固定間隔 {fixed_interval:g}秒なら {fixed} 回)")
+    return lines
@@ -0,0 +1,223 @@
+import datetime
+import heapq
+import logging
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger("Schedule")
+
+
+class Schedule:
+    """
+    受信の予定。deadline() は最後の受信からこの時刻までに次が届くはずという期限を、
+    expected() は次の受信が見込まれる時刻を返す（適応的なポーリングで使う）
+    """
+
+    def deadline(self, last_received: datetime.datetime) -> Optional[datetime.datetime]:
+        raise NotImplementedError
+
+    def expected(self, last_received: datetime.datetime) -> Optional[datetime.datetime]:
+        """期限の日の、最後に受信したのと同じ時刻"""
+        deadline = self.deadline(last_received)
+        if deadline is None:
+            return None
+        return datetime.datetime.combine(deadline.date() - datetime.timedelta(days=1), last_received.time())
+
+
+class IntervalSchedule(Schedule):
+    """一定間隔（daily / weekly / monthly / every:6h など）。期限は間隔に grace を加えた時刻"""
+
+    def __init__(self, interval: datetime.timedelta, grace: datetime.timedelta = datetime.timedelta()):
+        self.interval = interval
+        self.grace = grace
+
+    def deadline(self, last_received: datetime.datetime) -> datetime.datetime:
+        return last_received + self.interval + self.grace
+
+    def expected(self, last_received: datetime.datetime) -> datetime.datetime:
+        return last_received + self.interval
+
+
+class WeekdaySchedule(Schedule):
+    """平日（月〜金）に届く。最後の受信日の次の平日が終わるまでが期限"""
+
+    def deadline(self, last_received: datetime.datetime) -> datetime.datetime:
+        day = last_received.date() + datetime.timedelta(days=1)
+        while day.weekday() >= 5:
+            day += datetime.timedelta(days=1)
+        return datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time())
+
+
+class DayOfMonthSchedule(Schedule):
+    """
+    毎月の決まった日に届く（cron の日フィールドと同じ書式: 1,15 / 1-5 / */10 / 5/10 / L は月末）
+
+    最後の受信日より後の、次に該当する日が終わるまでが期限。
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self.days: Set[int] = set()
+        self.last_day = False
+        for part in field.split(","):
+            part = part.strip()
+            if part.upper() == "L":
+                self.last_day = True
+                continue
+            spec, _, step = part.partition("/")
+            if spec == "*":
+                start, end = 1, 31
+            elif "-" in spec:
+                start, end = (int(value) for value in spec.split("-", 1))
+            else:
+                # cron と同じく 5/10 は 5 日から月末まで 10 日ごと
+                start = int(spec)
+                end = 31 if step else start
+            if not 1 <= start <= end <= 31:
+                raise ValueError(f"日の指定が不正です: {part}")
+            self.days.update(range(start, end + 1, int(step) if step else 1))
+
+    def _matches(self, day: datetime.date) -> bool:
+        # 翌日が 1 日なら月末（calendar は起動が遅くなるため使わない）
+        last_day = (day + datetime.timedelta(days=1)).day == 1
+        return day.day in self.days or (self.last_day and last_day)
+
+    def deadline(self, last_received: datetime.datetime) -> Optional[datetime.datetime]:
+        day = last_received.date() + datetime.timedelta(days=1)
+        # 31 日などは該当しない月もあるため、最大 1 年先まで探す
+        for _ in range(366):
+            if self._matches(day):
+                return datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time())
+            day += datetime.timedelta(days=1)
+        return None
+
+
+_UNITS = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+_EVERY = re.compile(r'^every:(\d+)([mhdw])$')
+
+_NAMED = {
+    "daily": datetime.timedelta(days=1),
+    "weekly": datetime.timedelta(days=7),
+    "monthly": datetime.timedelta(days=30),
+}
+# 従来の「N 日を超えて未受信なら未着」と同じ期限（N+1 日）になるよう 1 日の猶予を加える
+_NAMED_GRACE = datetime.timedelta(days=1)
+
+
+def parse_schedule(spec: Optional[str]) -> Optional[Schedule]:
+    """
+    expected_frequency を解釈する。未知の書式は None（未着の判定をしない）
+
+    daily / weekly / monthly, every:<N>[m|h|d|w], weekdays, dom:<日の指定>
+    """
+    spec = (spec or "").strip().lower()
+    if spec in _NAMED:
+        return IntervalSchedule(_NAMED[spec], _NAMED_GRACE)
+    if spec == "weekdays":
+        return WeekdaySchedule()
+    match = _EVERY.match(spec)
+    if match:
+        return IntervalSchedule(datetime.timedelta(**{_UNITS[match.group(2)]: int(match.group(1))}))
+    if spec.startswith("dom:"):
+        try:
+            return DayOfMonthSchedule(spec[4:])
+        except ValueError as e:
+            logger.warning(f"予想頻度 '{spec}' を解釈できません: {e}")
+            return None
+    logger.warning(f"予想頻度 '{spec}' を解釈できません")
+    return None
+
+
+def parse_received(value: str) -> datetime.datetime:
+    """last_received の ISO 文字列をローカル時刻（タイムゾーン無し）にする"""
+    received = datetime.datetime.fromisoformat(value)
+    if received.tzinfo is not None:
+        received = received.astimezone().replace(tzinfo=None)
+    return received
+
+
+class DeadlineIndex:
+    """
+    キーごとの次の期限を優先度付きキュー（ヒープ）で管理する
+
+    受信を記録するたびに update() でそのキーの期限だけを入れ直す。古い項目は
+    ヒープに残したまま、取り出すときに現在の期限と照合して読み捨てる。
+    一度も受信していないキーは最初から期限切れとして扱う。
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}
+        # キー -> (expected_frequency, 解釈した Schedule)
+        self._schedules: Dict[str, Tuple[Optional[str], Optional[Schedule]]] = {}
+
+    def rebuild(self, keys: Dict) -> None:
+        self._heap = []
+        self._deadlines = {}
+        for key, data in keys.items():
+            self.update(key, data)
+
+    def update(self, key: str, data: Dict) -> None:
+        spec = data.get("expected_frequency")
+        if key not in self._schedules or self._schedules[key][0] != spec:
+            self._schedules[key] = (spec, parse_schedule(spec))
+        schedule = self._schedules[key][1]
+
+        if not data.get("last_received"):
+            due: Optional[float] = float("-inf")
+        elif schedule is None:
+            due = None
+        else:
+            deadline = schedule.deadline(parse_received(data["last_received"]))
+            due = deadline.timestamp() if deadline else None
+
+        if due is None:
+            self._deadlines.pop(key, None)
+            return
+        if self._deadlines.get(key) == due:
+            return
+        self._deadlines[key] = due
+        heapq.heappush(self._heap, (due, key))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            # 読み捨て待ちの古い項目が増えすぎたら作り直す
+            self._heap = [(due, key) for key, due in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def remove(self, key: str) -> None:
+        self._deadlines.pop(key, None)
+        self._schedules.pop(key, None)
+
+    def _valid(self, entry: Tuple[float, str]) -> bool:
+        due, key = entry
+        return self._deadlines.get(key) == due
+
+    def overdue(self, now: float) -> List[str]:
+        """期限を過ぎたキーを期限の早い順に返す"""
+        popped = []
+        result = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            if self._valid(entry):
+                result.append(entry[1])
+                popped.append(entry)
+        for entry in popped:
+            heapq.heappush(heap, entry)
+        return result
+
+    def next_deadline(self, now: float) -> Optional[float]:
+        """now より後で最初に来る期限（無ければ None）"""
+        popped = []
+        found = None
+        heap = self._heap
+        while heap:
+            entry = heapq.heappop(heap)
+            if not self._valid(entry):
+                continue
+            popped.append(entry)
+            if entry[0] > now:
+                found = entry[0]
+                break
+        for entry in popped:
+            heapq.heappush(heap, entry)
+        return found
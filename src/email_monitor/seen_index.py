@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("SeenIndex")
+
+
+class SeenIndex:
+    """
+    処理済みメールの索引（メッセージキー → 初めて処理した時刻）
+
+    検索範囲が前回と重なった場合や、同じメールが複数のフォルダにある場合に
+    復号・照合と履歴への追加を 1 回だけにするために使う。max_entries 件を超えた分と
+    max_age_days 日より前に処理した分は古い順に削除する。
+
+    ファイルは 1 行に [メッセージキー, 時刻] を書いた JSON Lines で、保存時は追加分だけを
+    追記する。削除した分の行が残っている行の COMPACT_RATIO 倍を超えたら書き直す。
+    """
+
+    COMPACT_RATIO = 2
+    COMPACT_MIN_RECORDS = 1000
+
+    def __init__(self, path: str = "seen.json", max_entries: int = 100000, max_age_days: float = 30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        # ファイルの行数（削除した分も含む）と、書き直しが必要か（以前の形式など）
+        self.records = 0
+        self._rewrite_needed = False
+        self.entries: "OrderedDict[str, float]" = self._load()
+        self._pending: List[Tuple[str, float]] = []
+        self._evict(time.time())
+
+    @staticmethod
+    def message_key(message_id: Optional[str], date: Optional[str], sender: Optional[str],
+                    subject: Optional[str]) -> str:
+        """Message-ID が無い場合は Date / From / Subject のハッシュを使う"""
+        if message_id and message_id.strip():
+            return message_id.strip()
+        digest = hashlib.sha1("\0".join(str(value or "") for value in (date, sender, subject)).encode('utf-8'))
+        return "sha1:" + digest.hexdigest()
+
+    def _load(self) -> "OrderedDict[str, float]":
+        if not os.path.exists(self.path):
+            return OrderedDict()
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            if text.lstrip().startswith("{"):
+                # 以前の形式（全体で 1 つの JSON オブジェクト）。次の保存で書き直す
+                entries = json.loads(text)
+                self._rewrite_needed = True
+            else:
+                entries = {}
+                lines = text.splitlines()
+                for number, line in enumerate(lines, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        message_key, seen_at = json.loads(line)
+                    except ValueError:
+                        if number == len(lines):
+                            # 追記の途中で停止した最後の行
+                            logger.warning(f"処理済みメールの索引の途中までの行を読み飛ばします: {self.path}")
+                            self._rewrite_needed = True
+                            continue
+                        raise
+                    entries.setdefault(message_key, seen_at)
+                    self.records += 1
+            logger.info(f"{len(entries)} 件の処理済みメールを読み込みました")
+            return OrderedDict(sorted(entries.items(), key=lambda item: item[1]))
+        except Exception as e:
+            logger.error(f"処理済みメールの索引の読み込みに失敗: {e}")
+            raise
+
+    def __contains__(self, message_key: str) -> bool:
+        return message_key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, message_key: str, now: Optional[float] = None) -> None:
+        if message_key in self.entries:
+            return
+        self.entries[message_key] = now if now is not None else time.time()
+        self._pending.append((message_key, self.entries[message_key]))
+        self._evict(self.entries[message_key])
+
+    def _evict(self, now: float) -> None:
+        entries = self.entries
+        while entries:
+            seen_at = next(iter(entries.values()))
+            if len(entries) <= self.max_entries and now - seen_at <= self.max_age:
+                break
+            entries.popitem(last=False)
+
+    def save(self) -> None:
+        self._evict(time.time())
+        try:
+            records = self.records + len(self._pending)
+            if self._rewrite_needed or records > max(len(self.entries) * self.COMPACT_RATIO, self.COMPACT_MIN_RECORDS):
+                self._rewrite()
+            elif self._pending:
+                # 保存までの間に削除された分も追記する（読み込み時に古い順に削除する）
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write("".join(_line(message_key, seen_at) for message_key, seen_at in self._pending))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.records += len(self._pending)
+            self._pending = []
+        except Exception as e:
+            logger.error(f"処理済みメールの索引の保存に失敗: {e}")
+            raise
+
+    def _rewrite(self) -> None:
+        """現在の索引だけのファイルを一時ファイルに書いてから置き換える"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write("".join(_line(message_key, seen_at) for message_key, seen_at in self.entries.items()))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.records = len(self.entries)
+        self._rewrite_needed = False
+
+
+def _line(message_key: str, seen_at: float) -> str:
+    return json.dumps([message_key, seen_at], ensure_ascii=False, separators=(",", ":")) + "\n"
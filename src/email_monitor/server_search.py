@@ -0,0 +1,128 @@
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .metrics import add_time
+
+logger = logging.getLogger("ServerSearch")
+
+CLIENT = "client"
+SERVER = "server"
+
+DEFAULT_FIELDS = ["SUBJECT", "BODY"]
+
+
+def choose_strategy(config: Dict, keys: Iterable[str], message_count: int) -> str:
+    """
+    照合方式を決める
+
+    match_strategy が "auto" の場合、キーが少なく対象メールが多いときだけ
+    サーバー側 SEARCH で候補を絞り込む。
+    """
+    strategy = config.get("match_strategy", "auto")
+    if strategy in (CLIENT, SERVER):
+        return strategy
+    keys = list(keys)
+    if not keys or "" in keys:
+        # 空のキーは全メールに一致するため絞り込めない
+        return CLIENT
+    if len(keys) <= config.get("server_search_max_keys", 20) and \
+            message_count >= config.get("server_search_min_messages", 500):
+        return SERVER
+    return CLIENT
+
+
+class _SearchCommand:
+    """
+    UID SEARCH の引数。ASCII のキーは引用符付き文字列、それ以外はリテラルで送る
+
+    render() はリテラルの位置で区切ったテキスト片とリテラルの列を返す。
+    """
+
+    def __init__(self, base: str):
+        self.base = base
+        self.terms: List[Tuple[str, List[bytes]]] = []
+        self.size = len(base)
+
+    def add(self, key: str, fields: List[str]) -> None:
+        """fields（SUBJECT / BODY / FROM / HEADER <名前>）のいずれかにキーを含む条件を加える"""
+        if key.isascii() and "\r" not in key and "\n" not in key:
+            quoted = '"' + key.replace("\\", "\\\\").replace('"', '\\"') + '"'
+            items = [f"{field} {quoted}" for field in fields]
+            literals = []
+        else:
+            data = key.encode('utf-8')
+            items = [f"{field} {{{len(data)}}}\0" for field in fields]
+            literals = [data] * len(fields)
+        term = items[-1]
+        for item in reversed(items[:-1]):
+            term = f"OR {item} {term}"
+        self.terms.append((f"({term})", literals))
+        self.size += len(term) + sum(len(data) + 20 for data in literals) + 2
+
+    def render(self) -> Tuple[List[str], List[bytes]]:
+        """(リテラルで区切ったテキスト片, リテラル) を返す"""
+        # OR は 2 項演算子なので "OR t1 OR t2 t3" のように前置で連結する
+        expr = self.terms[-1][0]
+        for term, _ in reversed(self.terms[:-1]):
+            expr = f"OR {term} {expr}"
+        text = f"CHARSET UTF-8 {self.base} ({expr})"
+        literals = [data for _, items in self.terms for data in items]
+        return text.split("\0"), literals
+
+
+def build_search_commands(keys: List[str], base: str, max_command_bytes: int,
+                          fields: Optional[Dict[str, List[str]]] = None) -> List[_SearchCommand]:
+    """
+    キーを OR SUBJECT ... BODY ... の条件にまとめ、コマンド長が上限を超えないように分割する
+
+    fields でキーごとの検索項目を指定できる（既定は SUBJECT と BODY）。
+    """
+    commands: List[_SearchCommand] = []
+    current = _SearchCommand(base)
+    for key in keys:
+        if current.terms and current.size > max_command_bytes:
+            commands.append(current)
+            current = _SearchCommand(base)
+        current.add(key, (fields or {}).get(key) or DEFAULT_FIELDS)
+    if current.terms:
+        commands.append(current)
+    return commands
+
+
+def server_search_uids(mail, keys: List[str], base: str, config: Dict, stats: Dict,
+                       fields: Optional[Dict[str, List[str]]] = None) -> Set[int]:
+    """サーバー側 SEARCH でいずれかのキーを照合範囲（既定は件名か本文）に含むメールの UID を返す"""
+    max_command_bytes = config.get("server_search_max_command_bytes", 4000)
+    candidates: Set[int] = set()
+    for command in build_search_commands(keys, base, max_command_bytes, fields):
+        texts, literals = command.render()
+        candidates.update(_uid_search(mail, stats, texts, literals))
+    return candidates
+
+
+class _LiteralSender:
+    """
+    imaplib は 1 コマンドに 1 つのリテラルしか送れないため、literal にメソッドを渡し、
+    継続応答 ("+") を受けるたびに次のリテラルと後続の文字列を送らせる
+    （imaplib は literal がバウンドメソッドの場合だけこの動作をする）
+    """
+
+    def __init__(self, literals: List[bytes], tails: List[str]):
+        self.pending = list(zip(literals, tails))
+
+    def next_literal(self, _continuation) -> bytes:
+        literal, tail = self.pending.pop(0)
+        return literal + tail.encode('ascii')
+
+
+def _uid_search(mail, stats: Dict, texts: List[str], literals: List[bytes]) -> List[int]:
+    if literals:
+        mail.literal = _LiteralSender(literals, texts[1:]).next_literal
+    started = time.perf_counter()
+    typ, data = mail.uid('search', None, texts[0])
+    add_time(stats, "search", started)
+    stats["search_commands"] = stats.get("search_commands", 0) + 1
+    if typ != 'OK':
+        raise mail.error(f"UID SEARCH に失敗: {data}")
+    return [int(uid) for uid in data[0].split()]
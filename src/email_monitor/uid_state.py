@@ -0,0 +1,75 @@
+import json
+import os
+import logging
+from typing import Dict, Optional
+
+from .key_store import atomic_write_json
+
+logger = logging.getLogger("UidState")
+
+class UidState:
+    """
+    フォルダごとの UIDVALIDITY と処理済みの最大 UID を保存する
+
+    走査の前に STATUS で取得した値（status）も保存し、次のチェックで STATUS の結果が
+    同じなら走査を省略する（folder_precheck）。
+    """
+
+    def __init__(self, state_path: str = "state.json"):
+        self.state_path = state_path
+        self.folders = self._load_state()
+
+    def _load_state(self) -> Dict:
+        if not os.path.exists(self.state_path):
+            return {}
+
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            logger.info(f"{len(state)} 個のフォルダの UID 状態を読み込みました")
+            return state
+        except Exception as e:
+            logger.error(f"UID 状態ファイルの読み込みに失敗: {e}")
+            raise
+
+    def save(self) -> None:
+        try:
+            atomic_write_json(self.state_path, self.folders)
+        except Exception as e:
+            logger.error(f"UID 状態の保存に失敗: {e}")
+            raise
+
+    @staticmethod
+    def folder_id(config: Dict, folder: str) -> str:
+        return f"{config['email']}@{config['imap_server']}/{folder}"
+
+    def get_watermark(self, folder_id: str, uidvalidity: Optional[int]) -> Optional[int]:
+        """UIDVALIDITY が一致する場合のみ、処理済みの最大 UID を返す"""
+        state = self.folders.get(folder_id)
+        if state is None or uidvalidity is None:
+            return None
+        if state["uidvalidity"] != uidvalidity:
+            logger.warning(f"{folder_id} の UIDVALIDITY が変化しました ({state['uidvalidity']} -> {uidvalidity})")
+            return None
+        return state["last_uid"]
+
+    def status_unchanged(self, folder_id: str, status: Dict[str, int]) -> bool:
+        """STATUS の結果が前回走査したときと同じか（同じなら新着は無い）"""
+        state = self.folders.get(folder_id)
+        return state is not None and state.get("status") == status
+
+    def update(self, folder_id: str, uidvalidity: Optional[int], last_uid: Optional[int],
+               status: Optional[Dict[str, int]] = None) -> None:
+        """
+        status は走査の前に取得した STATUS の結果（走査が最後まで終わった場合だけ渡す）
+
+        last_uid が None（空のフォルダなど位置が決まらない場合）は何も保存しない。
+        """
+        if uidvalidity is None or last_uid is None:
+            return
+        self.folders[folder_id] = {
+            "uidvalidity": uidvalidity,
+            "last_uid": last_uid
+        }
+        if status is not None:
+            self.folders[folder_id]["status"] = status
@@ -0,0 +1,16 @@
+import logging
+from typing import Optional
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def setup_logging(level: int = logging.INFO, log_file: Optional[str] = None) -> None:
+    """
+    ロギング設定
+
+    log_file を指定した場合はファイルにも出力する（最初に書き込むまでファイルは開かない）。
+    """
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8', delay=True))
+    logging.basicConfig(level=level, format=LOG_FORMAT, handlers=handlers)
@@ -0,0 +1,67 @@
+"""
+テスト共通のフィクスチャ
+
+IMAP サーバーと通知先は benchmarks/ のローカルサーバー（fake_imap / fake_sinks）を使う。
+設定ファイルなどは一時ディレクトリに書き、カレントディレクトリもそこに移す。
+"""
+import email.utils
+import json
+import time
+from email.mime.text import MIMEText
+
+import pytest
+
+from fake_imap import FakeImapServer, FakeMailbox
+
+
+def make_message(subject: str, body: str = "本文") -> bytes:
+    message = MIMEText(body, "plain", "utf-8")
+    message["Subject"] = subject
+    message["From"] = "sender@example.com"
+    message["Date"] = email.utils.formatdate(localtime=True)
+    message["Message-ID"] = email.utils.make_msgid()
+    return message.as_bytes()
+
+
+def wait_until(predicate, timeout: float = 5.0, interval: float = 0.02) -> bool:
+    """predicate が真になるまで待つ（timeout 秒で諦めて False を返す）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return bool(predicate())
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def inbox():
+    return FakeMailbox("INBOX")
+
+
+@pytest.fixture
+def imap_server(inbox):
+    server = FakeImapServer({"INBOX": inbox}).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def write_config(workdir, imap_server):
+    """ローカル IMAP サーバーに接続する config.json と keys.json を書く"""
+    def write(keys, **overrides):
+        host, port = imap_server.address
+        config = {"imap_server": host, "imap_port": port, "imap_ssl": False, "email": "user",
+                  "password": "pass", "folder": "INBOX", "check_interval": 60, "message_cache_max_bytes": 0}
+        config.update(overrides)
+        with open(workdir / "config.json", "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        with open(workdir / "keys.json", "w", encoding="utf-8") as f:
+            json.dump({key: {"description": "", "expected_frequency": "daily", "last_received": None}
+                       for key in keys}, f)
+    return write
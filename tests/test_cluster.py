@@ -0,0 +1,88 @@
+import datetime
+import time
+
+import pytest
+
+from conftest import make_message
+from email_monitor.cluster import IMAP, Coordinator, LeaseStore, Worker
+from email_monitor.config_manager import ConfigManager
+from email_monitor.monitor import EmailMonitor
+
+
+def _scan(last_uid, detections=()):
+    now = datetime.datetime.now()
+    return {"uidvalidity": 1, "last_uid": last_uid, "status": None,
+            "message_keys": [message_key for _, message_key in detections],
+            "detections": [(key, now, "件名", message_key) for key, message_key in detections]}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LeaseStore(str(tmp_path / "cluster.db"))
+    store.sync_items([("INBOX", IMAP, 60)], {})
+    yield store
+    store.close()
+
+
+def test_lease_is_exclusive_until_it_expires(store):
+    now = time.time()
+    item = store.claim("a", 30, now)
+    assert item["item_id"] == "INBOX"
+    assert store.claim("b", 30, now + 29) is None
+
+    taken = store.claim("b", 30, now + 31)
+    assert taken["item_id"] == "INBOX"
+    assert taken["token"] == item["token"] + 1
+
+
+def test_expired_worker_cannot_renew_or_complete(store):
+    now = time.time()
+    stale = store.claim("a", 30, now)
+    taken = store.claim("b", 30, now + 31)
+
+    assert not store.renew(stale, "a", 30)
+    assert store.complete(stale, "a", _scan(10, [("K", "<1@x>")]), now + 60) is None
+    assert store.pending_detections() == []
+
+    assert store.complete(taken, "b", _scan(5, [("K", "<1@x>")]), now + 60) == 1
+    assert [row[1] for row in store.pending_detections()] == ["K"]
+    item = store.claim("c", 30, now + 120)
+    assert item["last_uid"] == 5
+
+
+def test_message_seen_in_another_folder_is_recorded_once(store):
+    store.sync_items([("INBOX", IMAP, 60), ("Archive", IMAP, 60)], {})
+    now = time.time()
+    for worker in ("a", "b"):
+        item = store.claim(worker, 30, now)
+        store.complete(item, worker, _scan(1, [("K", "<same@x>")]), now + 60)
+    assert len(store.pending_detections()) == 1
+
+
+def test_worker_takes_over_an_expired_lease(write_config, inbox):
+    write_config(["請求書"], cluster_path="cluster.db", lease_seconds=0.2)
+    inbox.append(make_message("今月の請求書"))
+    monitor = EmailMonitor(ConfigManager())
+    coordinator = Coordinator(monitor)
+    coordinator.sync()
+
+    # リースを取得したまま停止したワーカー
+    crashed = LeaseStore("cluster.db")
+    assert crashed.claim("crashed", 0.2) is not None
+    crashed.close()
+    worker = Worker(EmailMonitor(ConfigManager()), "survivor")
+    try:
+        assert not worker.run_once()
+        time.sleep(0.3)
+        assert worker.run_once()
+    finally:
+        worker.monitor.close()
+        worker.store.close()
+
+    assert coordinator.merge() == 1
+    assert monitor.config_manager.keys["請求書"]["last_received"] is not None
+    status = coordinator.store.status()
+    assert status["items"][0]["owner"] is None
+    assert status["items"][0]["last_uid"] == 1
+    monitor.close()
+    coordinator.store.close()
@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+from email_monitor.config_manager import ConfigManager
+from email_monitor.history import MAGIC, Detection, DetectionLog, History
+from email_monitor.key_store import JsonKeyStore, KeyChanges
+
+
+def _entries(count, subject="件名"):
+    return [Detection(1767225600.0 + i, f"{subject} {i}") for i in range(count)]
+
+
+def test_history_keeps_the_newest_entries_in_order():
+    history = History(3, _entries(5))
+    assert [entry.subject for entry in history] == ["件名 2", "件名 3", "件名 4"]
+    assert history.last().subject == "件名 4"
+    assert len(history) == 3
+    assert History(3).last() is None
+
+
+def test_history_without_capacity_is_unbounded():
+    assert len(History(0, _entries(50))) == 50
+
+
+def test_detection_round_trips_through_iso_dates():
+    entry = Detection.from_iso("2026-01-01T09:00:00", "件名")
+    assert entry.date == "2026-01-01T09:00:00"
+    assert entry.to_dict() == {"date": "2026-01-01T09:00:00", "subject": "件名"}
+
+
+def test_log_replays_appends_and_tombstones(tmp_path):
+    log = DetectionLog(str(tmp_path / "keys.history"))
+    entries = _entries(4)
+    log.append([], [("A", entries[0]), ("B", entries[1])])
+    # 消去レコードより前の A の履歴は捨て、後の履歴だけを残す
+    log.append(["A"], [("A", entries[2]), ("B", entries[3])])
+
+    histories = DetectionLog(log.path).load(10)
+    assert list(histories["A"]) == [entries[2]]
+    assert list(histories["B"]) == [entries[1], entries[3]]
+    assert log.records == 5
+
+
+def test_log_truncates_a_torn_tail(tmp_path):
+    log = DetectionLog(str(tmp_path / "keys.history"))
+    entries = _entries(3, "長い件名" * 10)
+    log.append([], [("A", entry) for entry in entries])
+    with open(log.path, "rb") as f:
+        data = f.read()
+    with open(log.path, "wb") as f:
+        f.write(data[:-5])
+
+    reloaded = DetectionLog(log.path)
+    assert list(reloaded.load(10)["A"]) == entries[:2]
+    assert reloaded.records == 2
+    # 切り詰めた後ろに追記したレコードも読める
+    reloaded.append([], [("A", entries[2])])
+    assert list(DetectionLog(log.path).load(10)["A"]) == entries
+
+
+def test_log_stops_at_a_corrupted_record(tmp_path):
+    log = DetectionLog(str(tmp_path / "keys.history"))
+    entries = _entries(3)
+    log.append([], [("A", entry) for entry in entries])
+    with open(log.path, "r+b") as f:
+        # 2 件目の件名の 1 バイトを書き換える（CRC が合わなくなる）
+        data = f.read()
+        position = data.index("件名 1".encode("utf-8"))
+        f.seek(position)
+        f.write(b"X")
+
+    assert list(DetectionLog(log.path).load(10)["A"]) == entries[:1]
+
+
+def test_log_rejects_unknown_files(tmp_path):
+    path = tmp_path / "keys.history"
+    path.write_bytes(b"not a log")
+    with pytest.raises(ValueError):
+        DetectionLog(str(path)).load(10)
+
+
+def test_rewrite_keeps_only_current_history(tmp_path):
+    log = DetectionLog(str(tmp_path / "keys.history"))
+    log.append([], [("A", entry) for entry in _entries(20)])
+    log.append(["B"], [])
+    histories = log.load(5)
+    log.rewrite(histories)
+
+    assert log.records == 5
+    assert open(log.path, "rb").read().startswith(MAGIC)
+    assert [entry.subject for entry in DetectionLog(log.path).load(5)["A"]] == [f"件名 {i}" for i in range(15, 20)]
+
+
+def test_json_store_compacts_the_log_on_save(tmp_path, monkeypatch):
+    monkeypatch.setattr(DetectionLog, "COMPACT_MIN_RECORDS", 10)
+    store = JsonKeyStore(str(tmp_path / "keys.json"), history_limit=3)
+    keys = store.load()
+    keys["A"] = {"description": "", "expected_frequency": "daily", "last_received": None, "history": History(3)}
+    for entry in _entries(12):
+        changes = KeyChanges()
+        keys["A"]["history"].append(entry)
+        changes.add_history("A", entry)
+        store.save(keys, changes)
+
+    # 12 件追記した時点で現在の 3 件だけに書き直される
+    assert store.log.records <= 10
+    reloaded = JsonKeyStore(store.path, history_limit=3).load()
+    assert [entry.subject for entry in reloaded["A"]["history"]] == ["件名 9", "件名 10", "件名 11"]
+
+
+def test_compact_history_keeps_detections_saved_by_another_process(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open("config.json", "w", encoding="utf-8") as f:
+        json.dump({"email": "user", "password": "pass"}, f)
+    with open("keys.json", "w", encoding="utf-8") as f:
+        json.dump({"K": {"description": "", "expected_frequency": "daily", "last_received": None}}, f)
+    compactor, daemon = ConfigManager(), ConfigManager()
+    daemon.record_detection("K", "2026-01-01T09:00:00", "デーモンの検出")
+    daemon.save_keys()
+    compactor.record_detection("K", "2026-01-02T09:00:00", "未保存の検出")
+
+    compactor.compact_history()
+    # 書き直した後の保存で同じ検出を追記し直さない
+    compactor.save_keys()
+
+    reloaded = ConfigManager()
+    assert [entry.subject for entry in reloaded.keys["K"]["history"]] == ["デーモンの検出", "未保存の検出"]
+    assert reloaded.store.log.records == 2
@@ -0,0 +1,82 @@
+import logging
+import threading
+
+import pytest
+
+from conftest import make_message, wait_until
+from email_monitor import monitor as monitor_module
+from email_monitor.config_manager import ConfigManager
+from email_monitor.monitor import EmailMonitor
+
+
+@pytest.fixture
+def idle_daemon(monkeypatch):
+    """
+    run_idle_daemon をスレッドで動かす
+
+    IDLE は短い間隔で出し直し、テストの終わりに KeyboardInterrupt で止める。
+    before_idle に関数を入れると、次の IDLE の直前に 1 回だけ呼ぶ。
+    """
+    stop = threading.Event()
+    hooks = []
+    real_idle_wait = monitor_module.idle_wait
+
+    def idle_wait(mail, timeout):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        while hooks:
+            hooks.pop(0)()
+        return real_idle_wait(mail, min(timeout, 0.2))
+
+    monkeypatch.setattr(monitor_module, "idle_wait", idle_wait)
+    threads = []
+
+    def start(before_idle=None):
+        if before_idle is not None:
+            hooks.append(before_idle)
+        monitor = EmailMonitor(ConfigManager())
+        thread = threading.Thread(target=monitor.run_idle_daemon, daemon=True)
+        thread.start()
+        threads.append(thread)
+        return monitor
+
+    yield start
+    stop.set()
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive()
+
+
+def test_idle_wakes_up_on_new_message(write_config, inbox, imap_server, idle_daemon):
+    write_config(["請求書"], idle=True)
+    monitor = idle_daemon()
+    assert wait_until(lambda: imap_server.stats.snapshot()["commands"].get("IDLE", 0) > 0)
+
+    inbox.append(make_message("今月の請求書"))
+
+    assert wait_until(lambda: monitor.config_manager.keys["請求書"]["last_received"] is not None)
+
+
+def test_idle_wake_up_uses_keys_added_by_another_process(write_config, inbox, imap_server, idle_daemon):
+    write_config(["請求書"], idle=True)
+
+    def add_key_and_deliver():
+        # 別のプロセスがキーを追加した直後、次の reload より前に該当するメールが届く
+        other = ConfigManager()
+        other.add_key("領収書")
+        other.save_keys()
+        inbox.append(make_message("領収書の送付"))
+
+    monitor = idle_daemon(before_idle=add_key_and_deliver)
+
+    assert wait_until(lambda: (monitor.config_manager.keys.get("領収書") or {}).get("last_received") is not None)
+
+
+def test_idle_logs_unchanged_missing_keys_once(write_config, imap_server, idle_daemon, caplog):
+    write_config(["請求書"], idle=True, reload_interval=0.1)
+    caplog.set_level(logging.WARNING)
+    idle_daemon()
+
+    assert wait_until(lambda: imap_server.stats.snapshot()["commands"].get("IDLE", 0) >= 5)
+    warnings = [record for record in caplog.records if "未着メール検出" in record.getMessage()]
+    assert len(warnings) == 1
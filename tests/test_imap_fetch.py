@@ -0,0 +1,74 @@
+from email_monitor.imap_fetch import (chunk_uids_by_size, compress_uids, find_text_part, get_header_fields,
+                                     get_section, parse_fetch_response, part_size)
+
+
+def test_compress_uids():
+    assert compress_uids([5, 1, 2, 3, 3, 7, 8]) == "1:3,5,7:8"
+    assert compress_uids([]) == ""
+
+
+def test_parse_literals_in_imaplib_format():
+    # imaplib はリテラルを (直前の行, リテラル本体) のタプルで返す
+    data = [
+        (b'1 (UID 101 RFC822.SIZE 42 BODY[HEADER.FIELDS (SUBJECT DATE)] {19}', b"Subject: (a) \"b\"\r\n\r\n"),
+        b' FLAGS (\\Seen))',
+        (b'2 (UID 102 BODY[HEADER.FIELDS (SUBJECT DATE)] {4}', b"\r\n\r\n"),
+        b')',
+    ]
+    messages = parse_fetch_response(data)
+
+    assert set(messages) == {101, 102}
+    assert messages[101]["RFC822.SIZE"] == "42"
+    assert get_header_fields(messages[101]) == b"Subject: (a) \"b\"\r\n\r\n"
+    assert messages[101]["FLAGS"] == ["\\Seen"]
+    assert get_header_fields(messages[102]) == b"\r\n\r\n"
+
+
+def test_parse_quoted_strings_nil_and_nested_lists():
+    data = [b'3 (UID 7 BODYSTRUCTURE ("TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL "BASE64" 1200 16 NIL NIL NIL)'
+            b' ENVELOPE ("a \\"quoted\\" (subject)" NIL))']
+    attrs = parse_fetch_response(data)[7]
+
+    assert attrs["BODYSTRUCTURE"] == ["TEXT", "PLAIN", ["CHARSET", "UTF-8"], None, None, "BASE64", "1200", "16",
+                                      None, None, None]
+    assert attrs["ENVELOPE"] == ['a "quoted" (subject)', None]
+
+
+def test_fetch_responses_without_uid_are_ignored():
+    data = [b'4 (FLAGS (\\Seen))', b'5 (UID 9 FLAGS ())']
+    assert list(parse_fetch_response(data)) == [9]
+
+
+def test_get_section_accepts_partial_origin():
+    attrs = parse_fetch_response([(b'1 (UID 1 BODY[1.2]<0> {3}', b"abc"), b')'])[1]
+    assert get_section(attrs, "1.2") == b"abc"
+    assert get_section(attrs, "1") is None
+
+
+MULTIPART = [
+    ["TEXT", "HTML", ["CHARSET", "UTF-8"], None, None, "QUOTED-PRINTABLE", "300", "10", None, None, None],
+    ["TEXT", "PLAIN", ["CHARSET", "ISO-2022-JP"], None, None, "7BIT", "120", "4", None, None, None],
+    ["APPLICATION", "PDF", ["NAME", "a.pdf"], None, None, "BASE64", "90000", None, ["ATTACHMENT", None], None],
+    "MIXED", ["BOUNDARY", "x"], None, None,
+]
+
+
+def test_find_text_part_in_multipart():
+    assert find_text_part(MULTIPART) == ("2", "7BIT", "ISO-2022-JP")
+    assert part_size(MULTIPART, "2") == 120
+    assert part_size(MULTIPART, "3") == 90000
+    assert part_size(MULTIPART, "4") is None
+
+
+def test_find_text_part_skips_attachments():
+    attachment = ["TEXT", "PLAIN", ["CHARSET", "UTF-8"], None, None, "BASE64", "10", "1", None,
+                  ["ATTACHMENT", ["FILENAME", "a.txt"]], None]
+    assert find_text_part([attachment, "MIXED"]) is None
+    assert find_text_part(None) is None
+
+
+def test_chunk_uids_by_size():
+    sizes = {1: 40, 2: 40, 3: 40, 4: 500, 5: 10}
+    assert list(chunk_uids_by_size([5, 4, 3, 2, 1], sizes, 10, 100)) == [
+        ([1, 2], 80), ([3], 40), ([4], 500), ([5], 10)]
+    assert list(chunk_uids_by_size([1, 2, 3], sizes, 2, 1000)) == [([1, 2], 80), ([3], 40)]
@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+from email_monitor.matcher import KeyMatcher, ScopedMatcher
+
+
+@pytest.mark.parametrize("linear_scan_max_keys", [0, 1000])
+def test_overlapping_keys(linear_scan_max_keys):
+    matcher = KeyMatcher(["he", "she", "his", "hers", "請求", "請求書"], linear_scan_max_keys)
+    assert matcher.linear == (linear_scan_max_keys > 0)
+    assert matcher.find("ushers") == {"he", "she", "hers"}
+    assert matcher.find("今月の請求書です") == {"請求", "請求書"}
+    assert matcher.find("nothing") == set()
+
+
+def test_empty_key_always_matches():
+    assert KeyMatcher(["", "abc"], 0).find("xyz") == {""}
+
+
+def test_automaton_agrees_with_substring_search():
+    rng = random.Random(0)
+    alphabet = "abcあい"
+    keys = {"".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(60)}
+    matcher = KeyMatcher(keys, linear_scan_max_keys=0)
+    for _ in range(200):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        assert matcher.find(text) == {key for key in keys if key in text}
+
+
+KEYS = {
+    "請求書": {},
+    "障害": {"scope": "subject"},
+    "billing@example.com": {"scope": "from"},
+    "Mailer-1": {"scope": "header:X-Mailer"},
+    "本文だけ": {"scope": "body"},
+    "件名か差出人": {"scope": ["subject", "from"]},
+}
+
+
+def test_scoped_matcher_matches_each_scope():
+    matcher = ScopedMatcher(KEYS)
+    # 照合範囲は小文字にそろえる
+    assert sorted(matcher.header_names) == ["from", "subject", "x-mailer"]
+    assert matcher.body_keys == {"請求書", "本文だけ"}
+
+    found = matcher.match_headers({"subject": "障害と請求書", "from": "billing@example.com",
+                                   "x-mailer": "Mailer-1.0"})
+    assert found == {"障害", "請求書", "billing@example.com", "Mailer-1"}
+    # 件名で一致しても、本文だけを対象とするキーが残っていれば本文が必要
+    assert matcher.needs_body(found)
+    assert matcher.match_body("本文だけにある 障害", found) == found | {"本文だけ"}
+    assert not matcher.needs_body(found | {"本文だけ"})
+
+
+def test_body_scoped_key_does_not_match_subject():
+    matcher = ScopedMatcher({"本文だけ": {"scope": "body"}})
+    assert matcher.match_headers({"subject": "本文だけ"}) == set()
+    assert matcher.match_text("本文だけ", "") == set()
+    assert matcher.match_text("", "本文だけ") == {"本文だけ"}
+
+
+def test_unknown_scope_falls_back_to_subject_and_body():
+    matcher = ScopedMatcher({"K": {"scope": "unknown"}})
+    assert matcher.search_fields["K"] == ["SUBJECT", "BODY"]
+    assert matcher.match_text("K", "") == {"K"}
+
+
+def test_search_fields():
+    matcher = ScopedMatcher(KEYS)
+    assert matcher.search_fields["件名か差出人"] == ["SUBJECT", "FROM"]
+    assert matcher.search_fields["Mailer-1"] == ["HEADER x-mailer"]
+
+
+def test_unchanged_scopes_are_reused():
+    previous = ScopedMatcher(KEYS)
+    keys = dict(KEYS, 新しい件名={"scope": "subject"})
+    matcher = ScopedMatcher(keys, previous)
+
+    assert matcher.header_matchers["from"] is previous.header_matchers["from"]
+    assert matcher.body_matcher is previous.body_matcher
+    assert matcher.header_matchers["subject"] is not previous.header_matchers["subject"]
+    assert matcher.match_headers({"subject": "新しい件名"}) == {"新しい件名"}
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+from conftest import wait_until
+from email_monitor.notifier import DETECTED, MISSING, Notifier
+from fake_sinks import FakeSmtpServer, FakeWebhookServer
+
+
+@pytest.fixture
+def webhook():
+    server = FakeWebhookServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def smtp():
+    server = FakeSmtpServer().start()
+    yield server
+    server.stop()
+
+
+def _notifier(server, repeat_hours=24, **sink_config):
+    config = dict(server.sink_config(), retry_base=0.01, **sink_config)
+    return Notifier({"notifications": [config], "notify_repeat_hours": repeat_hours})
+
+
+def test_failed_sends_are_retried(webhook):
+    webhook.fail_first = 2
+    notifier = _notifier(webhook)
+    notifier.missing({"請求書": "未受信"})
+    notifier.close(5)
+
+    assert webhook.attempts == 3
+    assert [batch["missing"] for batch in webhook.received] == [{"請求書": "未受信"}]
+    assert notifier.workers[0].sent == 1
+
+
+def test_gives_up_after_retries(webhook):
+    webhook.fail_first = 10
+    notifier = _notifier(webhook, retries=2)
+    notifier.detected("請求書", "2026-01-01T00:00:00", "今月の請求書")
+    notifier.close(5)
+
+    assert webhook.attempts == 3
+    assert webhook.received == []
+    assert notifier.workers[0].failed == 1
+
+
+def test_missing_key_is_notified_once_until_it_arrives(smtp):
+    notifier = _notifier(smtp)
+    notifier.missing({"請求書": "未受信"}, now=0)
+    notifier.flush()
+    notifier.missing({"請求書": "1日間未受信"}, now=3600)
+    notifier.flush()
+    assert wait_until(lambda: len(smtp.received) == 1)
+
+    # 届いた後に再び期限を過ぎたら改めて通知する
+    notifier.missing({}, now=7200)
+    notifier.missing({"請求書": "未受信"}, now=10800)
+    notifier.close(5)
+    assert len(smtp.received) == 2
+
+
+def test_missing_key_is_notified_again_after_repeat_hours(webhook):
+    notifier = _notifier(webhook, repeat_hours=1)
+    notifier.missing({"請求書": "未受信"}, now=0)
+    notifier.flush()
+    assert wait_until(lambda: len(webhook.received) == 1)
+    notifier.missing({"請求書": "未受信"}, now=1800)
+    notifier.flush()
+    notifier.missing({"請求書": "1日間未受信"}, now=3600)
+    notifier.close(5)
+
+    assert [batch["missing"] for batch in webhook.received] == [{"請求書": "未受信"}, {"請求書": "1日間未受信"}]
+
+
+def test_batches_over_the_rate_are_merged(webhook):
+    notifier = _notifier(webhook, rate_per_minute=120)
+    worker = notifier.workers[0]
+    # バケットを空にしておき、最初の送信でトークンを待たせる
+    worker.tokens = 0.0
+    worker.refilled = time.monotonic()
+    started = time.monotonic()
+    for number in range(3):
+        notifier.detected("請求書", "2026-01-01T00:00:00", f"請求書 {number}")
+        notifier.flush()
+    notifier.close(5)
+
+    assert time.monotonic() - started >= 0.4
+    assert len(webhook.received) == 1
+    assert [entry["subject"] for entry in webhook.received[0]["detected"]] == ["請求書 0", "請求書 1", "請求書 2"]
+
+
+@pytest.mark.parametrize("rate", [0, None])
+def test_zero_rate_is_unlimited(webhook, rate):
+    notifier = _notifier(webhook, rate_per_minute=rate)
+    for number in range(3):
+        notifier.detected("請求書", "2026-01-01T00:00:00", f"請求書 {number}")
+        notifier.flush()
+    notifier.close(5)
+
+    assert sum(len(batch["detected"]) for batch in webhook.received) == 3
+    assert notifier.workers[0].failed == 0
+
+
+def test_nothing_is_sent_without_notifications():
+    notifier = Notifier({})
+    notifier.missing({"請求書": "未受信"})
+    notifier.flush()
+    assert not notifier.enabled
+    assert notifier._pending == {MISSING: {}, DETECTED: []}
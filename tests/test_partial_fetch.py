@@ -0,0 +1,43 @@
+import email.utils
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from email_monitor import monitor as monitor_module
+from email_monitor.config_manager import ConfigManager
+from email_monitor.monitor import EmailMonitor
+
+
+def _multipart(subject, body):
+    message = MIMEMultipart()
+    message.attach(MIMEText(body, "plain", "utf-8"))
+    message["Subject"] = subject
+    message["Date"] = email.utils.formatdate(localtime=True)
+    message["Message-ID"] = email.utils.make_msgid()
+    return message.as_bytes()
+
+
+def test_partial_bodies_are_fetched_within_the_byte_budget(write_config, inbox, monkeypatch):
+    budget = 400 * 1024
+    for number in range(10):
+        inbox.append(_multipart(f"お知らせ {number}", f"番号 {number} " + "あ" * 40000))
+    write_config(["番号 9"], fetch_mode="partial", max_inflight_bytes=budget)
+
+    fetched = []
+    real_fetch_sections = monitor_module.fetch_sections
+
+    def fetch_sections(*args, **kwargs):
+        bodies = real_fetch_sections(*args, **kwargs)
+        fetched.append(sum(len(body) for body in bodies.values()))
+        return bodies
+
+    monkeypatch.setattr(monitor_module, "fetch_sections", fetch_sections)
+    monitor = EmailMonitor(ConfigManager())
+    try:
+        assert monitor.check_emails() == {"番号 9": True}
+    finally:
+        monitor.close()
+
+    # 本文（約 160KB）は取得の前に予算の半分ずつに分けて確保する
+    assert len(fetched) > 1
+    assert max(fetched) <= budget // 2
+    assert monitor.last_cycle_stats["peak_inflight_bytes"] <= budget
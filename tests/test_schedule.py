@@ -0,0 +1,115 @@
+import datetime
+
+import pytest
+
+from email_monitor.schedule import (DayOfMonthSchedule, DeadlineIndex, IntervalSchedule, WeekdaySchedule,
+                                    parse_received, parse_schedule)
+
+
+def _dt(*args):
+    return datetime.datetime(*args)
+
+
+def test_named_frequencies_keep_one_day_of_grace():
+    schedule = parse_schedule("daily")
+    assert isinstance(schedule, IntervalSchedule)
+    assert schedule.deadline(_dt(2026, 1, 1, 9)) == _dt(2026, 1, 3, 9)
+    assert schedule.expected(_dt(2026, 1, 1, 9)) == _dt(2026, 1, 2, 9)
+    assert parse_schedule(" Weekly ").deadline(_dt(2026, 1, 1)) == _dt(2026, 1, 9)
+
+
+def test_every_interval():
+    assert parse_schedule("every:6h").deadline(_dt(2026, 1, 1, 9)) == _dt(2026, 1, 1, 15)
+    assert parse_schedule("every:90m").deadline(_dt(2026, 1, 1, 9)) == _dt(2026, 1, 1, 10, 30)
+    assert parse_schedule("every:2w").deadline(_dt(2026, 1, 1)) == _dt(2026, 1, 15)
+
+
+@pytest.mark.parametrize("spec", [None, "", "hourly", "every:6x", "dom:0", "dom:32", "dom:10-5", "dom:x"])
+def test_unknown_frequencies_are_not_monitored(spec):
+    assert parse_schedule(spec) is None
+
+
+def test_weekdays_skip_the_weekend():
+    schedule = parse_schedule("weekdays")
+    assert isinstance(schedule, WeekdaySchedule)
+    # 2026-01-02 は金曜。次の平日は 5 日（月）で、その日の終わりが期限
+    assert schedule.deadline(_dt(2026, 1, 2, 18)) == _dt(2026, 1, 6)
+    assert schedule.expected(_dt(2026, 1, 2, 18)) == _dt(2026, 1, 5, 18)
+    assert schedule.deadline(_dt(2026, 1, 5, 9)) == _dt(2026, 1, 7)
+
+
+@pytest.mark.parametrize("field, days", [
+    ("1,15", {1, 15}),
+    ("1-5", {1, 2, 3, 4, 5}),
+    ("*/10", {1, 11, 21, 31}),
+    ("5/10", {5, 15, 25}),
+    ("1-10/3", {1, 4, 7, 10}),
+])
+def test_day_of_month_fields(field, days):
+    assert DayOfMonthSchedule(field).days == days
+
+
+def test_day_of_month_deadline():
+    schedule = parse_schedule("dom:1,15")
+    assert schedule.deadline(_dt(2026, 1, 1, 9)) == _dt(2026, 1, 16)
+    assert schedule.deadline(_dt(2026, 1, 15, 9)) == _dt(2026, 2, 2)
+    # 31 日の無い月は飛ばす
+    assert parse_schedule("dom:31").deadline(_dt(2026, 1, 31)) == _dt(2026, 4, 1)
+
+
+def test_day_of_month_last_day():
+    schedule = parse_schedule("dom:L")
+    assert schedule.deadline(_dt(2026, 1, 31, 9)) == _dt(2026, 3, 1)
+    assert schedule.deadline(_dt(2028, 1, 31, 9)) == _dt(2028, 3, 1)
+    assert schedule.deadline(_dt(2028, 2, 1, 9)) == _dt(2028, 3, 1)
+
+
+def test_parse_received_converts_aware_times_to_local():
+    aware = datetime.datetime(2026, 1, 1, 0, 0, tzinfo=datetime.timezone.utc)
+    assert parse_received(aware.isoformat()) == aware.astimezone().replace(tzinfo=None)
+    assert parse_received("2026-01-01T09:00:00") == _dt(2026, 1, 1, 9)
+
+
+def _key(last_received, frequency="every:1h"):
+    return {"expected_frequency": frequency, "last_received": last_received}
+
+
+def test_deadline_index_orders_overdue_keys():
+    index = DeadlineIndex()
+    index.rebuild({
+        "never": _key(None),
+        "early": _key("2026-01-01T00:00:00"),
+        "late": _key("2026-01-01T01:00:00"),
+        "unknown": _key("2026-01-01T00:00:00", "hourly"),
+    })
+    at = _dt(2026, 1, 1, 1, 30).timestamp()
+    assert index.overdue(at) == ["never", "early"]
+    assert index.next_deadline(at) == _dt(2026, 1, 1, 2).timestamp()
+    # 取り出しても索引は変わらない
+    assert index.overdue(at) == ["never", "early"]
+
+
+def test_deadline_index_update_replaces_the_old_deadline():
+    index = DeadlineIndex()
+    index.rebuild({"K": _key("2026-01-01T00:00:00")})
+    at = _dt(2026, 1, 1, 1, 30).timestamp()
+    assert index.overdue(at) == ["K"]
+
+    index.update("K", _key("2026-01-01T01:00:00"))
+    assert index.overdue(at) == []
+    assert index.next_deadline(at) == _dt(2026, 1, 1, 2).timestamp()
+
+    index.update("K", _key("2026-01-01T01:00:00", "daily"))
+    assert index.next_deadline(at) == _dt(2026, 1, 3, 1).timestamp()
+
+    index.remove("K")
+    assert index.overdue(float("inf")) == []
+    assert index.next_deadline(at) is None
+
+
+def test_deadline_index_heap_stays_bounded():
+    index = DeadlineIndex()
+    for minute in range(1000):
+        index.update("K", _key(f"2026-01-01T00:{minute // 60:02d}:{minute % 60:02d}"))
+    assert len(index._heap) <= 2 * 1 + 64 + 1
+    assert index.overdue(_dt(2026, 1, 2).timestamp()) == ["K"]
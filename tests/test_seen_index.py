@@ -0,0 +1,62 @@
+import json
+
+from email_monitor.seen_index import SeenIndex
+
+
+def _lines(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def test_save_appends_only_new_entries(tmp_path):
+    path = str(tmp_path / "seen.json")
+    index = SeenIndex(path, max_age_days=1e9)
+    index.add("<1@x>", 100.0)
+    index.add("<2@x>", 200.0)
+    index.save()
+    index.add("<2@x>", 300.0)
+    index.add("<3@x>", 300.0)
+    index.save()
+    index.save()
+
+    assert _lines(path) == ['["<1@x>",100.0]', '["<2@x>",200.0]', '["<3@x>",300.0]']
+    assert list(SeenIndex(path, max_age_days=1e9).entries.items()) == [("<1@x>", 100.0), ("<2@x>", 200.0),
+                                                                       ("<3@x>", 300.0)]
+
+
+def test_evicted_entries_are_dropped_on_load_and_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(SeenIndex, "COMPACT_MIN_RECORDS", 4)
+    path = str(tmp_path / "seen.json")
+    index = SeenIndex(path, max_entries=2, max_age_days=1e9)
+    for number in range(4):
+        index.add(f"<{number}@x>", float(number))
+        index.save()
+    assert list(SeenIndex(path, max_entries=2, max_age_days=1e9).entries) == ["<2@x>", "<3@x>"]
+
+    index.add("<4@x>", 4.0)
+    index.save()
+    assert _lines(path) == ['["<3@x>",3.0]', '["<4@x>",4.0]']
+
+
+def test_legacy_file_and_torn_line_are_rewritten(tmp_path):
+    path = str(tmp_path / "seen.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"<old@x>": 100.0}, f, indent=4)
+    index = SeenIndex(path, max_age_days=1e9)
+    assert "<old@x>" in index
+    index.save()
+    assert _lines(path) == ['["<old@x>",100.0]']
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('["<torn@x>",2')
+    index = SeenIndex(path, max_age_days=1e9)
+    assert list(index.entries) == ["<old@x>"]
+    index.save()
+    assert _lines(path) == ['["<old@x>",100.0]']
+
+
+def test_message_key_falls_back_to_a_hash():
+    assert SeenIndex.message_key(" <id@x> ", None, None, None) == "<id@x>"
+    key = SeenIndex.message_key(None, "Thu, 1 Jan 2026 09:00:00 +0900", "a@example.com", "件名")
+    assert key.startswith("sha1:")
+    assert key == SeenIndex.message_key("", "Thu, 1 Jan 2026 09:00:00 +0900", "a@example.com", "件名")